@@ -1,16 +1,19 @@
-import asyncio
-from telegram_api.bot import start_bot
-from telegram_api.database import Database
+import sys
 from config import Config
 
-# Initialize database
-try:
-    db = Database()
-    print(f"🔌 Connected to database at: {Config.DATABASE_URL}")
-except Exception as e:
-    print(f"❌ Failed to connect to database: {e}")
-    raise
+def run_health_checks():
+    """Check the database and OpenAI connections. Makes a real (billed) API call."""
+    from telegram_api.bot import get_db
+    from llm.config import test_openai_api
+
+    get_db()
+    test_openai_api()
 
 if __name__ == '__main__':
-    # Run bot using asyncio.run() to avoid deprecation warning
-    asyncio.run(start_bot())
+    # Health checks are opt-in so restarts don't wait on (or pay for) them
+    if '--check' in sys.argv or Config.STARTUP_HEALTH_CHECK:
+        run_health_checks()
+
+    from telegram_api.bot import start_bot
+    # run_polling inside start_bot manages its own event loop
+    start_bot()
@@ -0,0 +1,445 @@
+# Local stand-ins for the OpenAI, ElevenLabs and Telegram HTTP APIs, plus the
+# part of the S3 API the audio store uses.
+#
+# One server answers all of them, with per-vendor latency distributions, error
+# rates and payload sizes, so the pipeline can be benchmarked with no network:
+#
+#   python benchmarks/fakes.py --port 8765 --openai-latency 2 --tts-latency 1.5
+#
+# then point the bot at it with
+#
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+#   ELEVENLABS_BASE_URL=http://127.0.0.1:8765
+#   TELEGRAM_BASE_URL=http://127.0.0.1:8765/bot
+#   AUDIO_STORE=s3 S3_BUCKET=audio S3_ENDPOINT_URL=http://127.0.0.1:8765 (any AWS credentials)
+#
+# Every Telegram call is recorded and can be read back from GET /_events.
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MP3 = os.path.join(ROOT, 'example', 'test.mp3')
+
+SENTENCES = [
+    "Octopuses can change the color and texture of their skin in the blink of an eye.",
+    "Elephants remember the paths to water holes for decades.",
+    "Some birds navigate by sensing the magnetic field of the Earth.",
+    "Honey bees tell each other where flowers are with a dance.",
+    "Crows recognise human faces and remember the ones that were unkind to them.",
+]
+
+
+def add_fake_arguments(parser):
+    """Options of the fakes, shared with the benchmarks that start them."""
+    group = parser.add_argument_group('fake services')
+    for vendor, latency, sigma in (('openai', 2.0, 0.4), ('tts', 1.0, 0.3), ('telegram', 0.1, 0.3), ('s3', 0.02, 0.3)):
+        group.add_argument(f'--{vendor}-latency', type=float, default=latency,
+                           help=f"median {vendor} latency in seconds (log-normal)")
+        group.add_argument(f'--{vendor}-sigma', type=float, default=sigma,
+                           help=f"spread of the {vendor} latency distribution")
+        group.add_argument(f'--{vendor}-error-rate', type=float, default=0.0,
+                           help=f"fraction of {vendor} calls answered with a 500")
+        group.add_argument(f'--{vendor}-throttle-rate', type=float, default=0.0,
+                           help=f"fraction of {vendor} calls answered with a 429")
+    group.add_argument('--script-chars', type=int, default=3000, help="length of generated scripts")
+    group.add_argument('--openai-tokens-per-second', type=float, default=0,
+                       help="speed the fake OpenAI writes its answers at, 0 for instantly")
+    group.add_argument('--openai-cache-min-tokens', type=int, default=1024,
+                       help="shortest prompt prefix the fake OpenAI caches, like the real one")
+    group.add_argument('--tts-bytes-per-char', type=int, default=60,
+                       help="MP3 bytes returned per character of text (about 16 kB/s of speech at 128 kbps)")
+    group.add_argument('--tts-bandwidth', type=float, default=2000, help="TTS download speed in kB/s")
+    group.add_argument('--mp3', default=DEFAULT_MP3, help="MP3 file the TTS audio is cut from")
+    return parser
+
+
+def script(chars):
+    """SSML of roughly chars characters, in paragraphs like the real scripts."""
+    paragraphs, size = [], 0
+    while size < chars:
+        sentences = random.sample(SENTENCES, 3)
+        paragraph = f"<p>{' '.join(sentences)}</p>"
+        paragraphs.append(paragraph)
+        size += len(paragraph)
+    return "<speak>\n" + "\n".join(paragraphs) + "\n</speak>"
+
+
+class FakeServices:
+    def __init__(self, args):
+        self.args = args
+        with open(args.mp3, 'rb') as mp3_file:
+            self.mp3 = mp3_file.read()
+        self.events = []
+        # Called with every recorded Telegram event, from the server's threads
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._message_ids = iter(range(1, 10 ** 9))
+        self._file_ids = iter(range(1, 10 ** 9))
+        # S3: (bucket, key) -> (body, content type, last modified, ETag), and upload id -> {part number: body}
+        self.objects = {}
+        self.uploads = {}
+        self._upload_ids = iter(range(1, 10 ** 9))
+        # OpenAI: system prompts seen so far, the prefixes its prompt cache would hold
+        self.prompt_prefixes = set()
+
+    def latency(self, vendor):
+        median = getattr(self.args, f'{vendor}_latency')
+        sigma = getattr(self.args, f'{vendor}_sigma')
+        return random.lognormvariate(0, sigma) * median if median > 0 else 0
+
+    def failure(self, vendor):
+        """429, 500 or None, drawn from the vendor's error rates."""
+        draw = random.random()
+        throttle = getattr(self.args, f'{vendor}_throttle_rate')
+        if draw < throttle:
+            return 429
+        if draw < throttle + getattr(self.args, f'{vendor}_error_rate'):
+            return 500
+        return None
+
+    def record(self, event):
+        with self._lock:
+            event['time'] = time.time()
+            self.events.append(event)
+        for listener in self.listeners:
+            listener(event)
+
+    def cached_prompt_tokens(self, messages):
+        """
+        Tokens of the request's system prompt the fake OpenAI "has cached": all of it,
+        in steps of 128 like OpenAI, when the same system prompt was sent before.
+        """
+        if not messages or messages[0].get('role') != 'system':
+            return 0
+        prefix = messages[0].get('content') or ''
+        tokens = len(prefix) // 4
+        with self._lock:
+            seen = prefix in self.prompt_prefixes
+            self.prompt_prefixes.add(prefix)
+        if not seen or tokens < self.args.openai_cache_min_tokens:
+            return 0
+        return tokens // 128 * 128
+
+    def create_upload(self):
+        with self._lock:
+            upload_id = str(next(self._upload_ids))
+            self.uploads[upload_id] = {}
+        return upload_id
+
+    def put_object(self, bucket, key, content, content_type, parts=None):
+        """Store an object and return its ETag, which like S3's is the MD5 with a part count for multipart uploads."""
+        etag = f'"{hashlib.md5(content).hexdigest()}{f"-{parts}" if parts else ""}"'
+        with self._lock:
+            # Last-Modified has a resolution of a second
+            self.objects[(bucket, key)] = (content, content_type, int(time.time()), etag)
+        return etag
+
+    def message(self, chat_id, **extra):
+        with self._lock:
+            message_id = next(self._message_ids)
+        return dict(message_id=message_id, date=int(time.time()), chat={'id': chat_id, 'type': 'private'}, **extra)
+
+    def audio(self, size):
+        with self._lock:
+            file_id = next(self._file_ids)
+        return {'file_id': f"fake-audio-{file_id}", 'file_unique_id': f"fake-{file_id}", 'duration': 60, 'file_size': size}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    services = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def is_s3(self):
+        return self.headers.get('Authorization', '').startswith('AWS4-HMAC-SHA256')
+
+    def do_HEAD(self):
+        self.s3('HEAD', b'')
+
+    def do_PUT(self):
+        self.s3('PUT', self.read_body())
+
+    def do_DELETE(self):
+        self.s3('DELETE', self.read_body())
+
+    def do_GET(self):
+        if self.is_s3():
+            self.s3('GET', b'')
+        elif self.path.startswith('/_events'):
+            with self.services._lock:
+                events = list(self.services.events)
+            self.send_json(200, events)
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.is_s3():
+            self.s3('POST', body)
+        elif self.path.endswith('/chat/completions'):
+            self.chat_completion(body)
+        elif '/text-to-speech/' in self.path:
+            self.text_to_speech(body)
+        elif re.match(r'^/bot[^/]+/\w+$', self.path):
+            self.telegram(self.path.rsplit('/', 1)[1], body)
+        elif self.path == '/_reset':
+            with self.services._lock:
+                self.services.events.clear()
+            self.send_json(200, {'ok': True})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def fail(self, status, vendor):
+        if vendor == 'telegram':
+            payload = {'ok': False, 'error_code': status, 'description': 'Fake failure'}
+            if status == 429:
+                payload['parameters'] = {'retry_after': 1}
+            self.send_json(status, payload)
+        else:
+            self.send_json(status, {'error': {'message': 'Fake failure'}}, headers={'retry-after-ms': '500'} if status == 429 else None)
+
+    def chat_completion(self, body):
+        time.sleep(self.services.latency('openai'))
+        status = self.services.failure('openai')
+        if status:
+            return self.fail(status, 'openai')
+        request = json.loads(body)
+        prompt_chars = sum(len(message.get('content') or '') for message in request.get('messages', []))
+        cached_tokens = self.services.cached_prompt_tokens(request.get('messages', []))
+        content = script(self.services.args.script_chars)
+        usage = {
+            'prompt_tokens': prompt_chars // 4,
+            'completion_tokens': len(content) // 4,
+            'total_tokens': prompt_chars // 4 + len(content) // 4,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        }
+        completion = {
+            'id': 'chatcmpl-fake',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+        }
+        tokens_per_second = self.services.args.openai_tokens_per_second
+        if request.get('stream'):
+            return self.stream_completion(completion, content, usage, tokens_per_second)
+        if tokens_per_second:
+            time.sleep(len(content) / 4 / tokens_per_second)
+        self.send_json(200, {
+            **completion,
+            'object': 'chat.completion',
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': usage,
+        })
+
+    def stream_completion(self, completion, content, usage, tokens_per_second):
+        """Server-sent events of a few tokens each, ending with the usage like with stream_options.include_usage."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(choices, **extra):
+            chunk = {**completion, 'object': 'chat.completion.chunk', 'choices': choices, **extra}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        step = 16  # characters, about 4 tokens
+        for start in range(0, len(content), step):
+            if tokens_per_second:
+                time.sleep(step / 4 / tokens_per_second)
+            event([{'index': 0, 'delta': {'content': content[start:start + step]}, 'finish_reason': None}])
+        event([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        event([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def text_to_speech(self, body):
+        args = self.services.args
+        time.sleep(self.services.latency('tts'))
+        status = self.services.failure('tts')
+        if status:
+            return self.fail(status, 'tts')
+        text = json.loads(body).get('text', '')
+        mp3 = self.services.mp3
+        size = min(len(mp3), max(4096, len(text) * args.tts_bytes_per_char))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk_size = 16 * 1024
+        for offset in range(0, size, chunk_size):
+            chunk = mp3[offset:min(size, offset + chunk_size)]
+            self.wfile.write(chunk)
+            if args.tts_bandwidth > 0:
+                time.sleep(len(chunk) / 1024 / args.tts_bandwidth)
+
+    def telegram(self, method, body):
+        time.sleep(self.services.latency('telegram'))
+        status = self.services.failure('telegram')
+        if status:
+            return self.fail(status, 'telegram')
+
+        fields = self.form_fields(body)
+        chat_id = int(fields.get('chat_id') or 0)
+        event = {'method': method, 'chat_id': chat_id, 'bytes': len(body)}
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Lisa', 'username': 'fake_podcast_bot'}
+        elif method == 'sendAudio':
+            event['upload'] = b'filename=' in body
+            event['title'] = fields.get('title', '')
+            result = self.services.message(chat_id, audio=self.services.audio(len(body)))
+        elif method == 'sendMessage':
+            event['text'] = fields.get('text', '')
+            event['reply_markup'] = bool(fields.get('reply_markup'))
+            result = self.services.message(chat_id, text=fields.get('text', ''))
+        elif method == 'sendChatAction':
+            event['action'] = fields.get('action', '')
+            result = True
+        elif method in ('deleteWebhook', 'setWebhook', 'answerCallbackQuery', 'deleteMessage'):
+            result = True
+        else:
+            result = self.services.message(chat_id)
+        self.services.record(event)
+        self.send_json(200, {'ok': True, 'result': result})
+
+    def send_xml(self, status, xml, headers=None):
+        body = f'<?xml version="1.0" encoding="UTF-8"?>\n{xml}'.encode('utf-8') if xml else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def s3(self, method, body):
+        """Path-style S3: objects, multipart uploads and server-side copies."""
+        time.sleep(self.services.latency('s3'))
+        status = self.services.failure('s3')
+        if status:
+            code = 'SlowDown' if status == 429 else 'InternalError'
+            return self.send_xml(503 if status == 429 else 500, f"<Error><Code>{code}</Code></Error>")
+
+        services = self.services
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        query = {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        copy_source = self.headers.get('x-amz-copy-source')
+
+        if method == 'POST' and 'uploads' in query:
+            upload_id = services.create_upload()
+            return self.send_xml(200, f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                                      f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        if 'uploadId' in query and query['uploadId'] not in services.uploads:
+            return self.send_xml(404, "<Error><Code>NoSuchUpload</Code></Error>")
+        if method == 'PUT' and 'uploadId' in query:
+            with services._lock:
+                services.uploads[query['uploadId']][int(query['partNumber'])] = body
+            return self.send_xml(200, "", headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+        if method == 'POST' and 'uploadId' in query:
+            with services._lock:
+                parts = services.uploads.pop(query['uploadId'])
+            content = b''.join(parts[number] for number in sorted(parts))
+            etag = services.put_object(bucket, key, content, 'audio/mpeg', parts=len(parts))
+            return self.send_xml(200, f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                                      f"<ETag>{etag}</ETag></CompleteMultipartUploadResult>")
+        if method == 'DELETE':
+            with services._lock:
+                if 'uploadId' in query:
+                    services.uploads.pop(query['uploadId'], None)
+                else:
+                    services.objects.pop((bucket, key), None)
+            return self.send_xml(204, "")
+        if method == 'PUT' and copy_source:
+            source_bucket, _, source_key = unquote(copy_source).lstrip('/').partition('/')
+            with services._lock:
+                source = services.objects.get((source_bucket, source_key))
+            if source is None:
+                return self.send_xml(404, "<Error><Code>NoSuchKey</Code></Error>")
+            etag = services.put_object(bucket, key, source[0], self.headers.get('Content-Type') or source[1])
+            return self.send_xml(200, f"<CopyObjectResult><ETag>{etag}</ETag></CopyObjectResult>")
+        if method == 'PUT':
+            etag = services.put_object(bucket, key, body, self.headers.get('Content-Type', 'binary/octet-stream'))
+            return self.send_xml(200, "", headers={'ETag': etag})
+
+        with services._lock:
+            stored = services.objects.get((bucket, key))
+        if stored is None:
+            return self.send_xml(404, "<Error><Code>NoSuchKey</Code></Error>")
+        content, content_type, last_modified, etag = stored
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(last_modified, usegmt=True))
+        self.end_headers()
+        if method == 'GET':
+            self.wfile.write(content)
+
+    def form_fields(self, body):
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        if content_type.startswith('multipart/form-data'):
+            # Only the small text fields are needed, not the uploaded file
+            fields = {}
+            for name, value in re.findall(rb'name="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--', body, re.DOTALL):
+                if len(value) < 4096:
+                    fields[name.decode()] = value.decode('utf-8', 'replace')
+            return fields
+        from urllib.parse import parse_qsl
+        return dict(parse_qsl(body.decode('utf-8', 'replace')))
+
+
+def serve(args, port, host='127.0.0.1'):
+    """Start the fakes on a background thread and return the server."""
+    Handler.services = FakeServices(args)
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fakes", daemon=True).start()
+    return server
+
+
+def main():
+    parser = add_fake_arguments(argparse.ArgumentParser(description="Fake OpenAI, ElevenLabs and Telegram APIs"))
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args()
+    server = serve(args, args.port, args.host)
+    print(f"Fake services listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
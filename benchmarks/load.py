@@ -0,0 +1,331 @@
+# Load test of the bot's conversation flow with many concurrent users, against the
+# fake Telegram of fakes.py. No network needed.
+#
+# Simulated users arrive at --arrival-rate a second and go through
+# /start -> Create New Podcast -> topic -> language -> Yes, then press Next Episode
+# after every delivery, with log-normal think times in between. Their updates go
+# through the real Application and ConversationHandler from build_application().
+# Generation is stubbed with a sleep of --generation-time, or runs the real chains
+# against the fake vendors with --generation fakes.
+#
+# Reported separately:
+#   handler latency     update queued -> all handlers done, per step
+#   generation latency  Yes / Next Episode queued -> episode delivered
+#   event loop lag      how late a 50 ms timer fires, i.e. starvation of the event loop
+#
+#   python benchmarks/load.py --users 200 --arrival-rate 20 --think-time 2 --generation-time 30
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from fakes import add_fake_arguments, serve
+from pipeline import configure_environment, percentile
+
+LOOP_LAG_INTERVAL = 0.05
+
+
+def lognormal(median, sigma):
+    return random.lognormvariate(0, sigma) * median if median > 0 else 0
+
+
+def stats(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+def stub_chains(args):
+    """Generation chains that sleep instead of calling the vendors, then write a slice of the test MP3."""
+    from llm.audio_store import episode_path, get_audio_store
+
+    with open(args.mp3, 'rb') as mp3_file:
+        audio = mp3_file.read()[:args.audio_kb * 1024]
+
+    def generate(user_id, *names, on_audio=None):
+        time.sleep(lognormal(args.generation_time, args.generation_sigma))
+        if random.random() < args.generation_error_rate:
+            raise RuntimeError("Stubbed generation failure")
+        for name in names:
+            with get_audio_store().writer(episode_path(user_id, name)) as episode_file:
+                episode_file.write(audio)
+            if on_audio and name == "first_episode.mp3":
+                on_audio("intro", episode_path(user_id, name))
+
+    def stub_initial_chain(topic, language, user_id, db, on_audio=None):
+        generate(user_id, "first_episode.mp3", "episode_1.mp3", on_audio=on_audio)
+
+    def stub_chain(topic, language, user_id, db, episode_number, on_audio=None):
+        generate(user_id, f"episode_{episode_number}.mp3")
+
+    return stub_initial_chain, stub_chain
+
+
+class LoadTest:
+    def __init__(self, args, application, services):
+        self.args = args
+        self.application = application
+        self.bot = application.bot
+        self.loop = asyncio.get_running_loop()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        # update_id -> future resolved when the last handler group is done with it
+        self.handled = {}
+        # chat_id -> future resolved when the episode arrives (or the bot gives up)
+        self.deliveries = {}
+        self.handler_latency = defaultdict(list)
+        self.generation_latency = []
+        self.loop_lag = []
+        self.max_update_queue = 0
+        self.completed_users = 0
+        self.errors = defaultdict(int)
+        services.listeners.append(self.on_telegram_event)
+
+    async def on_handled(self, update, context):
+        """Registered in the last handler group, so it runs after every other handler."""
+        handled = self.handled.pop(update.update_id, None)
+        if handled and not handled.done():
+            handled.set_result(time.monotonic())
+
+    def on_telegram_event(self, event):
+        """Called by the fake Telegram's threads for every API call."""
+        if event['method'] != 'sendMessage':
+            return
+        text = event.get('text', '')
+        if event.get('reply_markup') and 'enjoyed Episode' in text or 'last episode' in text:
+            outcome = 'delivered'
+        elif 'Sorry' in text:
+            outcome = 'failed'
+        elif 'still working' in text:
+            outcome = 'busy'
+        else:
+            return
+        self.loop.call_soon_threadsafe(self._resolve_delivery, event['chat_id'], outcome, event['time'])
+
+    def _resolve_delivery(self, chat_id, outcome, delivered):
+        delivery = self.deliveries.get(chat_id)
+        if delivery and not delivery.done():
+            delivery.set_result((outcome, delivered))
+
+    def user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}", 'username': f"user{user_id}"}
+
+    def message(self, user_id, sender, text=None):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'username': f"user{user_id}"},
+            'from': sender,
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    def text(self, user_id, text):
+        return {'message': self.message(user_id, self.user(user_id), text)}
+
+    def press(self, user_id, data):
+        """A press on one of the buttons of the bot's last message."""
+        bot_user = {'id': self.bot.id, 'is_bot': True, 'first_name': self.bot.first_name, 'username': self.bot.username}
+        message = self.message(user_id, bot_user, text="")
+        return {'callback_query': {
+            'id': f"{user_id}-{message['message_id']}",
+            'from': self.user(user_id),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data,
+        }}
+
+    async def step(self, name, payload):
+        """Queue an update like the updater would and wait until all handlers are done with it."""
+        from telegram import Update
+
+        update_id = next(self.update_ids)
+        handled = self.loop.create_future()
+        self.handled[update_id] = handled
+        queued = time.monotonic()
+        await self.application.update_queue.put(Update.de_json({'update_id': update_id, **payload}, self.bot))
+        try:
+            done = await asyncio.wait_for(handled, self.args.timeout)
+        except asyncio.TimeoutError:
+            self.handled.pop(update_id, None)
+            self.errors[f"{name} timed out"] += 1
+            return False
+        self.handler_latency[name].append(done - queued)
+        return True
+
+    async def think(self):
+        await asyncio.sleep(lognormal(self.args.think_time, self.args.think_sigma))
+
+    async def simulate_user(self, user_id):
+        for name, payload in (
+            ('start', lambda: self.text(user_id, '/start')),
+            ('create_podcast', lambda: self.press(user_id, 'create_podcast')),
+            ('topic', lambda: self.text(user_id, f"Animal facts {user_id}")),
+            ('language', lambda: self.press(user_id, 'lang_en')),
+        ):
+            if not await self.step(name, payload()):
+                return
+            await self.think()
+
+        for episode_number in range(1, self.args.episodes + 1):
+            name, data = ('confirm', 'confirm_yes') if episode_number == 1 else ('next_episode', 'next_episode')
+            delivery = self.deliveries[user_id] = self.loop.create_future()
+            requested = time.time()
+            try:
+                if not await self.step(name, self.press(user_id, data)):
+                    return
+                outcome, delivered = await asyncio.wait_for(delivery, self.args.timeout)
+            except asyncio.TimeoutError:
+                self.errors["generation timed out"] += 1
+                return
+            finally:
+                self.deliveries.pop(user_id, None)
+            if outcome != 'delivered':
+                self.errors[f"generation {outcome}"] += 1
+                return
+            self.generation_latency.append(delivered - requested)
+            await self.think()
+        self.completed_users += 1
+
+    async def monitor(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag.append(time.monotonic() - started - LOOP_LAG_INTERVAL)
+            self.max_update_queue = max(self.max_update_queue, self.application.update_queue.qsize())
+
+    async def run(self):
+        monitor = asyncio.create_task(self.monitor())
+        started = time.monotonic()
+        users = []
+        for index in range(self.args.users):
+            users.append(asyncio.create_task(self.simulate_user(100000 + index)))
+            if self.args.arrival_rate > 0:
+                await asyncio.sleep(random.expovariate(self.args.arrival_rate))
+        await asyncio.gather(*users)
+        elapsed = time.monotonic() - started
+        monitor.cancel()
+
+        all_steps = [latency for latencies in self.handler_latency.values() for latency in latencies]
+        return {
+            'users': self.args.users,
+            'completed_users': self.completed_users,
+            'elapsed': elapsed,
+            'handler_latency': {name: stats(latencies) for name, latencies in self.handler_latency.items()},
+            'handler_latency_all': stats(all_steps),
+            'generation_latency': stats(self.generation_latency),
+            'loop_lag': stats(self.loop_lag),
+            'max_update_queue': self.max_update_queue,
+            'errors': dict(self.errors),
+        }
+
+
+async def run_load(args, services):
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from config import Config
+    from telegram_api import bot as bot_module
+
+    if not args.verbose:
+        # One INFO line per update would dominate the event loop at a few hundred users
+        logging.getLogger().setLevel(logging.WARNING)
+
+    if args.generation == 'stub':
+        stub_initial_chain, stub_chain = stub_chains(args)
+        bot_module.start_initial_chain, bot_module.start_chain = stub_initial_chain, stub_chain
+        if Config.JOB_BACKEND == 'database':
+            from telegram_api import worker
+            worker.CHAINS.update(initial=stub_initial_chain, next=stub_chain)
+
+    application = bot_module.build_application()
+    test = LoadTest(args, application, services)
+    application.add_handler(TypeHandler(Update, test.on_handled), group=99)
+
+    async with application:
+        # run_polling would call these, the updates are queued by the test instead of the updater
+        await bot_module.post_init(application)
+        await application.start()
+        try:
+            return await test.run()
+        finally:
+            await application.stop()
+            await bot_module.post_shutdown(application)
+
+
+def print_report(report):
+    def seconds(value):
+        return f"{value:.3f}s" if value is not None else "-"
+
+    def row(name, values):
+        print(f"  {name:<16}{values['count']:>6}  p50 {seconds(values['p50']):>8}  p95 {seconds(values['p95']):>8}"
+              f"  p99 {seconds(values['p99']):>8}  max {seconds(values['max']):>8}")
+
+    print(f"\n{report['completed_users']}/{report['users']} users finished in {report['elapsed']:.1f}s")
+    print("handler latency (queued -> handled)")
+    for name, values in report['handler_latency'].items():
+        row(name, values)
+    row('all', report['handler_latency_all'])
+    print("generation latency (requested -> delivered)")
+    row('episodes', report['generation_latency'])
+    print("event loop")
+    row('lag', report['loop_lag'])
+    print(f"  max update queue {report['max_update_queue']}")
+    if report['errors']:
+        print("errors")
+        for name, count in sorted(report['errors'].items()):
+            print(f"  {name:<24}{count:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user load test of the bot's conversation flow")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--arrival-rate', type=float, default=5, help="new users a second (Poisson), 0 for all at once")
+    parser.add_argument('--think-time', type=float, default=2, help="median seconds a user takes between steps")
+    parser.add_argument('--think-sigma', type=float, default=0.5)
+    parser.add_argument('--episodes', type=int, default=2, choices=range(1, 6), help="episodes each user listens to")
+    parser.add_argument('--generation', choices=['stub', 'fakes'], default='stub',
+                        help="stub: sleep instead of generating, fakes: real chains against the fake vendors")
+    parser.add_argument('--generation-time', type=float, default=20, help="median seconds of a stubbed generation")
+    parser.add_argument('--generation-sigma', type=float, default=0.3)
+    parser.add_argument('--generation-error-rate', type=float, default=0.0)
+    parser.add_argument('--audio-kb', type=int, default=256, help="size of the stubbed episodes")
+    parser.add_argument('--concurrency', type=int, default=4, help="generation workers")
+    parser.add_argument('--timeout', type=float, default=900, help="seconds to wait for a handler or an episode")
+    parser.add_argument('--seed', type=int, help="seed for arrivals, think times and stubbed durations")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's INFO logs")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    server = serve(args, 0)
+    services = server.RequestHandlerClass.services
+    workdir = tempfile.mkdtemp(prefix='podcast_load_')
+    os.chdir(workdir)  # episodes and the SQLite database are written relative to the working directory
+    configure_environment(f"http://127.0.0.1:{server.server_address[1]}", args)
+
+    report = asyncio.run(run_load(args, services))
+    server.shutdown()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# End-to-end pipeline benchmark against local fakes (see fakes.py), no network needed.
+#
+# chain: runs start_initial_chain and start_chain for --podcasts podcasts,
+#        --concurrency at a time, the way the generation workers do.
+# bot:   calls send_podcast for every podcast at once and waits until the fake
+#        Telegram has received each episode, so queueing, delivery and uploads count too.
+#
+# Reports p50/p95/p99 latency, throughput and peak memory, and for bot how long
+# users wait for their first audio (earlier with PROGRESSIVE_DELIVERY):
+#
+#   python benchmarks/pipeline.py --scenario both --podcasts 8 --openai-latency 0.5 --tts-latency 0.3
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from fakes import add_fake_arguments, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = '123456:benchmark'
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(name, latencies, errors, elapsed, peak_bytes, first_audio=None):
+    return {
+        'scenario': name,
+        'completed': len(latencies),
+        'errors': errors,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput_per_min': len(latencies) / elapsed * 60 if elapsed else 0,
+        'elapsed': elapsed,
+        'peak_traced_mb': peak_bytes / 1024 / 1024 if peak_bytes is not None else None,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'first_audio_p50': percentile(first_audio, 50),
+        'first_audio_p95': percentile(first_audio, 95),
+    }
+
+
+def print_report(report):
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else "-"
+
+    print(f"\n== {report['scenario']} ==")
+    print(f"episodes   {report['completed']} done, {report['errors']} failed in {report['elapsed']:.1f}s")
+    print(f"latency    p50 {seconds(report['p50'])}  p95 {seconds(report['p95'])}  p99 {seconds(report['p99'])}")
+    if report['first_audio_p50'] is not None:
+        print(f"1st audio  p50 {seconds(report['first_audio_p50'])}  p95 {seconds(report['first_audio_p95'])}")
+    print(f"throughput {report['throughput_per_min']:.1f} episodes/min")
+    traced = f"{report['peak_traced_mb']:.1f} MB traced, " if report['peak_traced_mb'] is not None else ""
+    print(f"memory     {traced}{report['max_rss_mb']:.1f} MB max RSS")
+
+
+def configure_environment(base_url, args):
+    """Point every client at the fakes. Must run before the bot modules are imported."""
+    defaults = {
+        'ENV': 'development',
+        'TELEGRAM_BOT_TOKEN': TOKEN,
+        'OPENAI_API_KEY': 'fake',
+        'ELEVENLABS_API_KEY': 'fake',
+        'OPENAI_BASE_URL': f"{base_url}/v1",
+        'ELEVENLABS_BASE_URL': base_url,
+        'TELEGRAM_BASE_URL': f"{base_url}/bot",
+        'TELEGRAM_BASE_FILE_URL': f"{base_url}/file/bot",
+        'METRICS_PORT': '0',
+        # Every podcast must do the full amount of work
+        'TTS_CACHE_ENABLED': 'false',
+        'MEMO_ENABLED': 'false',
+        'PREFETCH_NEXT_EPISODE': 'false',
+        'GENERATION_WORKERS': str(args.concurrency),
+    }
+    if os.environ.get('AUDIO_STORE') == 's3':
+        # AUDIO_STORE=s3 benchmarks the bucket backend against the fake S3
+        defaults.update({
+            'S3_ENDPOINT_URL': base_url,
+            'S3_BUCKET': 'audio',
+            'AWS_ACCESS_KEY_ID': 'fake',
+            'AWS_SECRET_ACCESS_KEY': 'fake',
+            'S3_REGION': 'us-east-1',
+        })
+    for name, value in defaults.items():
+        # Explicit settings in the environment win, e.g. TTS_SEGMENTED=true
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, ROOT)
+
+
+def run_chains(args):
+    """Generate every podcast with the blocking chains, --concurrency at a time."""
+    from llm.llm import start_initial_chain, start_chain
+    from telegram_api.bot import get_db
+
+    db = get_db()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def podcast(user_id):
+        nonlocal errors
+        db.add_user(user_id)
+        topic = f"Animal facts {user_id}"
+        for episode_number in range(1, args.episodes + 1):
+            started = time.monotonic()
+            try:
+                if episode_number == 1:
+                    start_initial_chain(topic, 'en', user_id, db)
+                else:
+                    start_chain(topic, 'en', user_id, db, episode_number)
+            except Exception as e:
+                print(f"Podcast {user_id} episode {episode_number} failed: {e}")
+                with lock:
+                    errors += 1
+                return
+            with lock:
+                latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(podcast, range(1, args.podcasts + 1)))
+    return latencies, errors, time.monotonic() - started
+
+
+async def run_bot(args, services):
+    """Request every podcast through send_podcast and wait for the fake Telegram to receive them."""
+    from telegram import Bot, Message
+    from telegram_api import bot as bot_module
+    from telegram_api.jobs import generation_queue
+
+    user_ids = range(1001, 1001 + args.podcasts)
+    latencies, first_audio, errors = [], [], 0
+
+    async with Bot(TOKEN, base_url=os.environ['TELEGRAM_BASE_URL']) as bot:
+        generation_queue.start()
+        try:
+            for episode_number in range(1, args.episodes + 1):
+                requested = {}
+                for user_id in user_ids:
+                    message = Message.de_json({
+                        'message_id': 1, 'date': int(time.time()),
+                        'chat': {'id': user_id, 'type': 'private', 'username': f"user{user_id}"},
+                    }, bot)
+                    context = SimpleNamespace(bot=bot, user_data={})
+                    requested[user_id] = time.monotonic(), time.time()
+                    await bot_module.send_podcast(
+                        None, context, f"Animal facts {user_id}", 'en',
+                        message=message, episode_number=episode_number
+                    )
+
+                # An episode is delivered once the message after its audio arrives
+                pending = set(user_ids)
+                waiting_for_audio = set(user_ids)
+                deadline = time.monotonic() + args.timeout
+                while pending and time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+                    with services._lock:
+                        events = list(services.events)
+                    for event in events:
+                        user_id = event.get('chat_id')
+                        if user_id not in pending:
+                            continue
+                        started, started_wall = requested[user_id]
+                        if event['time'] < started_wall:
+                            continue
+                        if event['method'] in ('sendAudio', 'sendVoice'):
+                            if user_id in waiting_for_audio:
+                                first_audio.append(event['time'] - started_wall)
+                                waiting_for_audio.discard(user_id)
+                            continue
+                        if event['method'] != 'sendMessage':
+                            continue
+                        text = event.get('text', '')
+                        if event.get('reply_markup') or 'last episode' in text:
+                            latencies.append(event['time'] - started_wall)
+                            pending.discard(user_id)
+                        elif 'Sorry' in text:
+                            errors += 1
+                            pending.discard(user_id)
+                errors += len(pending)
+        finally:
+            await generation_queue.stop()
+            adb = bot_module._adb
+            if adb is not None:
+                await adb.close()
+
+    return latencies, first_audio, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the podcast pipeline")
+    parser.add_argument('--scenario', choices=['chain', 'bot', 'both'], default='both')
+    parser.add_argument('--podcasts', type=int, default=8)
+    parser.add_argument('--episodes', type=int, default=2, help="episodes per podcast, the first one includes the intro")
+    parser.add_argument('--concurrency', type=int, default=4, help="podcasts generated at the same time")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds to wait for the bot scenario's deliveries")
+    parser.add_argument('--trace-memory', action='store_true', help="also report the peak of Python allocations (slower)")
+    parser.add_argument('--json', action='store_true', help="print the reports as JSON")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(args, 0)
+    services = server.RequestHandlerClass.services
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    workdir = tempfile.mkdtemp(prefix='podcast_benchmark_')
+    os.chdir(workdir)  # episodes and the SQLite database are written relative to the working directory
+    configure_environment(base_url, args)
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    reports = []
+    if args.scenario in ('chain', 'both'):
+        latencies, errors, elapsed = run_chains(args)
+        peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+        reports.append(summarize('chain', latencies, errors, elapsed, peak))
+
+    if args.scenario in ('bot', 'both'):
+        if args.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.monotonic()
+        latencies, first_audio, errors = asyncio.run(run_bot(args, services))
+        peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+        reports.append(summarize('bot', latencies, errors, time.monotonic() - started, peak, first_audio))
+
+    server.shutdown()
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+        print(f"\nFiles written to {workdir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Startup-time benchmark.
+#
+# Measures how long a fresh interpreter takes to import the bot and build the
+# Application, i.e. everything that happens before polling begins, and checks
+# that the heavy SDKs are still loaded lazily. Exits with status 1 on a regression:
+#
+#   python benchmarks/startup.py --runs 5 --max-seconds 1.0
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# These must only be imported when they are first used
+LAZY_MODULES = ['openai', 'elevenlabs', 'sqlalchemy']
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from telegram_api.bot import build_application
+build_application()
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def measure_once(workdir):
+    """Run the probe in a new interpreter. Returns (import seconds, process seconds, eagerly loaded modules)."""
+    env = dict(os.environ)
+    env.setdefault('TELEGRAM_BOT_TOKEN', '123456:benchmark')
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True
+    )
+    process_seconds = time.perf_counter() - started
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report['seconds'], process_seconds, report['loaded']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=1.0,
+                        help="fail if the median time to a ready Application is above this")
+    args = parser.parse_args()
+
+    import_times, process_times, loaded = [], [], set()
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(args.runs):
+            import_seconds, process_seconds, eager = measure_once(workdir)
+            import_times.append(import_seconds)
+            process_times.append(process_seconds)
+            loaded.update(eager)
+
+    median = statistics.median(import_times)
+    print(f"Application ready in {median:.3f}s median (min {min(import_times):.3f}s, max {max(import_times):.3f}s)")
+    print(f"Whole process in {statistics.median(process_times):.3f}s median over {args.runs} runs")
+
+    failed = False
+    if loaded:
+        print(f"❌ Imported at startup, should be lazy: {', '.join(sorted(loaded))}")
+        failed = True
+    if median > args.max_seconds:
+        print(f"❌ Startup is slower than {args.max_seconds:.2f}s")
+        failed = True
+    if not failed:
+        print("✅ Startup within budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,12 @@ class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+
+    # API endpoints, only changed to point at local stand-ins (see benchmarks/fakes.py)
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # None uses the SDK default
+    ELEVENLABS_BASE_URL = os.getenv('ELEVENLABS_BASE_URL')
+    TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot')
+    TELEGRAM_BASE_FILE_URL = os.getenv('TELEGRAM_BASE_FILE_URL', 'https://api.telegram.org/file/bot')
     
     # Determine environment
     ENV = os.getenv('ENV', 'development')
@@ -29,6 +35,131 @@ class Config:
     STORAGE_PATH = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', '')
     EPISODES_DIR = os.path.join(STORAGE_PATH, 'llm', 'episodes')
 
+    # 'polling' for a single instance, or 'webhook' to run several replicas behind a load balancer
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public https URL of the service, without the path
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('PORT', '8443'))
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+
+    # Keep user data, conversation states and restrictions in the database instead of in memory,
+    # so any replica can handle any update
+    SHARED_STATE = os.getenv('SHARED_STATE', 'true' if BOT_MODE == 'webhook' else 'false').lower() == 'true'
+
+    # Number of podcast generations that can run at the same time
+    GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '4'))
+
+    # 'memory' runs generation jobs in this process. 'database' queues them in the generation_jobs
+    # table, where the workers of every bot and worker process (python -m telegram_api.worker) lease them
+    JOB_BACKEND = os.getenv('JOB_BACKEND', 'memory')
+    JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '600'))  # renewed while the job runs
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '2'))  # seconds between claims when idle
+
+    # Drop and recreate every table on start. Replicas starting one after another would wipe each other,
+    # and so would the bot and worker processes sharing the database job queue
+    DB_RESET_ON_START = os.getenv(
+        'DB_RESET_ON_START', 'false' if SHARED_STATE or JOB_BACKEND == 'database' else 'true'
+    ).lower() == 'true'
+
+    # Connection pools of the shared OpenAI and ElevenLabs clients
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20'))
+    HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_KEEPALIVE_CONNECTIONS', '10'))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))  # seconds
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '300'))
+
+    # Vendor quotas shared by every generation in the process (see llm/rate_limit.py).
+    # The concurrency limits are upper bounds, they shrink while the vendor answers 429. A rate or concurrency of 0 means no limit
+    OPENAI_REQUESTS_PER_MINUTE = float(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))
+    OPENAI_TOKENS_PER_MINUTE = float(os.getenv('OPENAI_TOKENS_PER_MINUTE', '200000'))
+    OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '16'))
+    ELEVENLABS_REQUESTS_PER_MINUTE = float(os.getenv('ELEVENLABS_REQUESTS_PER_MINUTE', '120'))
+    ELEVENLABS_CHARACTERS_PER_MINUTE = float(os.getenv('ELEVENLABS_CHARACTERS_PER_MINUTE', '100000'))
+    ELEVENLABS_MAX_CONCURRENCY = int(os.getenv('ELEVENLABS_MAX_CONCURRENCY', '5'))
+
+    # Retries of throttled, failed or timed out vendor calls
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '5'))
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '1'))  # seconds
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '60'))
+
+    # Synthesized audio is cached by content so identical text is only sent to ElevenLabs once
+    TTS_CACHE_ENABLED = os.getenv('TTS_CACHE_ENABLED', 'true').lower() == 'true'
+    TTS_CACHE_DIR = os.path.join(STORAGE_PATH, 'llm', 'tts_cache')
+    TTS_CACHE_MAX_BYTES = int(os.getenv('TTS_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+
+    # Split long scripts into segments that are synthesized in parallel
+    TTS_SEGMENTED = os.getenv('TTS_SEGMENTED', 'false').lower() == 'true'
+    TTS_SEGMENT_CHARS = int(os.getenv('TTS_SEGMENT_CHARS', '1000'))
+    TTS_SEGMENT_CONCURRENCY = int(os.getenv('TTS_SEGMENT_CONCURRENCY', '3'))
+
+    # Stream episode scripts from the LLM and synthesize them while they are being written, in chunks of
+    # whole sentences or paragraphs of at least TTS_STREAM_CHUNK_CHARS characters
+    LLM_STREAMING = os.getenv('LLM_STREAMING', 'false').lower() == 'true'
+    TTS_STREAM_CHUNK_CHARS = int(os.getenv('TTS_STREAM_CHUNK_CHARS', '400'))
+
+    # Send audio while the rest of the episode is still being generated: the intro as soon as it is
+    # synthesized and, with EPISODE_PART_CHARS, episodes in parts of at least that many characters
+    # (0 sends episodes whole). An upload_voice chat action shows the user more is on its way
+    PROGRESSIVE_DELIVERY = os.getenv('PROGRESSIVE_DELIVERY', 'false').lower() == 'true'
+    EPISODE_PART_CHARS = int(os.getenv('EPISODE_PART_CHARS', '0'))
+
+    # Reuse lineups (and optionally scripts) generated for the same topic and language
+    MEMO_ENABLED = os.getenv('MEMO_ENABLED', 'true').lower() == 'true'
+    MEMO_SCRIPTS = os.getenv('MEMO_SCRIPTS', 'false').lower() == 'true'
+    MEMO_TTL_HOURS = float(os.getenv('MEMO_TTL_HOURS', str(7 * 24)))
+
+    # How much of the previous episode's ending is passed to the next episode's prompt
+    CONTEXT_ENDING_CHARS = int(os.getenv('CONTEXT_ENDING_CHARS', '600'))
+
+    # Number of users whose current podcast is kept in memory (0 disables the cache)
+    # Off by default with shared state or the database job backend, as other replicas' and workers' writes
+    # don't reach this process' cache
+    SERIES_CACHE_SIZE = int(os.getenv('SERIES_CACHE_SIZE', '0' if SHARED_STATE or JOB_BACKEND == 'database' else '1024'))
+
+    # Connection pool of the async database engine used by the bot handlers
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # seconds
+
+    # Where episode audio is kept: 'local' disk, or 's3' for an S3-compatible bucket shared by every replica and
+    # worker. Credentials come from the usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY variables
+    AUDIO_STORE = os.getenv('AUDIO_STORE', 'local')
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # e.g. http://minio:9000, None for AWS
+    S3_REGION = os.getenv('S3_REGION')
+    S3_PART_SIZE = int(os.getenv('S3_PART_SIZE', str(8 * 1024 * 1024)))  # multipart upload part size, at least 5 MiB
+    S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', '4'))
+
+    # Episode audio on the volume. Files nothing refers to are swept every STORAGE_SWEEP_MINUTES (0 turns it off),
+    # and the least recently delivered ones are evicted while they take more than STORAGE_QUOTA_BYTES (0 for no quota)
+    STORAGE_QUOTA_BYTES = int(os.getenv('STORAGE_QUOTA_BYTES', '0'))
+    STORAGE_SWEEP_MINUTES = float(os.getenv('STORAGE_SWEEP_MINUTES', '60'))
+    STORAGE_GRACE_MINUTES = float(os.getenv('STORAGE_GRACE_MINUTES', '60'))  # younger files are never removed
+
+    # Send episodes as Opus voice messages instead of MP3 audio (needs ffmpeg with libopus)
+    VOICE_DELIVERY = os.getenv('VOICE_DELIVERY', 'false').lower() == 'true'
+    VOICE_BITRATE = os.getenv('VOICE_BITRATE', '48k')
+
+    # Port of the Prometheus /metrics endpoint served next to the bot and the workers (0 turns it off)
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+    # Check the database and OpenAI connections before starting the bot (see app.py --check)
+    STARTUP_HEALTH_CHECK = os.getenv('STARTUP_HEALTH_CHECK', 'false').lower() == 'true'
+
+    # Generate the next episode in the background as soon as one is delivered
+    PREFETCH_NEXT_EPISODE = os.getenv('PREFETCH_NEXT_EPISODE', 'false').lower() == 'true'
+    # Unclaimed prefetched episodes are deleted after this many hours
+    PREFETCH_TTL_HOURS = float(os.getenv('PREFETCH_TTL_HOURS', '48'))
+
+    # Nightly batch that generates the next episode of every active podcast
+    DAILY_BATCH_ENABLED = os.getenv('DAILY_BATCH_ENABLED', 'false').lower() == 'true'
+    DAILY_BATCH_START_HOUR = int(os.getenv('DAILY_BATCH_START_HOUR', '2'))  # UTC
+    DAILY_BATCH_WINDOW_HOURS = float(os.getenv('DAILY_BATCH_WINDOW_HOURS', '4'))
+    DAILY_BATCH_CONCURRENCY = int(os.getenv('DAILY_BATCH_CONCURRENCY', '2'))
+
     @staticmethod
     def init_app(app):
         # Create necessary directories
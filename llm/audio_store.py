@@ -0,0 +1,350 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Every user's episodes live in this directory, on the volume if there is one, like the TTS cache.
+# In a bucket the key is the same path without the volume's mount point
+EPISODES_ROOT = Config.EPISODES_DIR
+
+# Size and version of a stored file. mtime_ns changes whenever the content is replaced
+StoredAudio = namedtuple('StoredAudio', ['size', 'mtime_ns'])
+
+
+def episode_path(user_id, filename):
+    """Key of one of a user's audio files, e.g. llm/episodes/<user_id>/episode_1.mp3 without a volume."""
+    return os.path.join(EPISODES_ROOT, str(user_id), filename)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as audio_file:
+        for chunk in iter(lambda: audio_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalAudioStore:
+    """
+    Audio files on the local disk, the key being the path.
+    Every replica and worker has to share the disk.
+    """
+    local = True
+
+    @contextmanager
+    def writer(self, key):
+        """
+        File-like object to write the audio for key to. The chunks go to a
+        temporary file that is renamed into place once the with block completes,
+        so readers never see a partial file.
+        """
+        os.makedirs(os.path.dirname(key) or '.', exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(key) or '.', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as audio_file:
+                yield audio_file
+            os.replace(tmp_path, key)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def publish(self, key):
+        """Make the local file at key available to every replica. Already the case on a shared disk."""
+
+    def stat(self, key):
+        try:
+            stat = os.stat(key)
+        except FileNotFoundError:
+            return None
+        return StoredAudio(stat.st_size, stat.st_mtime_ns)
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def local_copy(self, key):
+        """Path of a local file with the audio for key."""
+        return key
+
+    def open(self, key):
+        return open(key, 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(key)
+        except FileNotFoundError:
+            pass
+
+
+# Parts of S3 multipart uploads are sent from these threads while the audio is still being written
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+
+def _get_upload_executor():
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(max_workers=Config.S3_UPLOAD_CONCURRENCY, thread_name_prefix="s3-upload")
+        return _upload_executor
+
+
+def _content_type(key):
+    return 'audio/ogg' if key.endswith('.ogg') else 'audio/mpeg'
+
+
+class _MultipartUpload:
+    """Uploads what is written to it in parts of part_size, starting before the writing is done."""
+
+    def __init__(self, client, bucket, key, part_size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=_content_type(self.key)
+            )['UploadId']
+        number = len(self.parts) + 1
+        body, self.buffer = bytes(self.buffer), bytearray()
+        self.parts.append((number, _get_upload_executor().submit(
+            self.client.upload_part,
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=body
+        )))
+
+    def complete(self):
+        """Finish the upload and return the object's ETag."""
+        if self.upload_id is None:
+            # Small enough for a single request
+            return self.client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=_content_type(self.key)
+            )['ETag']
+        if self.buffer:
+            self._upload_part()
+        parts = [{'PartNumber': number, 'ETag': future.result()['ETag']} for number, future in self.parts]
+        return self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': parts}
+        )['ETag']
+
+    def abort(self):
+        if self.upload_id is None:
+            return
+        for _, future in self.parts:
+            future.cancel()
+        # Parts still in flight could otherwise land after the abort
+        wait([future for _, future in self.parts])
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logger.warning(f"Could not abort the upload of {self.key}: {e}")
+
+
+class _TeeWriter:
+    def __init__(self, audio_file, upload):
+        self.audio_file = audio_file
+        self.upload = upload
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.audio_file.write(data)
+        self.upload.write(data)
+        self.digest.update(data)
+        return len(data)
+
+
+class S3AudioStore:
+    """
+    Audio in an S3-compatible bucket (AWS S3, MinIO, R2...), shared by every
+    replica and worker. The local file at the same path is kept as a cache.
+
+    Writes stream into a multipart upload as the chunks arrive, so the upload
+    overlaps with synthesis. The SHA-256 of every object is indexed under
+    <prefix>hashes/, and publishing audio that is already in the bucket under
+    another key is a server-side copy instead of an upload.
+
+    Local copies get the object's Last-Modified as their mtime, which is how a
+    stale copy of a replaced object is told apart from a current one.
+    """
+    local = False
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, part_size=8 * 1024 * 1024):
+        import boto3
+        from botocore.config import Config as BotoConfig
+
+        if not bucket:
+            raise ValueError("AUDIO_STORE=s3 needs S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        # S3 rejects parts under 5 MiB, except the last one
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url, region_name=region,
+            config=BotoConfig(
+                # Self-hosted stores usually don't have a DNS name per bucket
+                s3={'addressing_style': 'path'} if endpoint_url else None,
+                retries={'max_attempts': Config.RETRY_MAX_ATTEMPTS, 'mode': 'standard'},
+                max_pool_connections=max(10, Config.S3_UPLOAD_CONCURRENCY * 2),
+                # Checksums on every request aren't supported by every S3-compatible store
+                request_checksum_calculation='when_required',
+                response_checksum_validation='when_required',
+            )
+        )
+
+    def _object_key(self, key):
+        if Config.STORAGE_PATH:
+            key = os.path.relpath(key, Config.STORAGE_PATH)
+        return self.prefix + key.replace(os.sep, '/')
+
+    def _hash_key(self, digest):
+        return f"{self.prefix}hashes/{digest}"
+
+    def _head(self, object_key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=object_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def _sync_mtime(self, key, head):
+        """Give the local copy the object's Last-Modified, marking it as current."""
+        mtime_ns = int(head['LastModified'].timestamp() * 1e9)
+        os.utime(key, ns=(mtime_ns, mtime_ns))
+
+    def _index(self, digest, key, etag):
+        self.client.put_object(
+            Bucket=self.bucket, Key=self._hash_key(digest),
+            Body=json.dumps({'key': self._object_key(key), 'etag': etag}).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+    def _find_copy(self, digest):
+        """Key of an object in the bucket with this content, or None."""
+        from botocore.exceptions import ClientError
+        try:
+            entry = json.loads(self.client.get_object(Bucket=self.bucket, Key=self._hash_key(digest))['Body'].read())
+        except ClientError:
+            return None
+        # The object may have been replaced or deleted since it was indexed
+        head = self._head(entry['key'])
+        return entry['key'] if head and head['ETag'] == entry['etag'] else None
+
+    @contextmanager
+    def writer(self, key):
+        """File-like object to write the audio for key to, uploaded in parts as it is written."""
+        object_key = self._object_key(key)
+        upload = _MultipartUpload(self.client, self.bucket, object_key, self.part_size)
+        try:
+            with LocalAudioStore().writer(key) as audio_file:
+                tee = _TeeWriter(audio_file, upload)
+                yield tee
+            etag = upload.complete()
+        except BaseException:
+            upload.abort()
+            raise
+        self._sync_mtime(key, self._head(object_key))
+        self._index(tee.digest.hexdigest(), key, etag)
+
+    def publish(self, key):
+        """Upload the local file at key, or copy it inside the bucket if the same audio is already there."""
+        object_key = self._object_key(key)
+        digest = file_sha256(key)
+        source = self._find_copy(digest)
+        if source == object_key:
+            self._sync_mtime(key, self._head(object_key))
+            return
+        if source:
+            self.client.copy_object(
+                Bucket=self.bucket, Key=object_key, CopySource={'Bucket': self.bucket, 'Key': source},
+                ContentType=_content_type(key), MetadataDirective='REPLACE'
+            )
+            logger.info(f"{key} is already in the bucket as {source}, copied it there")
+            head = self._head(object_key)
+            self._sync_mtime(key, head)
+            self._index(digest, key, head['ETag'])
+            return
+
+        upload = _MultipartUpload(self.client, self.bucket, object_key, self.part_size)
+        try:
+            with open(key, 'rb') as audio_file:
+                for chunk in iter(lambda: audio_file.read(1024 * 1024), b''):
+                    upload.write(chunk)
+            etag = upload.complete()
+        except BaseException:
+            upload.abort()
+            raise
+        self._sync_mtime(key, self._head(object_key))
+        self._index(digest, key, etag)
+
+    def stat(self, key):
+        head = self._head(self._object_key(key))
+        if head is None:
+            return None
+        return StoredAudio(head['ContentLength'], int(head['LastModified'].timestamp() * 1e9))
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def local_copy(self, key):
+        """Path of a current local copy of the audio for key, downloading it if needed."""
+        stored = self.stat(key)
+        if stored is None:
+            raise FileNotFoundError(key)
+        try:
+            local = os.stat(key)
+            if (local.st_size, local.st_mtime_ns) == stored:
+                return key
+        except FileNotFoundError:
+            pass
+
+        response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        with LocalAudioStore().writer(key) as audio_file:
+            for chunk in response['Body'].iter_chunks(1024 * 1024):
+                audio_file.write(chunk)
+        self._sync_mtime(key, response)
+        return key
+
+    def open(self, key):
+        return open(self.local_copy(key), 'rb')
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        LocalAudioStore().delete(key)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_audio_store():
+    """The AUDIO_STORE shared by the whole process."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if Config.AUDIO_STORE == 's3':
+                    _store = S3AudioStore(
+                        Config.S3_BUCKET, Config.S3_PREFIX, Config.S3_ENDPOINT_URL, Config.S3_REGION, Config.S3_PART_SIZE
+                    )
+                else:
+                    _store = LocalAudioStore()
+    return _store
@@ -0,0 +1,66 @@
+import os
+import threading
+import httpx
+from config import Config
+
+# Long-lived API clients shared by every generation in the process.
+# Each one keeps its own pool of keep-alive connections, so the TCP/TLS
+# handshake is paid once per connection instead of once per request.
+# The vendor SDKs are imported when their client is first needed, which
+# keeps them off the bot's startup path.
+_clients = {}
+_http_clients = []
+_lock = threading.Lock()
+
+def _limits():
+    return httpx.Limits(
+        max_connections=Config.HTTP_POOL_SIZE,
+        max_keepalive_connections=Config.HTTP_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+def _timeout():
+    return httpx.Timeout(Config.HTTP_READ_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT)
+
+def _http_client():
+    http_client = httpx.Client(limits=_limits(), timeout=_timeout())
+    _http_clients.append(http_client)
+    return http_client
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def get_openai_client():
+    """Shared synchronous OpenAI client."""
+    from openai import OpenAI
+    return _get_or_create("openai", lambda: OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        base_url=Config.OPENAI_BASE_URL,
+        http_client=_http_client(),
+        # Retries are done by llm.rate_limit, which also backs off the other workers
+        max_retries=0,
+    ))
+
+def get_elevenlabs_client():
+    """Shared synchronous ElevenLabs client."""
+    from elevenlabs.client import ElevenLabs
+    return _get_or_create("elevenlabs", lambda: ElevenLabs(
+        api_key=os.getenv("ELEVENLABS_API_KEY"),
+        base_url=Config.ELEVENLABS_BASE_URL,
+        httpx_client=_http_client(),
+    ))
+
+async def close_clients():
+    """Close every connection pool. Call on shutdown, from the bot's event loop."""
+    with _lock:
+        http_clients = list(_http_clients)
+        _http_clients.clear()
+        _clients.clear()
+    for http_client in http_clients:
+        http_client.close()
@@ -1,7 +1,7 @@
 # Set up logging
 import logging
 import os
-from openai import OpenAI
+from llm.clients import get_openai_client
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -10,12 +10,10 @@ logger = logging.getLogger(__name__)
 api_key = os.getenv('OPENAI_API_KEY')
 print(f"🔌 Connected to OpenAI API {api_key[:20]}..." if api_key else "❌ No OpenAI API key found")
 
-# Configure OpenAI client
-openai = OpenAI(api_key=api_key)
-
 def test_openai_api():
+    """Make a real chat completion to check the OpenAI key. Only run on request, see app.py --check."""
     try:
-        chat_completion = openai.chat.completions.create(
+        chat_completion = get_openai_client().chat.completions.create(
             messages=[
                 {
                     "role": "user",
@@ -29,7 +27,3 @@ def test_openai_api():
     except Exception as e:
         print(f"❌ OpenAI API test failed: {e}")
         raise
-
-# Only test the API if this module is being imported (not in production)
-if not os.getenv('RAILWAY_ENVIRONMENT'):
-    test_openai_api()
\ No newline at end of file
@@ -1,101 +1,246 @@
-from llm.config import logger, openai
-from llm.text_to_speech import ElevenLabsTextToSpeech
-from llm.prompts.prompt_loader import LANGUAGE_PROMPTS, EPISODE_LINEUP_PROMPT, FIRST_EPISODE_PROMPT, EPISODE_PROMPT
+from llm.config import logger
+from llm.clients import get_openai_client
+from llm.rate_limit import openai_limiter
+from metrics import llm_seconds, llm_first_token_seconds, llm_prompt_cache_seconds, llm_tokens, record_error
+from llm.text_to_speech import ElevenLabsTextToSpeech, StreamedScript, StreamingTextToSpeech
+from llm.audio_store import episode_path as audio_path
+from llm.pipeline import run_stages
+from llm.memo import memoized, memo_key
+from config import Config
+from llm.prompts import prompt_loader as prompts
 import os
+import re
+import time
 
 def ensure_user_directory(user_id):
     """Create a directory for the user if it doesn't exist."""
-    user_dir = os.path.join("llm", "episodes", str(user_id))
+    user_dir = os.path.dirname(audio_path(user_id, ""))
     if not os.path.exists(user_dir):
         os.makedirs(user_dir)
     return user_dir
 
+def cached_tokens(usage):
+    """Prompt tokens the provider served from its prompt cache."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+def log_usage(stage, usage, prompt_version=None):
+    """Log how many tokens a completion used."""
+    if usage:
+        version = f" [prompt {prompt_version}]" if prompt_version else ""
+        print(f"{stage}{version}: {usage.prompt_tokens} prompt tokens ({cached_tokens(usage)} cached), {usage.completion_tokens} completion tokens")
+
+def record_usage(stage, model, usage, started, prompt_version=None):
+    """Log and count the tokens of a finished completion that was requested at started."""
+    log_usage(stage, usage, prompt_version)
+    if usage:
+        cached = cached_tokens(usage)
+        llm_tokens.inc(usage.prompt_tokens, stage=stage, model=model, direction="in")
+        llm_tokens.inc(cached, stage=stage, model=model, direction="cached")
+        llm_tokens.inc(usage.completion_tokens, stage=stage, model=model, direction="out")
+        llm_prompt_cache_seconds.observe(
+            time.monotonic() - started, stage=stage, model=model, prompt_cache="hit" if cached else "miss"
+        )
+
+# Tokens reserved for the answer when a request is let through, settled with the real usage afterwards
+COMPLETION_TOKENS_ESTIMATE = 1500
+
+def create_completion(stage, language, prompt_version=None, **request):
+    """
+    Create a chat completion within the OpenAI rate limits, retrying throttled and failed calls.
+    prompt_version identifies the prompt in the logs, see prompt_loader.prompt_version.
+    """
+    model = request["model"]
+    # About 4 characters a token
+    estimate = sum(len(m["content"]) for m in request["messages"]) // 4 + COMPLETION_TOKENS_ESTIMATE
+    started = time.monotonic()
+    try:
+        with llm_seconds.time(stage=stage, model=model, language=language):
+            completion = openai_limiter.call(
+                lambda: get_openai_client().chat.completions.create(**request),
+                cost=estimate,
+                actual_cost=lambda c: c.usage.total_tokens
+            )
+    except Exception as e:
+        record_error(stage, e)
+        raise
+    record_usage(stage, model, completion.usage, started, prompt_version)
+    return completion
+
+def stream_completion(stage, language, on_text, prompt_version=None, **request):
+    """
+    Like create_completion, but the answer is streamed and on_text is called with
+    every piece of it as it arrives. Returns the whole answer. Only opening the
+    stream is retried: what on_text was already given can't be taken back.
+    """
+    model = request["model"]
+    estimate = sum(len(m["content"]) for m in request["messages"]) // 4 + COMPLETION_TOKENS_ESTIMATE
+    started = time.monotonic()
+    parts, usage = [], None
+    try:
+        with llm_seconds.time(stage=stage, model=model, language=language):
+            opened = openai_limiter.stream(
+                lambda: get_openai_client().chat.completions.create(
+                    stream=True, stream_options={"include_usage": True}, **request
+                ),
+                cost=estimate
+            )
+            with opened as stream, stream:
+                for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    if not parts:
+                        llm_first_token_seconds.observe(time.monotonic() - started, stage=stage, model=model)
+                    parts.append(chunk.choices[0].delta.content)
+                    on_text(parts[-1])
+    except Exception as e:
+        record_error(stage, e)
+        raise
+    if usage:
+        openai_limiter.units.charge(usage.total_tokens - estimate)
+    record_usage(stage, model, usage, started, prompt_version)
+    return ''.join(parts)
+
+def prompt_completion(stage, prompt, language, model="gpt-4o-mini", on_text=None, **variables):
+    """
+    Complete prompt with this call's variables. The static instructions go first
+    and the variables last, so repeated calls share a prefix the provider can cache.
+    With on_text the answer is streamed to it as it is written.
+    """
+    request = dict(
+        prompt_version=prompts.prompt_version(prompt, language),
+        model=model,
+        messages=prompts.build_messages(prompt, language, **variables)
+    )
+    if on_text:
+        return stream_completion(stage, language, on_text, **request)
+    return create_completion(stage, language, **request).choices[0].message.content
+
+def build_episode_context(series_summary, previous_episode_script):
+    """
+    Compact context for the next episode: the running summary of the series plus
+    the ending of the last episode, so the prompt stays the same size as the series grows.
+    """
+    ending = re.sub(r'<[^>]+>', ' ', previous_episode_script or '')
+    ending = re.sub(r'\s+', ' ', ending).strip()[-Config.CONTEXT_ENDING_CHARS:]
+    return f"{series_summary or 'No previous episode'}\nThe previous episode ended with: {ending}"
+
 def create_episode_lineup(message, language, user_id):
     """Send a message to OpenAI and return the response."""
     print(f"Creating episode lineup for user {user_id} in {language}")
     try:
-        lang_instruction = LANGUAGE_PROMPTS.get(language, LANGUAGE_PROMPTS['en'])
-        system_prompt = EPISODE_LINEUP_PROMPT.format(language_instruction=lang_instruction)
-        
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",  # Updated model name
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Create a podcast lineup about: {message}"},
-            ]
-        )
-        return completion.choices[0].message.content
+        return prompt_completion("lineup", "EPISODE_LINEUP_PROMPT", language, topic=message)
     except Exception as e:
         logger.error(f"OpenAI API error: {e}")
         raise
 
-def create_first_episode(message, episode_lineup, language, user_id):
-    """Send a message to OpenAI and return the response."""
+def write_first_episode_script(message, episode_lineup, language):
+    """Ask OpenAI for the intro script of the podcast."""
     try:
-        lang_instruction = LANGUAGE_PROMPTS.get(language, LANGUAGE_PROMPTS['en'])
-        system_prompt = FIRST_EPISODE_PROMPT.format(language_instruction=lang_instruction)
-        
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"""
-                 Create an intro for a podcast about: {message}\nThis is the episode lineup: {episode_lineup}
-                 Use the Speech Synthesis Markup Language(SSML) to add pauses and emphasis to the text.
-                 make it <emphasis level="moderate">....</emphasis> and <prosody rate="slow">...</prosody>
-                 """},
-            ]
-        )
-        
-        # Create user directory and save file there
-        user_dir = ensure_user_directory(user_id)
-        ElevenLabsTextToSpeech(completion.choices[0].message.content, os.path.join(user_dir, "first_episode"))
-        return completion.choices[0].message.content
+        return prompt_completion("intro_script", "FIRST_EPISODE_PROMPT", language, topic=message, episode_lineup=episode_lineup)
     except Exception as e:
         logger.error(f"OpenAI API error: {e}")
         raise
 
-def create_episode(message, episode_number, previous_episode_script, episode_lineup, language, user_id):
-    """Send a message to OpenAI and return the response."""
+def write_episode_script(message, episode_number, previous_episodes, episode_lineup, language, on_text=None):
+    """Ask OpenAI for the script of an episode, streaming it to on_text if given."""
     try:
-        lang_instruction = LANGUAGE_PROMPTS.get(language, LANGUAGE_PROMPTS['en'])
-        system_prompt = EPISODE_PROMPT.format(
-            episode_number=episode_number,
+        return prompt_completion(
+            "episode_script", "EPISODE_PROMPT", language,
+            on_text=on_text,
+            topic=message,
             episode_lineup=episode_lineup,
-            previous_episode_script=previous_episode_script,
-            language_instruction=lang_instruction
+            previous_episodes=previous_episodes,
+            episode_number=episode_number
         )
-        
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini", 
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"""
-                    Create episode {episode_number} about: {message}
-                    Use the Speech Synthesis Markup Language(SSML) to add pauses and emphasis to the text.
-                    make it <emphasis level="moderate">....</emphasis> and <prosody rate="slow">...</prosody>
-                 """},
-            ]
+    except Exception as e:
+        logger.error(f"OpenAI API error: {e}")
+        raise
+
+def summarize_series(series_summary, episode_script, language):
+    """Fold the newest episode into the running summary of the series."""
+    try:
+        return prompt_completion(
+            "summary", "SUMMARY_PROMPT", language,
+            series_summary=series_summary or 'This is the first episode.',
+            episode_script=episode_script
         )
-        # Create user directory and save file there
-        user_dir = ensure_user_directory(user_id)
-        ElevenLabsTextToSpeech(completion.choices[0].message.content, os.path.join(user_dir, f"episode_{episode_number}"))
-        return completion.choices[0].message.content
     except Exception as e:
         logger.error(f"OpenAI API error: {e}")
         raise
 
-def start_initial_chain(message, language, user_id, db):
-    """Start the chain of the podcast."""
+def announce_audio(on_audio, kind, path):
+    """Hand finished audio to on_audio, if the caller delivers progressively, and return its path."""
+    if on_audio:
+        on_audio(kind, path)
+    return path
+
+def episode_stages(dependencies, write_script, file_path, on_audio=None):
+    """
+    The "episode_script" and "episode_audio" stages of an episode. write_script(r, on_text)
+    writes the script. With LLM_STREAMING the audio stage starts together with the script
+    and synthesizes it chunk by chunk while it is being written, instead of after it.
+    With on_audio and EPISODE_PART_CHARS, each part of the episode is passed to
+    on_audio("part", path, number) as soon as it is synthesized.
+    """
+    on_part = None
+    if on_audio and Config.EPISODE_PART_CHARS:
+        on_part = lambda path, number: on_audio("part", path, number)
+    if not Config.LLM_STREAMING:
+        return {
+            "episode_script": (dependencies, lambda r: write_script(r, None)),
+            "episode_audio": (("episode_script",), lambda r: ElevenLabsTextToSpeech(r["episode_script"], file_path, on_part)),
+        }
+    script = StreamedScript()
+    return {
+        "episode_script": (dependencies, lambda r: script.write(lambda on_text: write_script(r, on_text))),
+        "episode_audio": (dependencies, lambda r: StreamingTextToSpeech(script, file_path, on_part)),
+    }
+
+def memoized_script(db, kind, message, language, prompt, inputs, produce):
+    """Reuse a script written for the same topic and inputs, if script memoization is on."""
+    if not Config.MEMO_SCRIPTS:
+        return produce()
+    return memoized(db, kind, memo_key(kind, message, language, prompt, *inputs), produce)
+
+def start_initial_chain(message, language, user_id, db, on_audio=None):
+    """
+    Start the chain of the podcast.
+    on_audio(kind, path) is called from the chain's threads with the intro, and the
+    episode's parts, as soon as they are synthesized.
+    """
     print(f"Starting initial chain for user {user_id}")
     
-    user_dir = os.path.join("llm", "episodes", str(user_id))
-    intro_path = os.path.join(user_dir, "first_episode.mp3")
-    episode_path = os.path.join(user_dir, "episode_1.mp3")
+    user_dir = os.path.dirname(audio_path(user_id, ""))
+    intro_path = audio_path(user_id, "first_episode.mp3")
+    episode_path = audio_path(user_id, "episode_1.mp3")
+    
+    ensure_user_directory(user_id)
     
-    episode_lineup = create_episode_lineup(message, language, user_id)
-    first_episode = create_first_episode(message, episode_lineup, language, user_id)
-    episode_1 = create_episode(message, 1, first_episode, episode_lineup, language, user_id)
+    # Only the intro script feeds into episode 1, so the intro audio is
+    # synthesized while the episode 1 script is being written
+    results = run_stages({
+        "lineup": ((), lambda r: memoized(
+            db, "lineup", memo_key("lineup", message, language, prompts.EPISODE_LINEUP_PROMPT),
+            lambda: create_episode_lineup(message, language, user_id)
+        )),
+        "intro_script": (("lineup",), lambda r: memoized_script(
+            db, "intro_script", message, language, prompts.FIRST_EPISODE_PROMPT, [r["lineup"]],
+            lambda: write_first_episode_script(message, r["lineup"], language)
+        )),
+        "intro_audio": (("intro_script",), lambda r: announce_audio(
+            on_audio, "intro", ElevenLabsTextToSpeech(r["intro_script"], os.path.join(user_dir, "first_episode"))
+        )),
+        **episode_stages(("lineup", "intro_script"), lambda r, on_text: memoized_script(
+            db, "episode_script", message, language, prompts.EPISODE_PROMPT, [1, r["intro_script"], r["lineup"]],
+            lambda: write_episode_script(message, 1, r["intro_script"], r["lineup"], language, on_text)
+        ), os.path.join(user_dir, "episode_1"), on_audio),
+        "summary": (("episode_script",), lambda r: summarize_series("", r["episode_script"], language)),
+    })
+    episode_lineup = results["lineup"]
+    episode_1 = results["episode_script"]
     
     # Save podcast information to database with user-specific paths        
     db.add_podcast(
@@ -105,31 +250,70 @@ def start_initial_chain(message, language, user_id, db):
         intro_path=intro_path,
         episode_path=episode_path,
         episode_lineup=episode_lineup,
-        episode_content=episode_1
+        episode_content=episode_1,
+        episode_summary=results["summary"]
     )
     
     return episode_1
 
-def start_chain(message, language, user_id, db, episode_number):
-    """Start the chain of the podcast."""
-    print(f"Starting chain for user {user_id}")
+def generate_next_episode(message, language, user_id, db, episode_number, on_audio=None):
+    """
+    Write and synthesize the next episode without saving it to the user's podcast.
+    Returns the episode script and the updated summary of the series.
+    """
+    series = db.get_series_snapshot(user_id)
+    episode_lineup = series.episode_lineup
+    series_summary = series.episode_summary
+    print(f"Episode lineup: {episode_lineup}")
+
+    previous_episodes = build_episode_context(series_summary, series.episode_content)
     
-    user_dir = os.path.join("llm", "episodes", str(user_id))
-    episode_path = os.path.join(user_dir, f"episode_{episode_number}.mp3")
+    # Create user directory and save file there
+    user_dir = ensure_user_directory(user_id)
     
-    episode_lineup = db.get_user_lineup(user_id)
-    print(f"Episode lineup: {episode_lineup}")
+    # The summary only needs the script, so it is written while the audio is synthesized
+    results = run_stages({
+        **episode_stages((), lambda r, on_text: memoized_script(
+            db, "episode_script", message, language, prompts.EPISODE_PROMPT, [episode_number, previous_episodes, episode_lineup],
+            lambda: write_episode_script(message, episode_number, previous_episodes, episode_lineup, language, on_text)
+        ), os.path.join(user_dir, f"episode_{episode_number}"), on_audio),
+        "summary": (("episode_script",), lambda r: summarize_series(series_summary, r["episode_script"], language)),
+    })
+    
+    return results["episode_script"], results["summary"]
 
-    episode = create_episode(message, episode_number, (db.get_user_podcast_episode(user_id) or ""), episode_lineup, language, user_id)
+def start_chain(message, language, user_id, db, episode_number, on_audio=None):
+    """Start the chain of the podcast. on_audio is called like in start_initial_chain."""
+    print(f"Starting chain for user {user_id}")
     
-    episode_content = f"{(db.get_user_podcast_episode(user_id) or 'No previous episode')} \n\n {episode}"
+    episode_path = audio_path(user_id, f"episode_{episode_number}.mp3")
+    
+    episode, episode_summary = generate_next_episode(message, language, user_id, db, episode_number, on_audio)
     
     # Save podcast information to database with user-specific paths    
     db.update_podcast(
         user_id=user_id,
         episode_path=episode_path,
-        episode_content=episode_content
+        episode_content=episode,
+        episode_number=episode_number,
+        episode_summary=episode_summary
     )
-    return episode_content
+    return episode
+
+def prefetch_chain(message, language, user_id, db, episode_number):
+    """Generate the next episode ahead of time and keep it until the user asks for it."""
+    print(f"Prefetching episode {episode_number} for user {user_id}")
     
+    episode_path = audio_path(user_id, f"episode_{episode_number}.mp3")
     
+    episode, episode_summary = generate_next_episode(message, language, user_id, db, episode_number)
+    
+    db.add_prefetched_episode(
+        user_id=user_id,
+        topic=message,
+        episode_number=episode_number,
+        episode_path=episode_path,
+        episode_content=episode,
+        episode_summary=episode_summary
+    )
+    return episode
@@ -0,0 +1,63 @@
+import hashlib
+import re
+import threading
+from config import Config
+
+
+def normalize_topic(topic):
+    """Lowercase and collapse whitespace/punctuation so similar requests share a key."""
+    return re.sub(r'[\W_]+', ' ', topic.lower()).strip()
+
+
+def _template_hash(prompt):
+    """
+    Short hash of a whole prompt template, so editing any part of it invalidates what it produced.
+    Not to be confused with prompt_loader.prompt_version, which identifies a rendered system prompt in the logs.
+    """
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+
+
+def memo_key(kind, topic, language, prompt, *inputs):
+    """Key for a generated text, built from everything that went into producing it."""
+    parts = [kind, normalize_topic(topic), language, _template_hash(prompt)]
+    parts += [hashlib.sha256(str(value).encode('utf-8')).hexdigest() for value in inputs]
+    return f"{kind}:{hashlib.sha256(chr(0).join(parts).encode('utf-8')).hexdigest()}"
+
+
+class MemoStats:
+    """Hit/miss counters per kind of memoized content."""
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, hit):
+        with self._lock:
+            hits, misses = self.counts.get(kind, (0, 0))
+            self.counts[kind] = (hits + 1, misses) if hit else (hits, misses + 1)
+
+    def hit_ratio(self, kind):
+        hits, misses = self.counts.get(kind, (0, 0))
+        return hits / (hits + misses) if hits + misses else 0.0
+
+
+memo_stats = MemoStats()
+
+
+def memoized(db, kind, key, produce):
+    """
+    Return the stored content for key, or call produce() and store its result.
+    Entries older than MEMO_TTL_HOURS are ignored. Set MEMO_ENABLED=false to always call produce().
+    """
+    if not Config.MEMO_ENABLED or db is None:
+        return produce()
+
+    content = db.get_memo(key, Config.MEMO_TTL_HOURS)
+    memo_stats.record(kind, content is not None)
+    if content is not None:
+        print(f"Memo hit for {kind} ({memo_stats.hit_ratio(kind):.0%} hit ratio)")
+        return content
+
+    content = produce()
+    db.put_memo(key, kind, content)
+    return content
@@ -0,0 +1,98 @@
+# Minimal MPEG audio frame parsing, enough to join MP3 streams without re-encoding.
+# Concatenating two MP3 files byte for byte leaves the second file's ID3 tag and
+# Xing/Info header in the middle of the stream, which some players read as garbage
+# or as the end of the file. Joining at frame level keeps only the audio frames.
+
+# Bitrates in kbps indexed by [version is MPEG1][layer][bitrate index]
+_BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates in Hz indexed by version bits then sample rate index
+_SAMPLE_RATES = {
+    0b11: [44100, 48000, 32000],  # MPEG1
+    0b10: [22050, 24000, 16000],  # MPEG2
+    0b00: [11025, 12000, 8000],   # MPEG2.5
+}
+
+
+def skip_id3v2(data):
+    """Return the offset of the first byte after a leading ID3v2 tag (0 if there is none)."""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def frame_length(header):
+    """Length in bytes of the frame starting with this 4-byte header, or None if it isn't a valid header."""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version = (header[1] >> 3) & 0b11
+    layer = 4 - ((header[1] >> 1) & 0b11)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0b11
+    padding = (header[2] >> 1) & 0b1
+
+    if version == 0b01 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 0b11
+    bitrate = _BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding
+    return 144 * bitrate // sample_rate + padding
+
+
+def is_info_frame(frame):
+    """True for the Xing/Info/VBRI frame encoders put first to describe the whole file."""
+    return any(marker in frame[:64] for marker in (b'Xing', b'Info', b'VBRI'))
+
+
+def iter_frames(data):
+    """
+    Yield the audio frames of an MP3 file.
+    ID3 tags, the Xing/Info header frame and any bytes that aren't part of a frame are skipped.
+    """
+    position = skip_id3v2(data)
+    end = len(data)
+    if data[-128:-125] == b'TAG':
+        end -= 128
+
+    first = True
+    while position + 4 <= end:
+        length = frame_length(data[position:position + 4])
+        if not length or position + length > end:
+            # Resynchronise on the next possible frame header
+            position += 1
+            continue
+        frame = data[position:position + length]
+        position += length
+        if first and is_info_frame(frame):
+            first = False
+            continue
+        first = False
+        yield frame
+
+
+def iter_joined_frames(paths):
+    """Yield the audio frames of several MP3 files in order, as one continuous stream."""
+    for path in paths:
+        with open(path, 'rb') as mp3_file:
+            data = mp3_file.read()
+        yield from iter_frames(data)
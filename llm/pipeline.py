@@ -0,0 +1,49 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from llm.config import logger
+from metrics import stage_seconds, record_error
+
+
+def run_stages(stages, max_workers=None):
+    """
+    Run a dependency graph of stages, starting each stage as soon as its dependencies are done.
+
+    stages maps a stage name to a (dependencies, func) tuple. func is called with a dict
+    holding the results of its dependencies. Returns a dict with the result of every stage.
+    If a stage fails, stages that haven't started are dropped and the error is re-raised.
+    """
+    results = {}
+    pending = dict(stages)
+    running = {}
+    started_at = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages), thread_name_prefix="stage")
+    try:
+        while pending or running:
+            # Start every stage whose dependencies are all available
+            for name, (dependencies, func) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    inputs = {dependency: results[dependency] for dependency in dependencies}
+                    started_at[name] = time.monotonic()
+                    running[executor.submit(func, inputs)] = name
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Unresolvable stage dependencies: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                elapsed = time.monotonic() - started_at[name]
+                stage_seconds.observe(elapsed, stage=name)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Stage {name} failed: {e}")
+                    record_error(name, e)
+                    raise
+                print(f"Stage {name} finished in {elapsed:.1f}s")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return results
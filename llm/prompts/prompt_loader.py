@@ -1,3 +1,5 @@
+import functools
+import hashlib
 import os
 import re
 
@@ -22,8 +24,62 @@ def load_prompt(filename):
         prompt = '\n'.join(line for line in content.split('\n')[2:] if line.strip())
     return prompt
 
-# Load all prompts at module level
-LANGUAGE_PROMPTS = load_language_prompts()
-EPISODE_LINEUP_PROMPT = load_prompt('episode_lineup_prompt.md')
-FIRST_EPISODE_PROMPT = load_prompt('first_episode_prompt.md')
-EPISODE_PROMPT = load_prompt('episode_prompt.md') 
\ No newline at end of file
+@functools.lru_cache(maxsize=None)
+def load_prompt_sections(filename):
+    """
+    Split a prompt file into its static instructions and the template of the
+    request, the '## Request' section holding the variables of each call.
+    """
+    with open(os.path.join(os.path.dirname(__file__), filename), 'r') as f:
+        content = f.read()
+    instructions, _, request = content.partition('\n## Request\n')
+    instructions = '\n'.join(line for line in instructions.split('\n')[2:] if line.strip())
+    return instructions, request.strip()
+
+def language_instruction(language):
+    # Inside the module the lazy constants aren't loaded through __getattr__
+    language_prompts = globals().get('LANGUAGE_PROMPTS') or __getattr__('LANGUAGE_PROMPTS')
+    return language_prompts.get(language, language_prompts['en'])
+
+@functools.lru_cache(maxsize=None)
+def system_prompt(name, language):
+    """
+    The instructions of prompt name in language. They are identical on every call
+    in a language, so they are the prefix the provider's prompt cache can reuse.
+    """
+    instructions, _ = load_prompt_sections(PROMPT_FILES[name])
+    return instructions.format(language_instruction=language_instruction(language))
+
+def build_messages(name, language, **variables):
+    """Chat messages for prompt name: the static system prompt first, this call's variables last."""
+    _, request = load_prompt_sections(PROMPT_FILES[name])
+    return [
+        {"role": "system", "content": system_prompt(name, language)},
+        {"role": "user", "content": request.format(**variables)},
+    ]
+
+@functools.lru_cache(maxsize=None)
+def prompt_version(name, language):
+    """Short hash of prompt name as sent in language, which changes whenever its cacheable prefix does."""
+    _, request = load_prompt_sections(PROMPT_FILES[name])
+    content = system_prompt(name, language) + '\0' + request
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
+# Prompts are read from disk the first time they are used, not at import
+PROMPT_FILES = {
+    'EPISODE_LINEUP_PROMPT': 'episode_lineup_prompt.md',
+    'FIRST_EPISODE_PROMPT': 'first_episode_prompt.md',
+    'EPISODE_PROMPT': 'episode_prompt.md',
+    'SUMMARY_PROMPT': 'summary_prompt.md',
+}
+
+def __getattr__(name):
+    """Load LANGUAGE_PROMPTS and the *_PROMPT constants on first access."""
+    if name == 'LANGUAGE_PROMPTS':
+        value = load_language_prompts()
+    elif name in PROMPT_FILES:
+        value = load_prompt(PROMPT_FILES[name])
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
@@ -0,0 +1,228 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from config import Config
+from metrics import Gauge, vendor_retries
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying. 429 also shrinks the vendor's concurrency limit
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute units a minute, up to one minute's worth.
+    take() blocks until the units are available. Units can also be charged
+    after the fact, which may leave the bucket in debt for later callers.
+    A rate of 0 (or less) means no limit.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.unlimited = rate_per_minute <= 0
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount):
+        if self.unlimited:
+            return
+        # A single call bigger than the bucket would wait forever, so it only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def charge(self, amount):
+        """Add (or refund, if negative) units without waiting."""
+        if self.unlimited:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on the number of calls in flight: every success raises the limit
+    by 1/limit (about +1 per round trip of calls), every throttling response
+    halves it. Responses to calls that were already in flight when the limit was
+    cut don't cut it again. A max_limit of 0 (or less) means no limit, though
+    Retry-After pauses are still honoured.
+    """
+
+    def __init__(self, max_limit):
+        self.unlimited = max_limit <= 0
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif not self.unlimited and self.in_flight >= int(self.limit):
+                    self._condition.wait()
+                else:
+                    self.in_flight += 1
+                    return time.monotonic()
+
+    def release(self, started, throttled=False, retry_after=None):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if not self.unlimited and started >= self._last_decrease:
+                    previous = int(self.limit)
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+                    if int(self.limit) < previous:
+                        logger.warning(f"Throttled, concurrency limit lowered to {int(self.limit)}")
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            elif not self.unlimited:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def status_code(error):
+    """HTTP status of an SDK error, or None for errors without a response."""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def retry_after(error):
+    """Seconds the vendor asked us to wait (Retry-After / retry-after-ms headers), or None."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or getattr(error, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """Throttling, server errors and connection problems are retried, other client errors aren't."""
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # No response at all: timeouts and dropped connections
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {'TransportError', 'TimeoutException', 'APIConnectionError', 'APITimeoutError', 'ConnectionError', 'TimeoutError'})
+
+
+class VendorLimiter:
+    """
+    Everything that stands between the generation chains and one vendor's API:
+    a requests/minute bucket, a units/minute bucket (tokens or characters),
+    adaptive concurrency and jittered exponential retries.
+    """
+
+    def __init__(self, name, requests_per_minute, units_per_minute, max_concurrency):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.units = TokenBucket(units_per_minute)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff, so retries from many workers spread out."""
+        return random.uniform(0, min(Config.RETRY_MAX_DELAY, Config.RETRY_BASE_DELAY * 2 ** attempt))
+
+    def _open(self, func, cost):
+        """
+        Run func() within the vendor's limits, retrying it on transient errors.
+        Returns the result and the start time of the concurrency slot, which is still held.
+        """
+        attempt = 0
+        while True:
+            self.requests.take(1)
+            self.units.take(cost)
+            started = self.concurrency.acquire()
+            try:
+                return func(), started
+            except Exception as e:
+                throttled = status_code(e) == 429
+                wait = retry_after(e) if throttled else None
+                self.concurrency.release(started, throttled=throttled, retry_after=wait)
+                attempt += 1
+                if not is_retryable(e) or attempt >= Config.RETRY_MAX_ATTEMPTS:
+                    raise
+                vendor_retries.inc(vendor=self.name, reason=status_code(e) or type(e).__name__)
+                delay = max(wait or 0, self.backoff(attempt))
+                logger.warning(f"{self.name} call failed ({e}), retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def call(self, func, cost=1, actual_cost=None):
+        """
+        Run func() within the vendor's limits and retry it on transient errors.
+        cost is the estimated number of units the call uses. actual_cost(result),
+        if given, returns the real number, and the difference is settled with the bucket.
+        """
+        result, started = self._open(func, cost)
+        self.concurrency.release(started)
+        if actual_cost:
+            try:
+                self.units.charge(actual_cost(result) - cost)
+            except Exception as e:
+                logger.debug(f"Could not settle the {self.name} cost: {e}")
+        return result
+
+    @contextmanager
+    def stream(self, func, cost=1):
+        """
+        Like call, for results that keep the connection busy after func() returns,
+        such as streamed responses: the concurrency slot is held until the with
+        block ends. Only func() itself is retried.
+        """
+        result, started = self._open(func, cost)
+        try:
+            yield result
+        finally:
+            self.concurrency.release(started)
+
+openai_limiter = VendorLimiter(
+    "OpenAI", Config.OPENAI_REQUESTS_PER_MINUTE, Config.OPENAI_TOKENS_PER_MINUTE, Config.OPENAI_MAX_CONCURRENCY
+)
+elevenlabs_limiter = VendorLimiter(
+    "ElevenLabs", Config.ELEVENLABS_REQUESTS_PER_MINUTE, Config.ELEVENLABS_CHARACTERS_PER_MINUTE, Config.ELEVENLABS_MAX_CONCURRENCY
+)
+
+Gauge(
+    'vendor_concurrency_limit', "Current adaptive concurrency limit per vendor", ['vendor'],
+    callback=lambda: {(limiter.name,): int(limiter.concurrency.limit) for limiter in (openai_limiter, elevenlabs_limiter)}
+)
+Gauge(
+    'vendor_calls_in_flight', "Vendor calls currently running", ['vendor'],
+    callback=lambda: {(limiter.name,): limiter.concurrency.in_flight for limiter in (openai_limiter, elevenlabs_limiter)}
+)
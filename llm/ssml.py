@@ -0,0 +1,138 @@
+import re
+
+_TAG = re.compile(r'(<[^>]+>)')
+_TAG_NAME = re.compile(r'</?\s*([\w:-]+)')
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+# Tags after which a script can be cut without breaking the flow of speech
+_BLOCK_TAGS = ('p', 's')
+
+
+def _is_opening(tag):
+    return not tag.startswith('</') and not tag.endswith('/>') and not tag.startswith(('<?', '<!'))
+
+
+def _pieces(text):
+    """
+    Cut SSML into the smallest pieces that can be synthesized separately:
+    whole paragraphs/sentences, or single sentences inside plain text.
+    Each piece is (raw_text, open_tags_before, open_tags_after).
+    """
+    pieces = []
+    stack = []  # (name, opening tag) of the elements that are currently open
+    current = ''
+    start_stack = []
+
+    def cut():
+        nonlocal current, start_stack
+        if current:
+            pieces.append((current, list(start_stack), list(stack)))
+        current = ''
+        start_stack = list(stack)
+
+    for token in _TAG.split(text):
+        if not token:
+            continue
+        if token.startswith('<'):
+            current += token
+            match = _TAG_NAME.match(token)
+            name = match.group(1).lower() if match else ''
+            if token.startswith('</'):
+                # Pop up to and including the matching opening tag
+                for index in range(len(stack) - 1, -1, -1):
+                    if stack[index][0] == name:
+                        del stack[index:]
+                        break
+                if name in _BLOCK_TAGS:
+                    cut()
+            elif _is_opening(token):
+                stack.append((name, token))
+            continue
+
+        sentences = _SENTENCE_END.split(token)
+        for index, sentence in enumerate(sentences):
+            current += sentence
+            if index < len(sentences) - 1:
+                current += ' '
+                cut()
+    cut()
+    return pieces
+
+
+def _has_speech(raw):
+    return bool(_TAG.sub('', raw).strip())
+
+
+def _segment(group):
+    """Join pieces into a well formed segment, or None if there is nothing to say in them."""
+    if not group or not any(_has_speech(raw) for raw, _, _ in group):
+        return None
+    opening = ''.join(tag for _, tag in group[0][1])
+    closing = ''.join(f'</{name}>' for name, _ in reversed(group[-1][2]))
+    return opening + ''.join(raw for raw, _, _ in group).strip() + closing
+
+
+def split_ssml(text, max_chars):
+    """
+    Split an SSML script into segments of at most roughly max_chars characters.
+
+    Cuts only happen after a paragraph, an SSML sentence or a sentence ending, and
+    every segment is well formed: tags still open at a cut are closed at the end of
+    the segment and opened again at the start of the next one.
+    """
+    segments = []
+    group = []
+    size = 0
+
+    for piece in _pieces(text):
+        if group and size + len(piece[0]) > max_chars:
+            segments.append(_segment(group))
+            group, size = [], 0
+        group.append(piece)
+        size += len(piece[0])
+    segments.append(_segment(group))
+
+    return [segment for segment in segments if segment]
+
+
+class SSMLChunker:
+    """
+    Cuts an SSML script that is still being written into segments, at the same
+    places as split_ssml. A segment is released as soon as it holds at least
+    min_chars characters of complete sentences or paragraphs.
+    """
+
+    def __init__(self, min_chars):
+        self.min_chars = min_chars
+        self.text = ''
+        self.released = 0  # pieces already handed out
+
+    def _release(self, pieces, final=False):
+        segments = []
+        group, size = [], 0
+        for piece in pieces:
+            group.append(piece)
+            size += len(piece[0])
+            if size >= self.min_chars:
+                segments.append(_segment(group))
+                self.released += len(group)
+                group, size = [], 0
+        if final:
+            segments.append(_segment(group))
+            self.released += len(group)
+        return [segment for segment in segments if segment]
+
+    def feed(self, text):
+        """Add the next part of the script. Returns the segments that are now complete."""
+        self.text += text
+        # The last piece may still grow, every piece before it is final
+        return self._release(_pieces(self.text)[self.released:-1])
+
+    def finish(self):
+        """Segments of whatever is left once the whole script is written."""
+        return self._release(_pieces(self.text)[self.released:], final=True)
+
+
+def plain_text(ssml):
+    """SSML with the tags removed and whitespace collapsed."""
+    return re.sub(r'\s+', ' ', _TAG.sub(' ', ssml)).strip()
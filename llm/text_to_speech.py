@@ -1,45 +1,303 @@
 import os
-from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-        
-def ElevenLabsTextToSpeech(text, file_path):
+import queue
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from llm.clients import get_elevenlabs_client
+from llm.rate_limit import elevenlabs_limiter
+from llm.tts_cache import TTSCache, cache_key
+from llm.ssml import SSMLChunker, split_ssml, plain_text
+from llm.mp3 import iter_joined_frames
+from llm.audio_store import LocalAudioStore, get_audio_store
+from metrics import tts_seconds, tts_first_byte_seconds, tts_characters, tts_cache_requests, audio_bytes, audio_write_seconds, record_error
+from config import Config
+
+VOICE_ID = "5l5f8iK3YPeGga21rQIX"
+MODEL_ID = "eleven_multilingual_v2"
+OUTPUT_FORMAT = "mp3_44100_128"
+
+tts_cache = TTSCache(Config.TTS_CACHE_DIR, Config.TTS_CACHE_MAX_BYTES)
+
+def write_audio_stream(audio_stream, file_path, store=None):
+    """
+    Write audio chunks to file_path as they arrive, through store's writer
+    (a plain local file by default), so readers never see a partial file.
+    Returns (bytes_written, time_to_first_byte) in seconds.
+    """
+    started = time.monotonic()
+    time_to_first_byte = None
+    bytes_written = 0
+
+    with (store or LocalAudioStore()).writer(file_path) as audio_file:
+        for chunk in audio_stream:
+            if not chunk:
+                continue
+            if time_to_first_byte is None:
+                time_to_first_byte = time.monotonic() - started
+            audio_file.write(chunk)
+            bytes_written += len(chunk)
+
+    return bytes_written, time_to_first_byte
+
+def synthesize_to_file(text, file_path, previous_text=None, next_text=None, store=None):
+    """
+    Stream the audio for text from ElevenLabs into file_path, through store if given.
+    previous_text/next_text are the neighbouring segments, so the voice flows across segment boundaries.
+    """
+    started = time.monotonic()
+
+    # Only send the stitching context when there is some
+    context = {}
+    if previous_text:
+        context["previous_text"] = previous_text
+    if next_text:
+        context["next_text"] = next_text
+
+    def stream_to_file():
+        # Get the audio as a generator
+        audio_generator = get_elevenlabs_client().text_to_speech.convert(
+            text=text,
+            voice_id=VOICE_ID,
+            model_id=MODEL_ID,
+            output_format=OUTPUT_FORMAT,
+            **context,
+        )
+
+        # Write the audio data to file as it is received
+        return write_audio_stream(audio_generator, file_path, store)
+
+    # The request is only sent once the stream is read, so a retry re-runs the whole download.
+    # ElevenLabs bills characters, which is what the limiter counts
+    try:
+        bytes_written, time_to_first_byte = elevenlabs_limiter.call(stream_to_file, cost=len(text))
+    except Exception as e:
+        record_error("tts", e)
+        raise
+
+    elapsed = time.monotonic() - started
+    tts_seconds.observe(elapsed, model=MODEL_ID)
+    if time_to_first_byte is not None:
+        tts_first_byte_seconds.observe(time_to_first_byte, model=MODEL_ID)
+    tts_characters.inc(len(text), model=MODEL_ID)
+    audio_bytes.inc(bytes_written, source="tts")
+    print(
+        f"Wrote {bytes_written} bytes to {file_path} in {elapsed:.1f}s "
+        f"(first byte after {time_to_first_byte or 0:.2f}s, {bytes_written / elapsed / 1024 if elapsed else 0:.1f} KiB/s)"
+    )
+    return bytes_written
+
+def synthesize_segments(text, file_path, store=None):
+    """
+    Split a long script into segments, synthesize them in parallel and join the
+    resulting MP3 frames into file_path, without decoding or re-encoding the audio.
+    """
+    segments = split_ssml(text, Config.TTS_SEGMENT_CHARS)
+    if len(segments) < 2:
+        return synthesize_to_file(text, file_path, store=store)
+
+    print(f"Synthesizing {len(segments)} segments for {file_path}")
+    segment_dir = tempfile.mkdtemp(dir=os.path.dirname(file_path) or '.', prefix='.segments_')
+    try:
+        segment_paths = [os.path.join(segment_dir, f"segment_{index}.mp3") for index in range(len(segments))]
+        with ThreadPoolExecutor(max_workers=Config.TTS_SEGMENT_CONCURRENCY, thread_name_prefix="tts") as executor:
+            futures = [
+                executor.submit(
+                    synthesize_to_file,
+                    segment,
+                    segment_path,
+                    previous_text=plain_text(segments[index - 1])[-500:] if index > 0 else None,
+                    next_text=plain_text(segments[index + 1])[:500] if index + 1 < len(segments) else None,
+                )
+                for index, (segment, segment_path) in enumerate(zip(segments, segment_paths))
+            ]
+            for future in futures:
+                future.result()
+
+        with audio_write_seconds.time(source="join"):
+            bytes_written, _ = write_audio_stream(iter_joined_frames(segment_paths), file_path, store)
+        audio_bytes.inc(bytes_written, source="join")
+        return bytes_written
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+class StreamedScript:
+    """
+    A script that is still being written by the LLM, handed to the TTS stage as
+    SSML segments in order. Iterating blocks until the next segment is complete,
+    and raises if writing the script failed.
+    """
+
+    def __init__(self, min_chars=None):
+        self.chunker = SSMLChunker(min_chars or Config.TTS_STREAM_CHUNK_CHARS)
+        self.segments = queue.Queue()
+        self.text = None
+        self._fed = False
+
+    def feed(self, text):
+        """Called with every piece of the script as it arrives."""
+        self._fed = True
+        for segment in self.chunker.feed(text):
+            self.segments.put(segment)
+
+    def write(self, write_script):
+        """Run write_script(on_text=self.feed) and return the script once it is complete."""
+        try:
+            script = write_script(self.feed)
+            if not self._fed:
+                # Nothing was streamed, e.g. a memoized script
+                self.feed(script)
+            for segment in self.chunker.finish():
+                self.segments.put(segment)
+        except BaseException as e:
+            self.segments.put(e)
+            raise
+        self.text = script
+        self.segments.put(None)
+        return script
+
+    def __iter__(self):
+        while True:
+            segment = self.segments.get()
+            if segment is None:
+                return
+            if isinstance(segment, BaseException):
+                raise RuntimeError("Writing the script failed") from segment
+            yield segment
+
+def part_path(file_path, number):
+    return f"{os.path.splitext(file_path)[0]}.part{number}.mp3"
+
+def synthesize_stream(segments, file_path, store=None, on_part=None):
+    """
+    Synthesize SSML segments as they arrive, up to TTS_SEGMENT_CONCURRENCY at a time,
+    and join their MP3 frames into file_path in order while the rest are still coming.
+    With on_part, consecutive segments of at least EPISODE_PART_CHARS characters are also
+    joined into local part files next to file_path, and on_part(path, number) is called
+    with each one as soon as it is complete.
+    """
+    started = time.monotonic()
+    segment_dir = tempfile.mkdtemp(dir=os.path.dirname(file_path) or '.', prefix='.segments_')
+    submitted = queue.Queue()
+
+    def submit(executor):
+        # Runs in its own thread, as waiting for the next segment blocks on the LLM
+        try:
+            previous = None
+            for index, segment in enumerate(segments):
+                segment_path = os.path.join(segment_dir, f"segment_{index}.mp3")
+                context = plain_text(previous)[-500:] if previous else None
+                future = executor.submit(synthesize_to_file, segment, segment_path, previous_text=context)
+                submitted.put((future, segment_path, len(plain_text(segment))))
+                previous = segment
+        except BaseException as e:
+            submitted.put(e)
+            return
+        submitted.put(None)
+
+    part_paths, part_size, parts = [], 0, 0
+
+    def release_part():
+        nonlocal part_paths, part_size, parts
+        parts += 1
+        path = part_path(file_path, parts)
+        write_audio_stream(iter_joined_frames(part_paths), path)
+        part_paths, part_size = [], 0
+        on_part(path, parts)
+
+    def synthesized_paths():
+        # Each segment file, in order, as soon as it is synthesized
+        nonlocal part_size
+        index = 0
+        while True:
+            item = submitted.get()
+            if item is None:
+                # What is left is the last part, unless the episode was too short to split
+                if part_paths and parts:
+                    release_part()
+                return
+            if isinstance(item, BaseException):
+                raise item
+            future, segment_path, chars = item
+            future.result()
+            if index == 0:
+                print(f"First segment of {file_path} synthesized after {time.monotonic() - started:.1f}s")
+            index += 1
+            yield segment_path
+            if on_part:
+                part_paths.append(segment_path)
+                part_size += chars
+                if part_size >= Config.EPISODE_PART_CHARS:
+                    release_part()
+
+    try:
+        with ThreadPoolExecutor(max_workers=Config.TTS_SEGMENT_CONCURRENCY, thread_name_prefix="tts") as executor:
+            threading.Thread(target=submit, args=(executor,), name="tts-stream", daemon=True).start()
+            with audio_write_seconds.time(source="stream"):
+                bytes_written, _ = write_audio_stream(iter_joined_frames(synthesized_paths()), file_path, store)
+        audio_bytes.inc(bytes_written, source="stream")
+        print(f"Streamed {bytes_written} bytes to {file_path} in {time.monotonic() - started:.1f}s")
+        return bytes_written
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+def StreamingTextToSpeech(script, file_path, on_part=None):
+    """
+    Convert a StreamedScript to speech while it is being written and save it to file_path,
+    which like for ElevenLabsTextToSpeech should include the user directory.
+    on_part is passed on to synthesize_stream.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if not file_path.endswith('.mp3'):
+        file_path = f"{file_path}.mp3"
+
+    synthesize_stream(script, file_path, get_audio_store(), on_part)
+    if Config.TTS_CACHE_ENABLED:
+        tts_cache.store(cache_key(script.text, VOICE_ID, MODEL_ID, OUTPUT_FORMAT), file_path)
+    return file_path
+
+def ElevenLabsTextToSpeech(text, file_path, on_part=None):
     """
     Convert text to speech using ElevenLabs and save to a specific path.
-    file_path should be the full path including user directory
+    file_path should be the full path including user directory.
+    With on_part the audio is also handed out in parts, see synthesize_stream.
     """
     try:
-        load_dotenv()
-        
         # Ensure the directory exists
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
+
         print('path', os.path.dirname(file_path))
-        
-        client = ElevenLabs(
-            api_key=os.getenv("ELEVENLABS_API_KEY"),
-        )
 
-        # Get the audio as a generator
-        audio_generator = client.text_to_speech.convert(
-            text=text,
-            voice_id="5l5f8iK3YPeGga21rQIX",
-            model_id="eleven_multilingual_v2",
-            output_format="mp3_44100_128",
-        )
-        
-        # Convert generator to bytes
-        audio_bytes = b''.join(chunk for chunk in audio_generator)
-        
         # Add .mp3 extension if not present
         if not file_path.endswith('.mp3'):
             file_path = f"{file_path}.mp3"
-        
-        # Write the audio data to file
-        with open(file_path, 'wb') as audio_file:
-            audio_file.write(audio_bytes)
-        
+
+        # Reuse the audio if this exact text was synthesized before
+        store = get_audio_store()
+        key = cache_key(text, VOICE_ID, MODEL_ID, OUTPUT_FORMAT)
+        if Config.TTS_CACHE_ENABLED and tts_cache.fetch(key, file_path):
+            tts_cache_requests.inc(result="hit")
+            print(f"TTS cache hit for {file_path} ({tts_cache.stats()['hit_ratio']:.0%} hit ratio)")
+            store.publish(file_path)
+            return file_path
+
+        if Config.TTS_CACHE_ENABLED:
+            tts_cache_requests.inc(result="miss")
+
+        # Long scripts are synthesized as parallel segments
+        if on_part:
+            synthesize_stream(split_ssml(text, Config.TTS_STREAM_CHUNK_CHARS), file_path, store, on_part)
+        elif Config.TTS_SEGMENTED and len(text) > Config.TTS_SEGMENT_CHARS:
+            synthesize_segments(text, file_path, store)
+        else:
+            synthesize_to_file(text, file_path, store=store)
+
+        if Config.TTS_CACHE_ENABLED:
+            tts_cache.store(key, file_path)
+
         return file_path
-        
+
     except Exception as e:
         print(f"An error occurred: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from llm.config import logger
+
+
+def normalize_text(text):
+    """Collapse whitespace so formatting differences don't change the cache key."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(text, voice_id, model_id, output_format):
+    """Content hash of everything that affects the synthesized audio."""
+    payload = '\0'.join([normalize_text(text), voice_id, model_id, output_format])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _copy(source, destination):
+    """
+    Atomically put a copy of source at destination.
+
+    Never hardlink: cache entries and episode files must not share an inode, or
+    touching one (LRU bumps, mtime syncs, deletes) would change the other.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination) or '.', suffix='.part')
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized MP3s on disk.
+
+    Entries are evicted least-recently-used first once the total size goes over
+    max_bytes. Last use is kept in the file's mtime, so the order survives restarts.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = None  # key -> size, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _load(self):
+        """Build the index from the cache directory on first use."""
+        if self._entries is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.mp3'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name[:-len('.mp3')], stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(files))
+        self._size = sum(self._entries.values())
+
+    def fetch(self, key, file_path):
+        """Copy the cached audio for key to file_path. Returns False on a miss."""
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            cached_path = self._path(key)
+            try:
+                os.utime(cached_path)
+                _copy(cached_path, file_path)
+            except OSError as e:
+                logger.warning(f"TTS cache entry {key} is unreadable, dropping it: {e}")
+                self._size -= self._entries.pop(key)
+                self.hits -= 1
+                self.misses += 1
+                return False
+        return True
+
+    def store(self, key, file_path):
+        """Add the audio at file_path to the cache and evict old entries if over budget."""
+        with self._lock:
+            self._load()
+            if key in self._entries:
+                return
+            size = os.path.getsize(file_path)
+            if size > self.max_bytes:
+                return
+            _copy(file_path, self._path(key))
+            self._entries[key] = size
+            self._size += size
+
+            while self._size > self.max_bytes and self._entries:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(old_key))
+                except OSError as e:
+                    logger.warning(f"Could not remove TTS cache entry {old_key}: {e}")
+
+    def stats(self):
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries or ()),
+                "bytes": self._size,
+            }
@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cached Telegram send up to a whole podcast
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) for every series."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, values, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing total, per label combination."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Current value. With a callback, the value is read from it on every scrape."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.callback:
+            try:
+                # The callback returns a number, or a dict of label values tuple -> number
+                value = self.callback()
+            except Exception as e:
+                logger.debug(f"Could not read gauge {self.name}: {e}")
+                return []
+            values = value if isinstance(value, dict) else {(): value}
+            return [('', key, (), value) for key, value in sorted(values.items())]
+        with self._lock:
+            return [('', key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, per label combination."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with block took, whether or not it raised."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', key, [('le', _format_value(bound))], cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+def record_error(stage, error):
+    """Count an exception by the stage it happened in and its type."""
+    errors.inc(stage=stage, type=type(error).__name__)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the bot's own logs
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Serve /metrics on a background thread. Does nothing if port is 0 or a server is already running."""
+    global _server
+    if not port or _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Could not start the metrics server on port {port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return _server
+
+
+# Generation
+stage_seconds = Histogram('podcast_stage_duration_seconds', "Duration of each stage of a generation chain", ['stage'])
+generation_seconds = Histogram('podcast_generation_duration_seconds', "Duration of whole generation chains", ['chain'])
+errors = Counter('podcast_errors_total', "Exceptions by stage and type", ['stage', 'type'])
+
+# LLM
+llm_seconds = Histogram('llm_request_duration_seconds', "Duration of chat completion calls, retries included", ['stage', 'model', 'language'])
+# direction is in, out, or cached for the part of the input served from the provider's prompt cache
+llm_tokens = Counter('llm_tokens_total', "Tokens used by chat completions", ['stage', 'model', 'direction'])
+llm_first_token_seconds = Histogram('llm_time_to_first_token_seconds', "Time until a streamed chat completion sent its first text", ['stage', 'model'])
+llm_prompt_cache_seconds = Histogram(
+    'llm_prompt_cache_request_duration_seconds', "Duration of chat completion calls by whether the prompt cache was hit",
+    ['stage', 'model', 'prompt_cache']
+)
+
+# Text to speech
+tts_seconds = Histogram('tts_request_duration_seconds', "Duration of ElevenLabs synthesis calls, retries included", ['model'])
+tts_first_byte_seconds = Histogram('tts_time_to_first_byte_seconds', "Time until ElevenLabs sent the first audio bytes", ['model'])
+tts_characters = Counter('tts_characters_total', "Characters sent to ElevenLabs", ['model'])
+tts_cache_requests = Counter('tts_cache_requests_total', "TTS cache lookups", ['result'])
+audio_bytes = Counter('audio_bytes_written_total', "Audio bytes written to disk", ['source'])
+audio_write_seconds = Histogram('audio_write_duration_seconds', "Time spent joining and writing audio files", ['source'])
+
+# Vendor limits
+vendor_retries = Counter('vendor_retries_total', "Retried vendor calls by HTTP status (or error type)", ['vendor', 'reason'])
+
+# Telegram
+telegram_send_seconds = Histogram('telegram_send_audio_duration_seconds', "Duration of sending audio to Telegram", ['method'])
+telegram_upload_bytes = Counter('telegram_upload_bytes_total', "Audio bytes uploaded to Telegram", [])
+
+# Storage
+storage_bytes = Gauge('episode_storage_bytes', "Bytes of episode audio on the volume at the last storage sweep", [])
+storage_removed_files = Counter('episode_files_removed_total', "Episode files removed by the storage sweep", ['reason'])
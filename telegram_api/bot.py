@@ -3,6 +3,8 @@ import logging
 import os
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
+from telegram.constants import ChatAction
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, 
     CommandHandler, 
@@ -10,17 +12,25 @@ from telegram.ext import (
     MessageHandler, 
     filters, 
     CallbackQueryHandler,
-    ConversationHandler
+    ConversationHandler,
+    TypeHandler
 )
-from typing import Set
 import sys
-from telegram_api.database import Database
+from telegram_api.jobs import generation_queue, PRIORITY_INTERACTIVE, PRIORITY_PREFETCH
+from telegram_api.scheduler import schedule_daily_batch
+from telegram_api.storage import make_voice_variant, schedule_storage_sweep
+from telegram_api.persistence import DatabasePersistence, SharedConversationHandler, shared_state_handlers
+from config import Config
+from metrics import telegram_send_seconds, telegram_upload_bytes, start_metrics_server
 import datetime
+import threading
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from llm.llm import start_chain, start_initial_chain
+from llm.llm import start_chain, start_initial_chain, prefetch_chain
 from llm.text_to_speech import ElevenLabsTextToSpeech
+from llm.clients import close_clients
+from llm.audio_store import episode_path as audio_path, get_audio_store
 
 # Load environment variables
 load_dotenv()
@@ -61,11 +71,36 @@ This project is still under development, so please be patient with me. 🙏
 type /start to start the conversation.
 """
 
-# Set to store users who have received their episode
-users_with_episode: Set[int] = set()
-
 # Initialize database after other global variables
-db = Database()
+# Databases are created on first use, so polling starts without waiting for SQLAlchemy and the schema setup
+_db = None
+_adb = None
+_db_lock = threading.Lock()
+
+# Job workers of the database job backend, see telegram_api/worker.py
+_job_workers = None
+
+def get_db(reset=None):
+    """Sync database, used by the generation workers. reset only applies to the call that connects."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                from telegram_api.database import Database
+                _db = Database(reset)
+                logger.info(f"🔌 Connected to database at: {Config.DATABASE_URL}")
+    return _db
+
+def get_adb():
+    """Async database, used by the handlers so round-trips don't block the event loop."""
+    global _adb
+    if _adb is None:
+        db = get_db()  # outside the lock, which get_db takes too
+        with _db_lock:
+            if _adb is None:
+                from telegram_api.database import AsyncDatabase
+                _adb = AsyncDatabase(series_cache=db.series_cache)
+    return _adb
 
 # Add this to store user's language preference
 def get_language_name(lang_code):
@@ -122,11 +157,235 @@ async def restrict_user(context: ContextTypes.DEFAULT_TYPE, user_id: int, msg) -
         )
     except Exception as e:
         logger.error(f"Failed to restrict user: {e}")
-        # Fallback to just using our internal tracking
-        users_with_episode.add(user_id)
+        # Fallback to just using our internal tracking, kept in user_data so it is persisted with it
+        context.user_data['restricted'] = True
+
+async def send_audio_file(bot, chat_id: int, path: str, title: str, filename: str):
+    """Send an episode as audio, or as an Opus voice message with VOICE_DELIVERY."""
+    if Config.VOICE_DELIVERY:
+        voice_path = await asyncio.to_thread(lambda: make_voice_variant(get_db(), path, chat_id))
+        if voice_path:
+            return await send_media_file(bot.send_voice, 'voice', chat_id, voice_path, caption=title)
+    return await send_media_file(bot.send_audio, 'audio', chat_id, path, filename=filename, title=title)
+
+async def send_media_file(send, kind: str, chat_id: int, path: str, filename: str = None, **kwargs):
+    """Send a file with send (bot.send_audio/send_voice), reusing Telegram's file_id if this exact file was uploaded before."""
+    store = get_audio_store()
+    stat = await asyncio.to_thread(store.stat, path)
+    if stat is None:
+        raise FileNotFoundError(path)
+    file_id = await get_adb().get_telegram_file_id(path, stat.size, stat.mtime_ns)
+    if file_id:
+        try:
+            with telegram_send_seconds.time(method="file_id"):
+                message = await send(chat_id=chat_id, **{kind: file_id}, **kwargs)
+            await get_adb().touch_audio_file(path)
+            return message
+        except BadRequest as e:
+            logger.warning(f"Telegram rejected the stored file_id for {path}, uploading again: {e}")
+    
+    media = await asyncio.to_thread(store.open, path)
+    with media, telegram_send_seconds.time(method="upload"):
+        message = await send(chat_id=chat_id, **{kind: media}, filename=filename, **kwargs)
+    telegram_upload_bytes.inc(stat.size)
+    sent = getattr(message, kind)
+    if sent:
+        await get_adb().save_telegram_file_id(path, sent.file_id, stat.size, stat.mtime_ns)
+    return message
+
+class ProgressiveDelivery:
+    """
+    Sends the audio of an episode while the rest of it is still being generated, with
+    PROGRESSIVE_DELIVERY: the intro as soon as it is synthesized and, with EPISODE_PART_CHARS,
+    the episode in parts. Pass it to the chain as on_audio. Until finish() an upload_voice
+    chat action tells the user more is on its way.
+    """
+
+    def __init__(self, bot, chat_id: int, podcast_topic: str, episode_number: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.podcast_topic = podcast_topic
+        self.episode_number = episode_number
+        self.loop = asyncio.get_running_loop()
+        self.sent = set()
+        self._last = None  # sends run one after the other, in the order the audio was ready
+        self._intro = False
+        self._held = []  # parts of episode 1 that are ready before the intro
+        self._parts = 0
+        self._failed = False
+        self._chat_action = asyncio.create_task(self._keep_chat_action())
+
+    def __call__(self, kind: str, path: str, number: int = None):
+        """Called by the chain, from its threads, with each piece of audio once it is ready."""
+        self.loop.call_soon_threadsafe(self._add, kind, path, number)
+
+    def _add(self, kind, path, number):
+        # The intro and episode 1 are synthesized side by side, but the intro goes first
+        if kind == 'part' and self.episode_number == 1 and not self._intro:
+            self._held.append((path, number))
+            return
+        self._schedule(kind, path, number)
+        if kind == 'intro':
+            self._intro = True
+            for held in self._held:
+                self._schedule('part', *held)
+            self._held = []
+
+    def _schedule(self, kind, path, number):
+        self._last = asyncio.create_task(self._send(kind, path, number, self._last))
+
+    async def _send(self, kind, path, number, previous):
+        if previous:
+            await previous
+        try:
+            if kind == 'intro':
+                await self.bot.send_message(chat_id=self.chat_id, text="🎙️ Here's the introduction to your podcast, episode 1 is on its way!")
+                await send_audio_file(
+                    self.bot, self.chat_id, path,
+                    title=f"Introduction on {self.podcast_topic}",
+                    filename=f"Introduction_{self.podcast_topic.replace(' ', '_')}.mp3"
+                )
+                self.sent.add('intro')
+            else:
+                await self._send_part(path, number)
+                self._parts += 1
+        except Exception as e:
+            logger.error(f"Could not send {path} early, it is sent with the rest of the episode: {e}")
+            self._failed = self._failed or kind == 'part'
+        finally:
+            if kind == 'part':
+                await asyncio.to_thread(_remove_quietly, path)
+
+    async def _send_part(self, path, number):
+        # Parts are only kept until they are sent, so there is no file_id worth reusing
+        size = await asyncio.to_thread(os.path.getsize, path)
+        media = await asyncio.to_thread(open, path, 'rb')
+        with media, telegram_send_seconds.time(method="upload"):
+            await self.bot.send_audio(
+                chat_id=self.chat_id,
+                audio=media,
+                title=f"Episode {self.episode_number} about {self.podcast_topic}, part {number}",
+                filename=f"Episode_{self.episode_number}_{self.podcast_topic.replace(' ', '_')}_part_{number}.mp3"
+            )
+        telegram_upload_bytes.inc(size)
+
+    async def _keep_chat_action(self):
+        # Telegram shows a chat action for up to 5 seconds, or until the next message
+        while True:
+            try:
+                await self.bot.send_chat_action(chat_id=self.chat_id, action=ChatAction.UPLOAD_VOICE)
+            except Exception as e:
+                logger.debug(f"Could not send a chat action to {self.chat_id}: {e}")
+            await asyncio.sleep(4)
+
+    async def finish(self):
+        """
+        Wait for the audio sent so far and stop the chat action.
+        Returns what deliver_podcast doesn't need to send again.
+        """
+        if self._last:
+            await self._last
+        self._chat_action.cancel()
+        # The intro never came, so these are sent as a whole episode instead
+        for path, _ in self._held:
+            await asyncio.to_thread(_remove_quietly, path)
+        if self._parts and not self._failed and not self._held:
+            self.sent.add('episode')
+        return self.sent
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def deliver_podcast(bot, chat_id: int, podcast_topic: str, episode_number: int, sent=()):
+    """
+    Send a generated podcast episode to the user.
+    sent holds what a ProgressiveDelivery already sent of it: 'intro' and/or 'episode'.
+    Returns False if the audio files are missing.
+    """
+    # Path to the audio files in user's directory
+    if episode_number == 1:
+        intro_path = audio_path(chat_id, "first_episode.mp3")
+        episode_path = audio_path(chat_id, "episode_1.mp3")
+    else:
+        episode_path = audio_path(chat_id, f"episode_{episode_number}.mp3")
+    
+    # The files may be in a bucket shared with workers on other machines
+    def exists(path):
+        return asyncio.to_thread(get_audio_store().exists, path)
+    
+    if episode_number == 1 and await exists(intro_path) and await exists(episode_path):
+        # Send the audio files
+        if 'intro' not in sent:
+            await bot.send_message(chat_id=chat_id, text="🎙️ Here's your podcast, enjoy!")
+            await send_audio_file(
+                bot, chat_id, intro_path,
+                title=f"Introduction on {podcast_topic}",
+                filename=f"Introduction_{podcast_topic.replace(' ', '_')}.mp3"
+            )
+        if 'episode' not in sent:
+            await send_audio_file(
+                bot, chat_id, episode_path,
+                title=f"Episode {episode_number} about {podcast_topic}",
+                filename=f"Episode_{episode_number}_{podcast_topic.replace(' ', '_')}.mp3"
+            )
+    elif episode_number > 1 and await exists(episode_path):
+        if 'episode' not in sent:
+            await send_audio_file(
+                bot, chat_id, episode_path,
+                title=f"Episode {episode_number} about {podcast_topic}",
+                filename=f"Episode_{episode_number}_{podcast_topic.replace(' ', '_')}.mp3"
+            )
+    else:
+        await bot.send_message(chat_id=chat_id, text="Sorry, I couldn't find the podcast file. Please try a different topic. 😔")
+        return False
+        
+    # Add Next Episode button if not the last episode
+    if episode_number < 5:
+        keyboard = [[InlineKeyboardButton("Next Episode ▶️", callback_data='next_episode')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"I hope you enjoyed Episode {episode_number}! Would you like to listen to the next episode?",
+            reply_markup=reply_markup
+        )
+    else:
+        await bot.send_message(chat_id=chat_id, text="That was the last episode of your podcast series! I hope you enjoyed it! 🎉")
+    return True
+
+async def remember_episode(user_id: int, podcast_topic: str, language: str, episode_number: int, user_data=None):
+    """
+    Record the episode the user just received, which the Next button continues from.
+    Only called once it is delivered, so a failed generation doesn't make the user skip an episode.
+    user_data is the user's context.user_data, if at hand. With SHARED_STATE the stored copy is updated too,
+    so deliveries by workers in other processes reach the bot.
+    """
+    values = {'current_episode': episode_number, 'podcast_topic': podcast_topic, 'language': language}
+    if user_data is not None:
+        user_data.update(values)
+    if Config.SHARED_STATE:
+        data = await get_adb().get_user_data(user_id)
+        data.update(values)
+        await get_adb().save_user_data(user_id, data)
+
+async def schedule_prefetch(user_id: int, podcast_topic: str, language: str, episode_number: int):
+    """Start generating an episode in the background so it's ready when the user asks for it."""
+    if not Config.PREFETCH_NEXT_EPISODE or episode_number > 5:
+        return
+    
+    await get_adb().expire_prefetched_episodes(Config.PREFETCH_TTL_HOURS)
+    if Config.JOB_BACKEND == 'database':
+        await get_adb().enqueue_job(user_id, 'prefetch', podcast_topic, language, episode_number, PRIORITY_PREFETCH)
+        return
+    generation_queue.submit(
+        user_id, prefetch_chain, podcast_topic, language, user_id, get_db(), episode_number,
+        priority=PRIORITY_PREFETCH, match=(podcast_topic, episode_number)
+    )
 
 async def send_podcast(update: Update, context: ContextTypes.DEFAULT_TYPE, podcast_topic: str, language: str, message=None, episode_number: int = 1):
-    """Send an existing podcast audio file to the user."""
+    """Queue generation of a podcast episode. The audio is sent to the user once it is ready."""
     try:
         msg = message or update.message
         if not msg:
@@ -138,68 +397,81 @@ async def send_podcast(update: Update, context: ContextTypes.DEFAULT_TYPE, podca
         username = msg.chat.username
         
         # Add user to database if not exists
-        db.add_user(user_id, username)
+        await get_adb().add_user(user_id, username)
+        
+        if Config.JOB_BACKEND == 'database':
+            await queue_database_job(msg, user_id, podcast_topic, language, episode_number, context.user_data)
+            return
         
         if episode_number == 1:
             # Generate first episode and intro
-            start_initial_chain(podcast_topic, language, user_id, db)
+            chain, args = start_initial_chain, (podcast_topic, language, user_id, get_db())
         else:
             # Generate next episode
-            start_chain(podcast_topic, language, user_id, db, episode_number)
-        
-        # Path to the audio files in user's directory
-        user_dir = os.path.join("llm", "episodes", str(user_id))
+            chain, args = start_chain, (podcast_topic, language, user_id, get_db(), episode_number)
         
-        if episode_number == 1:
-            intro_path = os.path.join(user_dir, "first_episode.mp3")
-            episode_path = os.path.join(user_dir, "episode_1.mp3")
-        else:
-            episode_path = os.path.join(user_dir, f"episode_{episode_number}.mp3")
+        delivery = None
         
-        # Store current episode number in user data
-        context.user_data['current_episode'] = episode_number
-        context.user_data['podcast_topic'] = podcast_topic
-        context.user_data['language'] = language
+        async def on_done(_):
+            sent = await delivery.finish() if delivery else ()
+            if await deliver_podcast(context.bot, user_id, podcast_topic, episode_number, sent):
+                await remember_episode(user_id, podcast_topic, language, episode_number, context.user_data)
+                await schedule_prefetch(user_id, podcast_topic, language, episode_number + 1)
         
-        if episode_number == 1 and os.path.exists(intro_path) and os.path.exists(episode_path):
-            # Send the audio files
-            await msg.reply_text("🎙️ Here's your podcast, enjoy!")
-            await msg.reply_audio(
-                audio=open(intro_path, 'rb'),
-                title=f"Introduction on {podcast_topic}",
-                filename=f"Introduction_{podcast_topic.replace(' ', '_')}.mp3"
-            )
-            await msg.reply_audio(
-                audio=open(episode_path, 'rb'),
-                title=f"Episode {episode_number} about {podcast_topic}",
-                filename=f"Episode_{episode_number}_{podcast_topic.replace(' ', '_')}.mp3"
-            )
-        elif episode_number > 1 and os.path.exists(episode_path):
-            await msg.reply_audio(
-                audio=open(episode_path, 'rb'),
-                title=f"Episode {episode_number} about {podcast_topic}",
-                filename=f"Episode_{episode_number}_{podcast_topic.replace(' ', '_')}.mp3"
+        async def on_error(e):
+            logger.error(f"Error generating podcast: {e}")
+            if delivery:
+                await delivery.finish()
+            await context.bot.send_message(
+                chat_id=user_id,
+                text="Sorry, something went wrong while sending your podcast. Please try again later. 😔"
             )
-        else:
-            await msg.reply_text("Sorry, I couldn't find the podcast file. Please try a different topic. 😔")
-            return
-            
-        # Add Next Episode button if not the last episode
-        if episode_number < 5:
-            keyboard = [[InlineKeyboardButton("Next Episode ▶️", callback_data='next_episode')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await msg.reply_text(
-                f"I hope you enjoyed Episode {episode_number}! Would you like to listen to the next episode?",
-                reply_markup=reply_markup
-            )
-        else:
-            await msg.reply_text("That was the last episode of your podcast series! I hope you enjoyed it! 🎉")
+        
+        async def on_prefetched(_):
+            if await get_adb().claim_prefetched_episode(user_id, podcast_topic, episode_number):
+                await on_done(None)
+            else:
+                await on_error(Exception(f"Prefetched episode {episode_number} is no longer available"))
+        
+        if episode_number > 1:
+            # Serve the episode straight away if it was generated after the last delivery
+            if await get_adb().claim_prefetched_episode(user_id, podcast_topic, episode_number):
+                await on_done(None)
+                return
+            # Or wait for the background generation of this episode if it is already running
+            if generation_queue.promote(user_id, on_done=on_prefetched, on_error=on_error, match=(podcast_topic, episode_number)):
+                return
+        
+        if Config.PROGRESSIVE_DELIVERY:
+            delivery = ProgressiveDelivery(context.bot, user_id, podcast_topic, episode_number)
+            args += (delivery,)
+        if not generation_queue.submit(user_id, chain, *args, on_done=on_done, on_error=on_error):
+            if delivery:
+                await delivery.finish()
+            await msg.reply_text("I'm still working on your previous episode, I'll send it as soon as it's ready! ⏳")
             
     except Exception as e:
         logger.error(f"Error sending podcast: {e}")
         if msg:
             await msg.reply_text("Sorry, something went wrong while sending your podcast. Please try again later. 😔")
 
+async def queue_database_job(msg, user_id: int, podcast_topic: str, language: str, episode_number: int, user_data=None):
+    """Queue an episode in the generation_jobs table. Whichever worker leases it sends it to the user."""
+    adb = get_adb()
+    if episode_number > 1:
+        # Promote first: a prefetch that finishes in between is then either promoted or already claimable
+        if await adb.promote_job(user_id, podcast_topic, episode_number, PRIORITY_INTERACTIVE):
+            return
+        if await adb.claim_prefetched_episode(user_id, podcast_topic, episode_number):
+            if await deliver_podcast(msg.get_bot(), user_id, podcast_topic, episode_number):
+                await remember_episode(user_id, podcast_topic, language, episode_number, user_data)
+                await schedule_prefetch(user_id, podcast_topic, language, episode_number + 1)
+            return
+    
+    chain = 'initial' if episode_number == 1 else 'next'
+    if not await adb.enqueue_job(user_id, chain, podcast_topic, language, episode_number, PRIORITY_INTERACTIVE, delivery='send'):
+        await msg.reply_text("I'm still working on your previous episode, I'll send it as soon as it's ready! ⏳")
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle button presses."""
     query = update.callback_query
@@ -249,7 +521,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif query.data == 'my_podcasts':
         # Get user's podcasts from database
         user_id = query.message.chat.id
-        podcasts = db.get_user_podcasts(user_id)
+        podcasts = await get_adb().get_user_podcasts(user_id)
         
         if podcasts:
             response = "Here are your podcasts:\n\n"
@@ -286,10 +558,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.message.reply_text("No problem! Please tell me a different topic you'd like to hear about 🎙️")
         return WAITING_FOR_TOPIC
 
-async def check_user_restriction(update: Update) -> bool:
+async def check_user_restriction(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Check if user is allowed to send messages."""
-    user_id = update.effective_user.id
-    if user_id in users_with_episode:
+    if context.user_data.get('restricted'):
         await update.message.reply_text(
             "You've already received today's episode! 🎙️\n"
             "Please wait for tomorrow's episode. I'll notify you when it's ready! ✨"
@@ -300,7 +571,7 @@ async def check_user_restriction(update: Update) -> bool:
 async def receive_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the podcast topic input."""
     # Check if user is allowed to send messages
-    if not await check_user_restriction(update):
+    if not await check_user_restriction(update, context):
         return ConversationHandler.END
         
     podcast_topic = update.message.text
@@ -338,12 +609,11 @@ async def restart_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Clear user data and allow them to start fresh."""
     user_id = update.message.chat_id
     
-    # Remove from restricted users set
-    if user_id in users_with_episode:
-        users_with_episode.remove(user_id)
+    # Lift the restriction
+    context.user_data.pop('restricted', None)
     
     # Clear database entries and files
-    if db.clear_user_data(user_id):
+    if await get_adb().clear_user_data(user_id):
         keyboard = [
             [
                 InlineKeyboardButton("Create New Podcast 🎙️", callback_data='create_podcast'),
@@ -374,7 +644,7 @@ async def send_easter_egg_episode(update: Update, context: ContextTypes.DEFAULT_
         
         # Add easter egg user to database if not exists (using numeric ID)
         try:
-            db.add_user(easter_egg_user_id, "easter_egg_user")
+            await get_adb().add_user(easter_egg_user_id, "easter_egg_user")
         except Exception as db_error:
             # If database fails, just log it and continue - easter egg doesn't need database
             logger.warning(f"Failed to add easter egg user to database: {db_error}")
@@ -382,14 +652,14 @@ async def send_easter_egg_episode(update: Update, context: ContextTypes.DEFAULT_
         await msg.reply_text("Oh wow! Someone actually asked how I am! 😊✨ Let me tell you in a special episode just for you!")
         
         # Ensure user directory exists
-        user_dir = os.path.join("llm", "episodes", str(easter_egg_user_id))
+        user_dir = os.path.dirname(audio_path(easter_egg_user_id, ""))
         if not os.path.exists(user_dir):
             os.makedirs(user_dir)
         
         # Check if easter egg audio already exists
-        easter_egg_audio = os.path.join(user_dir, "easter_egg_episode.mp3")
+        easter_egg_audio = audio_path(easter_egg_user_id, "easter_egg_episode.mp3")
         
-        if os.path.exists(easter_egg_audio):
+        if await asyncio.to_thread(get_audio_store().exists, easter_egg_audio):
             # Audio file already exists, send it directly
             logger.info("Easter egg audio file already exists, sending existing file")
         else:
@@ -442,12 +712,12 @@ async def send_easter_egg_episode(update: Update, context: ContextTypes.DEFAULT_
             
             # Generate the audio file
             easter_egg_path = os.path.join(user_dir, "easter_egg_episode")
-            ElevenLabsTextToSpeech(easter_egg_content, easter_egg_path)
+            await asyncio.to_thread(ElevenLabsTextToSpeech, easter_egg_content, easter_egg_path)
         
         # Send the special episode (whether it was existing or newly generated)
-        if os.path.exists(easter_egg_audio):
-            await msg.reply_audio(
-                audio=open(easter_egg_audio, 'rb'),
+        if await asyncio.to_thread(get_audio_store().exists, easter_egg_audio):
+            await send_audio_file(
+                context.bot, msg.chat_id, easter_egg_audio,
                 title="Special Easter Egg: How Am I Doing?",
                 filename="EasterEgg_How_Am_I_Doing.mp3"
             )
@@ -468,16 +738,55 @@ async def handle_easter_egg(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # If it's not the easter egg, ignore the message (let other handlers process it)
     return
 
-def start_bot() -> None:
-    """Start the bot."""
+async def post_init(application: Application) -> None:
+    """Start background workers once the bot's event loop is running."""
+    global _job_workers
+    start_metrics_server(Config.METRICS_PORT)
+    if Config.JOB_BACKEND == 'database':
+        # Bot-only replicas set GENERATION_WORKERS=0 and leave the jobs to telegram_api.worker processes
+        if Config.GENERATION_WORKERS > 0:
+            from telegram_api.worker import JobWorkerPool
+            _job_workers = JobWorkerPool(application.bot, user_data=application.user_data)
+            _job_workers.start()
+    else:
+        generation_queue.start()
+    # Set up the database in the background instead of delaying the first poll
+    warm_up = asyncio.get_running_loop().run_in_executor(None, get_adb)
+    warm_up.add_done_callback(log_database_warm_up)
+
+def log_database_warm_up(future) -> None:
+    if not future.cancelled() and future.exception():
+        logger.error(f"Could not set up the database: {future.exception()}")
+
+async def post_shutdown(application: Application) -> None:
+    """Stop background workers when the bot shuts down."""
+    await generation_queue.stop()
+    if _job_workers is not None:
+        await _job_workers.stop()
+    await close_clients()
+    if _adb is not None:
+        await _adb.close()
+
+def build_application() -> Application:
+    """Create the Application with all handlers registered."""
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(Config.TELEGRAM_BASE_URL)
+        .base_file_url(Config.TELEGRAM_BASE_FILE_URL)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if Config.SHARED_STATE:
+        builder = builder.persistence(DatabasePersistence(get_adb))
+    application = builder.build()
 
     # Add easter egg handler first (higher priority)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_easter_egg), group=0)
 
     # Create conversation handler with the new language selection state
-    conv_handler = ConversationHandler(
+    conv_handler = SharedConversationHandler(
         entry_points=[
             CommandHandler("start", start),
             CommandHandler("restart", restart_command),
@@ -494,12 +803,45 @@ def start_bot() -> None:
             CommandHandler("restart", restart_command)
         ],
         per_message=False,  # Fix PTBUserWarning about CallbackQueryHandler tracking
+        name="podcast",
+        persistent=Config.SHARED_STATE,
     )
 
+    # Generate the next episodes overnight
+    schedule_daily_batch(application, get_db, get_adb)
+    # Keep the episodes on the volume within their quota
+    schedule_storage_sweep(application, get_db)
+
     # Add handlers
     application.add_handler(conv_handler, group=1)
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("restart", restart_command))
 
+    if Config.SHARED_STATE:
+        # Load this update's state before any other handler and save it after all of them
+        load_shared_state, flush_shared_state = shared_state_handlers(conv_handler)
+        application.add_handler(TypeHandler(Update, load_shared_state), group=-1)
+        application.add_handler(TypeHandler(Update, flush_shared_state), group=2)
+
+    return application
+
+def start_bot() -> None:
+    """Start the bot."""
+    application = build_application()
+
+    if Config.BOT_MODE == 'webhook':
+        if not Config.WEBHOOK_URL:
+            raise ValueError("BOT_MODE=webhook needs WEBHOOK_URL")
+        # Every replica registers the same URL, the load balancer spreads the updates
+        application.run_webhook(
+            listen=Config.WEBHOOK_LISTEN,
+            port=Config.WEBHOOK_PORT,
+            url_path=Config.WEBHOOK_PATH,
+            webhook_url=f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}",
+            secret_token=Config.WEBHOOK_SECRET_TOKEN,
+            allowed_updates=Update.ALL_TYPES
+        )
+        return
+
     # Run the bot until the user presses Ctrl-C
     application.run_polling(allowed_updates=Update.ALL_TYPES)
\ No newline at end of file
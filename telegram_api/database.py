@@ -1,10 +1,16 @@
-import os
+import asyncio
 import logging
-from sqlalchemy import create_engine, text, Column, Integer, String, DateTime, ForeignKey, BigInteger
+import threading
+from collections import OrderedDict, namedtuple
+import json
+from sqlalchemy import create_engine, text, inspect, Column, Integer, String, DateTime, ForeignKey, BigInteger, Index, func, and_, or_, select, delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from datetime import datetime, timedelta
 from config import Config
+from llm.audio_store import get_audio_store
 
 logger = logging.getLogger(__name__)
 
@@ -31,10 +37,178 @@ class Podcast(Base):
     user = relationship("User", back_populates="podcasts")
     episode_lineup = Column(String)
     episode_content = Column(String)
+    episode_number = Column(Integer, default=1)
+    episode_summary = Column(String)
+
+class PrefetchedEpisode(Base):
+    __tablename__ = 'prefetched_episodes'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey('users.user_id'))
+    topic = Column(String)
+    episode_number = Column(Integer)
+    episode_path = Column(String)
+    episode_content = Column(String)
+    episode_summary = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AudioFile(Base):
+    __tablename__ = 'audio_files'
+    
+    path = Column(String, primary_key=True)
+    telegram_file_id = Column(String)
+    file_size = Column(BigInteger)
+    file_mtime_ns = Column(BigInteger)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Owner and last delivery, for clearing a user's files and evicting the least recently used ones
+    user_id = Column(BigInteger, index=True)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow)
+
+class ContentMemo(Base):
+    __tablename__ = 'content_memo'
+    
+    key = Column(String, primary_key=True)
+    kind = Column(String)
+    content = Column(String)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class BotUserData(Base):
+    __tablename__ = 'bot_user_data'
+    
+    user_id = Column(BigInteger, primary_key=True)
+    data = Column(String)  # JSON encoded context.user_data
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ConversationState(Base):
+    __tablename__ = 'conversation_states'
+    
+    name = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)  # JSON encoded conversation key
+    state = Column(Integer)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# States of a generation job
+JOB_QUEUED = 'queued'
+JOB_LEASED = 'leased'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+class GenerationJobRecord(Base):
+    __tablename__ = 'generation_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey('users.user_id'))
+    chain = Column(String)  # 'initial', 'next' or 'prefetch'
+    topic = Column(String)
+    language = Column(String)
+    episode_number = Column(Integer)
+    priority = Column(Integer, default=0)
+    delivery = Column(String)  # 'send' the episode to the user, 'notify' them it's ready, or nothing
+    state = Column(String, default=JOB_QUEUED)
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String)
+    not_after = Column(DateTime)  # batch jobs that haven't started by then are dropped
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # One active job per user, like the key of the in-process queue
+        Index(
+            'ix_generation_jobs_active_user', 'user_id', unique=True,
+            postgresql_where=text("state IN ('queued', 'leased')"),
+            sqlite_where=text("state IN ('queued', 'leased')")
+        ),
+        Index('ix_generation_jobs_claim', 'state', 'priority', 'id'),
+    )
+
+# What a worker gets when it claims a job
+JobLease = namedtuple('JobLease', ['id', 'user_id', 'chain', 'topic', 'language', 'episode_number', 'priority', 'attempts'])
+
+# A tracked audio file, as seen by the storage sweep
+AudioFileInfo = namedtuple('AudioFileInfo', ['path', 'user_id', 'file_size', 'last_accessed_at'])
+
+def _track_audio_files(session, user_id, paths):
+    """Record the size of freshly written audio files. A file that was rewritten loses its Telegram file_id."""
+    now = datetime.utcnow()
+    for path in paths:
+        stat = get_audio_store().stat(path) if path else None
+        if stat is None:
+            continue
+        audio_file = session.get(AudioFile, path)
+        if audio_file is None:
+            session.add(AudioFile(
+                path=path, user_id=user_id, file_size=stat.size, file_mtime_ns=stat.mtime_ns, last_accessed_at=now
+            ))
+        elif (audio_file.file_size, audio_file.file_mtime_ns) != tuple(stat):
+            audio_file.telegram_file_id = None
+            audio_file.file_size = stat.size
+            audio_file.file_mtime_ns = stat.mtime_ns
+            audio_file.user_id = user_id
+            audio_file.last_accessed_at = now
+
+def _claimable(now):
+    return or_(
+        GenerationJobRecord.state == JOB_QUEUED,
+        and_(GenerationJobRecord.state == JOB_LEASED, GenerationJobRecord.lease_expires_at < now)
+    )
+
+# Everything the next-episode path needs to know about a user's current podcast
+SeriesSnapshot = namedtuple('SeriesSnapshot', [
+    'podcast_id', 'topic', 'language', 'intro_path', 'episode_path',
+    'episode_lineup', 'episode_content', 'episode_summary', 'episode_number'
+])
+
+def _snapshot(podcast):
+    return SeriesSnapshot(
+        podcast_id=podcast.id,
+        topic=podcast.topic,
+        language=podcast.language,
+        intro_path=podcast.intro_path,
+        episode_path=podcast.episode_path,
+        episode_lineup=podcast.episode_lineup,
+        episode_content=podcast.episode_content,
+        episode_summary=podcast.episode_summary,
+        episode_number=podcast.episode_number
+    )
+
+class SeriesCache:
+    """
+    Bounded LRU cache of each user's latest SeriesSnapshot.
+    Database methods that write a podcast update it, so reads never see stale data
+    from this process. A max_size of 0 turns the cache off.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            snapshot = self._entries.get(user_id)
+            if snapshot is not None:
+                self._entries.move_to_end(user_id)
+            return snapshot
+
+    def put(self, user_id, snapshot):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = snapshot
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
 
 class Database:
-    def __init__(self):
-        """Initialize database connection."""
+    def __init__(self, reset=None):
+        """Initialize database connection. reset overrides DB_RESET_ON_START."""
         try:
             # Use the database URL from Config instead of directly from environment
             database_url = Config.DATABASE_URL
@@ -43,26 +217,43 @@ class Database:
             
             self.engine = create_engine(database_url)
             self.Session = sessionmaker(bind=self.engine)
+            self.series_cache = SeriesCache(Config.SERIES_CACHE_SIZE)
             
             # Create all tables
-            self.init_db()
+            self.init_db(Config.DB_RESET_ON_START if reset is None else reset)
             
         except Exception as e:
             logger.error(f"Database initialization error: {e}")
             raise
 
-    def init_db(self):
-        """Initialize database tables."""
+    def init_db(self, reset=False):
+        """Initialize database tables, dropping the existing ones first with reset."""
         try:
-            # Drop existing tables if they exist
-            Base.metadata.drop_all(self.engine)
+            if reset:
+                # Drop existing tables if they exist
+                Base.metadata.drop_all(self.engine)
             # Create new tables with updated schema
             Base.metadata.create_all(self.engine)
+            self._add_missing_columns()
             logger.info("Database tables created successfully")
         except Exception as e:
             logger.error(f"Error creating database tables: {e}")
             raise
 
+    def _add_missing_columns(self):
+        """create_all doesn't alter existing tables, so add the (nullable) columns introduced since they were created."""
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                        logger.info(f"Added column {table.name}.{column.name}")
+
     def add_user(self, user_id: int, username: str = None):
         """Add a new user to the database."""
         session = self.Session()
@@ -78,7 +269,7 @@ class Database:
         finally:
             session.close()
 
-    def add_podcast(self, user_id: int, topic: str, language: str, intro_path: str, episode_path: str, episode_lineup: str, episode_content: str):
+    def add_podcast(self, user_id: int, topic: str, language: str, intro_path: str, episode_path: str, episode_lineup: str, episode_content: str, episode_summary: str = None):
         """Add a new podcast to the database."""
         session = self.Session()
         try:
@@ -89,32 +280,42 @@ class Database:
                 intro_path=intro_path,
                 episode_path=episode_path,
                 episode_lineup=episode_lineup,
-                episode_content=episode_content
+                episode_content=episode_content,
+                episode_summary=episode_summary,
+                episode_number=1
             )
             session.add(podcast)
+            _track_audio_files(session, user_id, [intro_path, episode_path])
+            session.flush()
+            snapshot = _snapshot(podcast)
             session.commit()
+            self.series_cache.put(user_id, snapshot)
         except Exception as e:
             logger.error(f"Error adding podcast: {e}")
             session.rollback()
         finally:
             session.close()
             
-    def update_podcast(self, user_id: int,episode_path: str, episode_content: str):
+    def update_podcast(self, user_id: int,episode_path: str, episode_content: str, episode_number: int = None, episode_summary: str = None):
         """Update a podcast in the database."""
         session = self.Session()
         try:
-            podcast = session.query(Podcast).filter_by(user_id=user_id).first()
+            podcast = session.query(Podcast).filter_by(user_id=user_id).order_by(Podcast.created_at.desc()).first()
             if podcast:
-                podcast.topic = podcast.topic
-                podcast.language = podcast.language
-                podcast.intro_path = podcast.intro_path
                 podcast.episode_path = episode_path
-                podcast.episode_lineup = podcast.episode_lineup
                 podcast.episode_content = episode_content
+                if episode_number is not None:
+                    podcast.episode_number = episode_number
+                if episode_summary is not None:
+                    podcast.episode_summary = episode_summary
+                _track_audio_files(session, user_id, [episode_path])
+                snapshot = _snapshot(podcast)
                 session.commit()
+                self.series_cache.put(user_id, snapshot)
         except Exception as e:
             logger.error(f"Error updating podcast: {e}")
             session.rollback()
+            self.series_cache.invalidate(user_id)
         finally:
             session.close()
     
@@ -127,21 +328,265 @@ class Database:
         finally:
             session.close()
 
-    def get_user_podcast_episode(self, user_id: int):
-        """Get the latest episode for a specific user."""
+    def get_series_snapshot(self, user_id: int):
+        """
+        Get a SeriesSnapshot of the latest podcast of a specific user, or None if they have none.
+        Served from the series cache when possible, otherwise loaded with a single projected query.
+        """
+        snapshot = self.series_cache.get(user_id)
+        if snapshot is not None:
+            return snapshot
+        
         session = self.Session()
         try:
-            podcast = session.query(Podcast).filter_by(user_id=user_id).order_by(Podcast.created_at.desc()).first()
-            return podcast.episode_content
+            row = session.query(
+                Podcast.id, Podcast.topic, Podcast.language, Podcast.intro_path, Podcast.episode_path,
+                Podcast.episode_lineup, Podcast.episode_content, Podcast.episode_summary, Podcast.episode_number
+            ).filter_by(user_id=user_id).order_by(Podcast.created_at.desc()).first()
+            if row is None:
+                return None
+            snapshot = SeriesSnapshot(*row)
+            self.series_cache.put(user_id, snapshot)
+            return snapshot
         finally:
             session.close()
+
+    def get_user_podcast_episode(self, user_id: int):
+        """Get the latest episode for a specific user."""
+        return self.get_series_snapshot(user_id).episode_content
+    
+    def get_user_podcast_summary(self, user_id: int):
+        """Get the running summary of the latest podcast of a specific user."""
+        return self.get_series_snapshot(user_id).episode_summary
     
     def get_user_lineup(self, user_id: int):
         """Get the lineup for a specific user."""
+        return self.get_series_snapshot(user_id).episode_lineup
+
+    def get_telegram_file_id(self, path: str, file_size: int, file_mtime_ns: int):
+        """Get the Telegram file_id of an uploaded audio file, if the file hasn't changed since."""
+        session = self.Session()
+        try:
+            audio_file = session.query(AudioFile).filter_by(path=path).first()
+            if audio_file and audio_file.file_size == file_size and audio_file.file_mtime_ns == file_mtime_ns:
+                return audio_file.telegram_file_id
+            return None
+        finally:
+            session.close()
+
+    def save_telegram_file_id(self, path: str, telegram_file_id: str, file_size: int, file_mtime_ns: int):
+        """Remember the Telegram file_id returned when an audio file was uploaded."""
+        session = self.Session()
+        try:
+            session.merge(AudioFile(
+                path=path,
+                telegram_file_id=telegram_file_id,
+                file_size=file_size,
+                file_mtime_ns=file_mtime_ns,
+                last_accessed_at=datetime.utcnow()
+            ))
+            session.commit()
+        except Exception as e:
+            logger.error(f"Error saving Telegram file_id: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def track_audio_files(self, user_id: int, paths):
+        """Start tracking audio files that aren't saved with a podcast, e.g. voice variants."""
+        session = self.Session()
+        try:
+            _track_audio_files(session, user_id, paths)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Error tracking audio files: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def get_audio_files(self):
+        """Every tracked audio file, least recently used first."""
+        session = self.Session()
+        try:
+            rows = session.query(
+                AudioFile.path, AudioFile.user_id, AudioFile.file_size, AudioFile.last_accessed_at
+            ).order_by(AudioFile.last_accessed_at).all()
+            return [AudioFileInfo(*row) for row in rows]
+        finally:
+            session.close()
+
+    def get_episode_paths(self):
+        """Audio paths the podcasts and prefetched episodes refer to, mapped to their user."""
+        session = self.Session()
+        try:
+            paths = {}
+            for user_id, intro_path, episode_path in session.query(Podcast.user_id, Podcast.intro_path, Podcast.episode_path):
+                paths.update({path: user_id for path in (intro_path, episode_path) if path})
+            for user_id, episode_path in session.query(PrefetchedEpisode.user_id, PrefetchedEpisode.episode_path):
+                if episode_path:
+                    paths[episode_path] = user_id
+            return paths
+        finally:
+            session.close()
+
+    def get_prefetched_paths(self):
+        """Audio paths of prefetched episodes that are still waiting for their user."""
         session = self.Session()
         try:
+            return {path for (path,) in session.query(PrefetchedEpisode.episode_path) if path}
+        finally:
+            session.close()
+
+    def forget_audio_files(self, paths):
+        """Stop tracking audio files, after they were deleted."""
+        if not paths:
+            return
+        session = self.Session()
+        try:
+            session.query(AudioFile).filter(AudioFile.path.in_(list(paths))).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Error forgetting audio files: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def get_memo(self, key: str, max_age_hours: float):
+        """Get memoized content if it is younger than max_age_hours."""
+        session = self.Session()
+        try:
+            cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+            memo = session.query(ContentMemo).filter(ContentMemo.key == key, ContentMemo.created_at >= cutoff).first()
+            if not memo:
+                return None
+            memo.hits = (memo.hits or 0) + 1
+            session.commit()
+            return memo.content
+        except Exception as e:
+            logger.error(f"Error reading memo: {e}")
+            session.rollback()
+            return None
+        finally:
+            session.close()
+
+    def put_memo(self, key: str, kind: str, content: str):
+        """Store generated content so it can be reused for the same inputs."""
+        session = self.Session()
+        try:
+            session.merge(ContentMemo(key=key, kind=kind, content=content, hits=0, created_at=datetime.utcnow()))
+            session.commit()
+        except Exception as e:
+            logger.error(f"Error storing memo: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def add_prefetched_episode(self, user_id: int, topic: str, episode_number: int, episode_path: str, episode_content: str, episode_summary: str = None):
+        """Store an episode that was generated before the user asked for it."""
+        session = self.Session()
+        try:
+            session.query(PrefetchedEpisode).filter_by(user_id=user_id, episode_number=episode_number).delete()
+            session.add(PrefetchedEpisode(
+                user_id=user_id,
+                topic=topic,
+                episode_number=episode_number,
+                episode_path=episode_path,
+                episode_content=episode_content,
+                episode_summary=episode_summary
+            ))
+            _track_audio_files(session, user_id, [episode_path])
+            session.commit()
+        except Exception as e:
+            logger.error(f"Error adding prefetched episode: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def claim_prefetched_episode(self, user_id: int, topic: str, episode_number: int):
+        """
+        Move a prefetched episode into the user's podcast.
+        Returns True if the episode was available and its audio file still exists.
+        """
+        session = self.Session()
+        try:
+            prefetched = session.query(PrefetchedEpisode).filter_by(
+                user_id=user_id, topic=topic, episode_number=episode_number
+            ).first()
+            if not prefetched:
+                return False
+            
+            session.delete(prefetched)
+            if not get_audio_store().exists(prefetched.episode_path):
+                session.commit()
+                return False
+            
             podcast = session.query(Podcast).filter_by(user_id=user_id).order_by(Podcast.created_at.desc()).first()
-            return podcast.episode_lineup
+            if podcast:
+                podcast.episode_path = prefetched.episode_path
+                podcast.episode_content = prefetched.episode_content
+                podcast.episode_number = prefetched.episode_number
+                podcast.episode_summary = prefetched.episode_summary
+                snapshot = _snapshot(podcast)
+            session.commit()
+            if podcast:
+                self.series_cache.put(user_id, snapshot)
+            return podcast is not None
+        except Exception as e:
+            logger.error(f"Error claiming prefetched episode: {e}")
+            session.rollback()
+            self.series_cache.invalidate(user_id)
+            return False
+        finally:
+            session.close()
+
+    def get_active_series(self, max_episodes: int = 5):
+        """
+        Get the podcasts that still have episodes left and no episode waiting to be claimed.
+        Returns (user_id, topic, language, next_episode_number) for each user's latest podcast.
+        """
+        session = self.Session()
+        try:
+            latest = session.query(
+                Podcast.user_id,
+                func.max(Podcast.created_at).label('created_at')
+            ).group_by(Podcast.user_id).subquery()
+            
+            podcasts = session.query(Podcast).join(
+                latest,
+                and_(Podcast.user_id == latest.c.user_id, Podcast.created_at == latest.c.created_at)
+            ).filter(Podcast.episode_number < max_episodes).all()
+            
+            prefetched = set(session.query(PrefetchedEpisode.user_id, PrefetchedEpisode.episode_number).all())
+            
+            return [
+                (p.user_id, p.topic, p.language, p.episode_number + 1)
+                for p in podcasts
+                if (p.user_id, p.episode_number + 1) not in prefetched
+            ]
+        finally:
+            session.close()
+
+    def expire_prefetched_episodes(self, max_age_hours: float):
+        """Delete prefetched episodes (and their audio) that were never claimed."""
+        session = self.Session()
+        try:
+            cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+            expired = session.query(PrefetchedEpisode).filter(PrefetchedEpisode.created_at < cutoff).all()
+            for prefetched in expired:
+                try:
+                    if prefetched.episode_path:
+                        get_audio_store().delete(prefetched.episode_path)
+                except Exception as e:
+                    logger.error(f"Error deleting files: {e}")
+                session.delete(prefetched)
+            session.commit()
+            if expired:
+                logger.info(f"Expired {len(expired)} unclaimed prefetched episodes")
+            return len(expired)
+        except Exception as e:
+            logger.error(f"Error expiring prefetched episodes: {e}")
+            session.rollback()
+            return 0
         finally:
             session.close()
 
@@ -151,23 +596,503 @@ class Database:
         try:
             podcasts = session.query(Podcast).filter_by(user_id=user_id).all()
             
-            # Delete files
-            for podcast in podcasts:
+            prefetched_episodes = session.query(PrefetchedEpisode).filter_by(user_id=user_id).all()
+            
+            # Delete files, including earlier episodes and voice variants that only audio_files knows about
+            paths = [p.intro_path for p in podcasts] + [p.episode_path for p in podcasts] + [p.episode_path for p in prefetched_episodes]
+            paths += [path for (path,) in session.query(AudioFile.path).filter_by(user_id=user_id)]
+            paths = [path for path in paths if path]
+            for path in paths:
                 try:
-                    if podcast.intro_path and os.path.exists(podcast.intro_path):
-                        os.remove(podcast.intro_path)
-                    if podcast.episode_path and os.path.exists(podcast.episode_path):
-                        os.remove(podcast.episode_path)
+                    get_audio_store().delete(path)
                 except Exception as e:
                     logger.error(f"Error deleting files: {e}")
             
             # Delete database records
+            session.query(AudioFile).filter(AudioFile.path.in_(paths)).delete(synchronize_session=False)
+            session.query(PrefetchedEpisode).filter_by(user_id=user_id).delete()
             session.query(Podcast).filter_by(user_id=user_id).delete()
             session.commit()
+            self.series_cache.invalidate(user_id)
             return True
         except Exception as e:
             logger.error(f"Error clearing user data: {e}")
             session.rollback()
             return False
         finally:
-            session.close()
\ No newline at end of file
+            session.close()
+
+    def enqueue_job(self, user_id: int, chain: str, topic: str, language: str, episode_number: int, priority: int, delivery: str = None, not_after: datetime = None):
+        """
+        Queue a generation job. Returns its id, or None if the user already has a queued or running job.
+        A job with a not_after (UTC) is dropped if no worker starts it by then.
+        """
+        session = self.Session()
+        try:
+            job = GenerationJobRecord(
+                user_id=user_id, chain=chain, topic=topic, language=language,
+                episode_number=episode_number, priority=priority, delivery=delivery, not_after=not_after
+            )
+            session.add(job)
+            session.commit()
+            return job.id
+        except IntegrityError:
+            session.rollback()
+            return None
+        finally:
+            session.close()
+
+    def claim_job(self, owner: str, lease_seconds: float, max_attempts: int, deadline_limit: int = None):
+        """
+        Lease the most urgent job that is queued or whose lease has expired, and return it as a JobLease.
+        Returns None if there is nothing to do. Jobs that were already tried max_attempts times are failed instead.
+        Jobs past their not_after are failed too, and while deadline_limit jobs with a not_after (the nightly
+        batch) are leased, no more of them are picked. Workers that claim at the same moment may overshoot
+        that limit by a job or two.
+
+        On PostgreSQL the candidate row is locked with FOR UPDATE SKIP LOCKED, so concurrent workers
+        each get a different job without waiting. SQLite ignores the locking clause; there the
+        conditional UPDATE makes sure only one worker wins a row, and the others look again.
+        """
+        session = self.Session()
+        try:
+            now = datetime.utcnow()
+            # Dropping them also frees their user for new jobs
+            dropped = session.execute(
+                update(GenerationJobRecord)
+                .where(_claimable(now), GenerationJobRecord.not_after < now)
+                .values(state=JOB_FAILED, lease_owner=None, lease_expires_at=None, last_error='Not started before its deadline')
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            session.commit()
+            if dropped:
+                logger.info(f"Dropped {dropped} generation jobs that missed their deadline")
+            
+            for _ in range(5):
+                now = datetime.utcnow()
+                query = session.query(GenerationJobRecord).filter(_claimable(now))
+                if deadline_limit is not None:
+                    running = session.query(func.count(GenerationJobRecord.id)).filter(
+                        GenerationJobRecord.state == JOB_LEASED,
+                        GenerationJobRecord.lease_expires_at >= now,
+                        GenerationJobRecord.not_after.isnot(None)
+                    ).scalar()
+                    if running >= deadline_limit:
+                        query = query.filter(GenerationJobRecord.not_after.is_(None))
+                job = query.order_by(
+                    GenerationJobRecord.priority, GenerationJobRecord.id
+                ).with_for_update(skip_locked=True).first()
+                if job is None:
+                    session.commit()
+                    return None
+                
+                lease = JobLease(job.id, job.user_id, job.chain, job.topic, job.language, job.episode_number, job.priority, job.attempts + 1)
+                if job.attempts >= max_attempts:
+                    values = {'state': JOB_FAILED, 'lease_owner': None, 'lease_expires_at': None,
+                              'last_error': job.last_error or 'Lease expired too many times'}
+                else:
+                    values = {'state': JOB_LEASED, 'lease_owner': owner, 'attempts': job.attempts + 1,
+                              'lease_expires_at': now + timedelta(seconds=lease_seconds)}
+                claimed = session.execute(
+                    update(GenerationJobRecord)
+                    .where(GenerationJobRecord.id == job.id, _claimable(now))
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                session.commit()
+                if claimed and values['state'] == JOB_LEASED:
+                    return lease
+                if claimed:
+                    logger.warning(f"Generation job {job.id} failed after {job.attempts} attempts")
+            return None
+        except Exception as e:
+            logger.error(f"Error claiming generation job: {e}")
+            session.rollback()
+            return None
+        finally:
+            session.close()
+
+    def renew_job_lease(self, job_id: int, owner: str, lease_seconds: float):
+        """Extend the lease of a running job. Returns False if the worker no longer holds it."""
+        session = self.Session()
+        try:
+            renewed = session.execute(
+                update(GenerationJobRecord)
+                .where(GenerationJobRecord.id == job_id, GenerationJobRecord.lease_owner == owner, GenerationJobRecord.state == JOB_LEASED)
+                .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+            ).rowcount
+            session.commit()
+            return bool(renewed)
+        except Exception as e:
+            logger.error(f"Error renewing job lease: {e}")
+            session.rollback()
+            return True
+        finally:
+            session.close()
+
+    def complete_job(self, job_id: int, owner: str):
+        """
+        Mark a leased job as done. Returns (True, delivery), or (False, None) if the lease
+        expired and the job was handed to another worker in the meantime.
+        """
+        session = self.Session()
+        try:
+            done = session.execute(
+                update(GenerationJobRecord)
+                .where(GenerationJobRecord.id == job_id, GenerationJobRecord.lease_owner == owner, GenerationJobRecord.state == JOB_LEASED)
+                .values(state=JOB_DONE, lease_expires_at=None)
+            ).rowcount
+            # Read after the update, so a promotion committed before it is seen
+            delivery = session.query(GenerationJobRecord.delivery).filter_by(id=job_id).scalar()
+            session.commit()
+            return (True, delivery) if done else (False, None)
+        except Exception as e:
+            logger.error(f"Error completing generation job: {e}")
+            session.rollback()
+            return False, None
+        finally:
+            session.close()
+
+    def fail_job(self, job_id: int, owner: str, error: str, max_attempts: int):
+        """
+        Put a job that raised back in the queue, or fail it for good after max_attempts.
+        Returns (failed for good, delivery).
+        """
+        session = self.Session()
+        try:
+            job = session.query(GenerationJobRecord).filter_by(id=job_id, lease_owner=owner, state=JOB_LEASED).first()
+            if not job:
+                session.commit()
+                return False, None
+            final = job.attempts >= max_attempts
+            job.state = JOB_FAILED if final else JOB_QUEUED
+            job.lease_owner = None
+            job.lease_expires_at = None
+            job.last_error = error[:1000]
+            delivery = job.delivery
+            session.commit()
+            return final, delivery
+        except Exception as e:
+            logger.error(f"Error failing generation job: {e}")
+            session.rollback()
+            return False, None
+        finally:
+            session.close()
+
+def async_database_url(database_url):
+    """Translate a sync SQLAlchemy URL to the matching asyncio driver."""
+    if database_url.startswith('postgresql://'):
+        return database_url.replace('postgresql://', 'postgresql+asyncpg://', 1)
+    if database_url.startswith('sqlite://'):
+        return database_url.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+    return database_url
+
+class AsyncDatabase:
+    """
+    asyncio version of the Database methods used by the bot handlers, so they
+    don't block the event loop on database round-trips. Tables are created by
+    the sync Database, which scripts and the generation workers keep using.
+    """
+
+    def __init__(self, series_cache: SeriesCache = None):
+        """Initialize database connection."""
+        try:
+            database_url = async_database_url(Config.DATABASE_URL)
+            
+            logger.info(f"Connecting async engine to database: {database_url}")
+            
+            options = {"pool_pre_ping": True}
+            if not database_url.startswith('sqlite'):
+                options.update(
+                    pool_size=Config.DB_POOL_SIZE,
+                    max_overflow=Config.DB_MAX_OVERFLOW,
+                    pool_recycle=Config.DB_POOL_RECYCLE,
+                )
+            
+            self.engine = create_async_engine(database_url, **options)
+            self.Session = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+            # Share the sync Database's cache so both see each other's writes
+            self.series_cache = series_cache or SeriesCache(Config.SERIES_CACHE_SIZE)
+            
+        except Exception as e:
+            logger.error(f"Database initialization error: {e}")
+            raise
+
+    async def close(self):
+        """Close every pooled connection."""
+        await self.engine.dispose()
+
+    async def add_user(self, user_id: int, username: str = None):
+        """Add a new user to the database."""
+        async with self.Session() as session:
+            try:
+                user = await session.get(User, user_id)
+                if not user:
+                    session.add(User(user_id=user_id, username=username))
+                    await session.commit()
+            except Exception as e:
+                logger.error(f"Error adding user: {e}")
+                await session.rollback()
+
+    async def get_user_podcasts(self, user_id: int):
+        """Get all podcasts for a specific user."""
+        async with self.Session() as session:
+            result = await session.execute(
+                select(Podcast.topic, Podcast.language, Podcast.intro_path, Podcast.episode_path, Podcast.created_at)
+                .filter_by(user_id=user_id)
+                .order_by(Podcast.created_at.desc())
+            )
+            return [tuple(row) for row in result.all()]
+
+    async def get_series_snapshot(self, user_id: int):
+        """Get a SeriesSnapshot of the latest podcast of a specific user, or None if they have none."""
+        snapshot = self.series_cache.get(user_id)
+        if snapshot is not None:
+            return snapshot
+        
+        async with self.Session() as session:
+            result = await session.execute(
+                select(
+                    Podcast.id, Podcast.topic, Podcast.language, Podcast.intro_path, Podcast.episode_path,
+                    Podcast.episode_lineup, Podcast.episode_content, Podcast.episode_summary, Podcast.episode_number
+                ).filter_by(user_id=user_id).order_by(Podcast.created_at.desc()).limit(1)
+            )
+            row = result.first()
+            if row is None:
+                return None
+            snapshot = SeriesSnapshot(*row)
+            self.series_cache.put(user_id, snapshot)
+            return snapshot
+
+    async def get_telegram_file_id(self, path: str, file_size: int, file_mtime_ns: int):
+        """Get the Telegram file_id of an uploaded audio file, if the file hasn't changed since."""
+        async with self.Session() as session:
+            audio_file = await session.get(AudioFile, path)
+            if audio_file and audio_file.file_size == file_size and audio_file.file_mtime_ns == file_mtime_ns:
+                return audio_file.telegram_file_id
+            return None
+
+    async def save_telegram_file_id(self, path: str, telegram_file_id: str, file_size: int, file_mtime_ns: int):
+        """Remember the Telegram file_id returned when an audio file was uploaded."""
+        async with self.Session() as session:
+            try:
+                await session.merge(AudioFile(
+                    path=path,
+                    telegram_file_id=telegram_file_id,
+                    file_size=file_size,
+                    file_mtime_ns=file_mtime_ns,
+                    last_accessed_at=datetime.utcnow()
+                ))
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Error saving Telegram file_id: {e}")
+                await session.rollback()
+
+    async def touch_audio_file(self, path: str):
+        """Mark an audio file as just delivered, so it is evicted last."""
+        async with self.Session() as session:
+            try:
+                await session.execute(
+                    update(AudioFile).where(AudioFile.path == path).values(last_accessed_at=datetime.utcnow())
+                )
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Error touching audio file: {e}")
+                await session.rollback()
+
+    async def claim_prefetched_episode(self, user_id: int, topic: str, episode_number: int):
+        """
+        Move a prefetched episode into the user's podcast.
+        Returns True if the episode was available and its audio file still exists.
+        """
+        async with self.Session() as session:
+            try:
+                result = await session.execute(
+                    select(PrefetchedEpisode).filter_by(user_id=user_id, topic=topic, episode_number=episode_number).limit(1)
+                )
+                prefetched = result.scalars().first()
+                if not prefetched:
+                    return False
+                
+                await session.delete(prefetched)
+                if not await asyncio.to_thread(get_audio_store().exists, prefetched.episode_path):
+                    await session.commit()
+                    return False
+                
+                result = await session.execute(
+                    select(Podcast).filter_by(user_id=user_id).order_by(Podcast.created_at.desc()).limit(1)
+                )
+                podcast = result.scalars().first()
+                if podcast:
+                    podcast.episode_path = prefetched.episode_path
+                    podcast.episode_content = prefetched.episode_content
+                    podcast.episode_number = prefetched.episode_number
+                    podcast.episode_summary = prefetched.episode_summary
+                    snapshot = _snapshot(podcast)
+                await session.commit()
+                if podcast:
+                    self.series_cache.put(user_id, snapshot)
+                return podcast is not None
+            except Exception as e:
+                logger.error(f"Error claiming prefetched episode: {e}")
+                await session.rollback()
+                self.series_cache.invalidate(user_id)
+                return False
+
+    async def get_active_series(self, max_episodes: int = 5):
+        """
+        Get the podcasts that still have episodes left and no episode waiting to be claimed.
+        Returns (user_id, topic, language, next_episode_number) for each user's latest podcast.
+        """
+        async with self.Session() as session:
+            latest = select(
+                Podcast.user_id,
+                func.max(Podcast.created_at).label('created_at')
+            ).group_by(Podcast.user_id).subquery()
+            
+            result = await session.execute(
+                select(Podcast.user_id, Podcast.topic, Podcast.language, Podcast.episode_number).join(
+                    latest,
+                    and_(Podcast.user_id == latest.c.user_id, Podcast.created_at == latest.c.created_at)
+                ).filter(Podcast.episode_number < max_episodes)
+            )
+            podcasts = result.all()
+            
+            result = await session.execute(select(PrefetchedEpisode.user_id, PrefetchedEpisode.episode_number))
+            prefetched = set(tuple(row) for row in result.all())
+            
+            return [
+                (user_id, topic, language, episode_number + 1)
+                for user_id, topic, language, episode_number in podcasts
+                if (user_id, episode_number + 1) not in prefetched
+            ]
+
+    async def expire_prefetched_episodes(self, max_age_hours: float):
+        """Delete prefetched episodes (and their audio) that were never claimed."""
+        async with self.Session() as session:
+            try:
+                cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+                result = await session.execute(select(PrefetchedEpisode).filter(PrefetchedEpisode.created_at < cutoff))
+                expired = result.scalars().all()
+                for prefetched in expired:
+                    try:
+                        if prefetched.episode_path:
+                            await asyncio.to_thread(get_audio_store().delete, prefetched.episode_path)
+                    except Exception as e:
+                        logger.error(f"Error deleting files: {e}")
+                    await session.delete(prefetched)
+                await session.commit()
+                if expired:
+                    logger.info(f"Expired {len(expired)} unclaimed prefetched episodes")
+                return len(expired)
+            except Exception as e:
+                logger.error(f"Error expiring prefetched episodes: {e}")
+                await session.rollback()
+                return 0
+
+    async def clear_user_data(self, user_id: int):
+        """Clear all podcasts for a specific user."""
+        async with self.Session() as session:
+            try:
+                podcasts = (await session.execute(select(Podcast).filter_by(user_id=user_id))).scalars().all()
+                prefetched_episodes = (await session.execute(select(PrefetchedEpisode).filter_by(user_id=user_id))).scalars().all()
+                
+                # Delete files, including earlier episodes and voice variants that only audio_files knows about
+                paths = [p.intro_path for p in podcasts] + [p.episode_path for p in podcasts] + [p.episode_path for p in prefetched_episodes]
+                paths += (await session.execute(select(AudioFile.path).filter_by(user_id=user_id))).scalars().all()
+                paths = [path for path in paths if path]
+                for path in paths:
+                    try:
+                        await asyncio.to_thread(get_audio_store().delete, path)
+                    except Exception as e:
+                        logger.error(f"Error deleting files: {e}")
+                
+                # Delete database records
+                await session.execute(delete(AudioFile).where(AudioFile.path.in_(paths)))
+                await session.execute(delete(PrefetchedEpisode).filter_by(user_id=user_id))
+                await session.execute(delete(Podcast).filter_by(user_id=user_id))
+                await session.commit()
+                self.series_cache.invalidate(user_id)
+                return True
+            except Exception as e:
+                logger.error(f"Error clearing user data: {e}")
+                await session.rollback()
+                return False
+
+    async def enqueue_job(self, user_id: int, chain: str, topic: str, language: str, episode_number: int, priority: int, delivery: str = None, not_after: datetime = None):
+        """Queue a generation job, see Database.enqueue_job."""
+        async with self.Session() as session:
+            try:
+                job = GenerationJobRecord(
+                    user_id=user_id, chain=chain, topic=topic, language=language,
+                    episode_number=episode_number, priority=priority, delivery=delivery, not_after=not_after
+                )
+                session.add(job)
+                await session.commit()
+                return job.id
+            except IntegrityError:
+                await session.rollback()
+                return None
+
+    async def promote_job(self, user_id: int, topic: str, episode_number: int, priority: int):
+        """
+        Hand a pending prefetch of this episode over to the user who is asking for it:
+        it moves up the queue and the worker sends it once it's done.
+        Returns False if no such job is queued or running.
+        """
+        async with self.Session() as session:
+            result = await session.execute(
+                update(GenerationJobRecord)
+                .where(
+                    GenerationJobRecord.user_id == user_id,
+                    GenerationJobRecord.topic == topic,
+                    GenerationJobRecord.episode_number == episode_number,
+                    GenerationJobRecord.chain == 'prefetch',
+                    GenerationJobRecord.state.in_([JOB_QUEUED, JOB_LEASED])
+                )
+                .values(priority=priority, delivery='send', not_after=None)
+            )
+            await session.commit()
+            return bool(result.rowcount)
+
+    async def get_user_data(self, user_id: int):
+        """Get the stored context.user_data of a user (empty if there is none)."""
+        async with self.Session() as session:
+            row = await session.get(BotUserData, user_id)
+            return json.loads(row.data) if row and row.data else {}
+
+    async def save_user_data(self, user_id: int, data: dict):
+        """Store the context.user_data of a user."""
+        async with self.Session() as session:
+            try:
+                await session.merge(BotUserData(user_id=user_id, data=json.dumps(data)))
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Error saving user data: {e}")
+                await session.rollback()
+
+    async def drop_user_data(self, user_id: int):
+        """Delete the stored context.user_data of a user."""
+        async with self.Session() as session:
+            await session.execute(delete(BotUserData).filter_by(user_id=user_id))
+            await session.commit()
+
+    async def get_conversation_state(self, name: str, key: tuple):
+        """Get the state of a conversation, or None if it isn't in one."""
+        async with self.Session() as session:
+            row = await session.get(ConversationState, (name, json.dumps(list(key))))
+            return row.state if row else None
+
+    async def save_conversation_state(self, name: str, key: tuple, state):
+        """Store the state of a conversation. A state of None ends it."""
+        async with self.Session() as session:
+            try:
+                encoded_key = json.dumps(list(key))
+                if state is None:
+                    await session.execute(delete(ConversationState).filter_by(name=name, key=encoded_key))
+                else:
+                    await session.merge(ConversationState(name=name, key=encoded_key, state=state))
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Error saving conversation state: {e}")
+                await session.rollback()
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from metrics import Gauge, generation_seconds, record_error
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are picked up first by the workers
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 10
+PRIORITY_BATCH = 20
+
+
+class GenerationJob:
+    """A blocking generation call plus the coroutines that handle its outcome."""
+
+    def __init__(self, key, func, args, on_done=None, on_error=None, priority=PRIORITY_INTERACTIVE, on_finish=None, match=None):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.priority = priority
+        self.on_finish = on_finish
+        self.match = match
+        self.started = False
+
+
+class GenerationQueue:
+    """
+    Runs podcast generation off the Telegram event loop.
+
+    Handlers submit a job and return right away. A fixed number of worker
+    coroutines pull jobs from a priority queue and run the blocking LLM/TTS
+    chain in a thread pool, then await the job's callback on the event loop
+    so the result can be delivered through the bot.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or Config.GENERATION_WORKERS
+        self.executor = None
+        self.queue = None
+        self.jobs = {}
+        self._tasks = []
+        self._counter = itertools.count()
+
+    def start(self):
+        """Start the worker pool. Must be called from the bot's event loop."""
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="generation")
+        self.queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started generation queue with {self.workers} workers")
+
+    async def stop(self):
+        """Cancel the workers and drop any jobs that haven't started yet."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def is_pending(self, key):
+        """Return True if a job with this key is queued or running."""
+        return key in self.jobs
+
+    def depth(self):
+        """Number of jobs waiting for a free worker."""
+        return self.queue.qsize() if self.queue else 0
+
+    def submit(self, key, func, *args, on_done=None, on_error=None, priority=PRIORITY_INTERACTIVE, on_finish=None, match=None):
+        """
+        Queue func(*args) to run on a worker thread.
+        on_finish is a plain callable run after the job, whatever the outcome, and is kept if the job is promoted.
+        match describes what the job produces (e.g. topic and episode), so promote() only hands it to a request for the same thing.
+        Returns False without queueing anything if a job with the same key is already pending.
+        """
+        if key in self.jobs:
+            return False
+
+        job = GenerationJob(key, func, args, on_done, on_error, priority, on_finish, match)
+        self.jobs[key] = job
+        self.queue.put_nowait((priority, next(self._counter), job))
+        logger.info(f"Queued generation job {key} (priority {priority}, depth {self.depth()})")
+        return True
+
+    def promote(self, key, on_done=None, on_error=None, priority=PRIORITY_INTERACTIVE, match=None):
+        """
+        Hand a pending lower-priority job over to an interactive request.
+        The job takes the new callbacks and, if it hasn't started yet, moves up the queue.
+        Returns False if there is no such job with this key, or it was submitted with a different match.
+        """
+        job = self.jobs.get(key)
+        if not job or job.priority <= priority or job.match != match:
+            return False
+
+        job.on_done = on_done
+        job.on_error = on_error
+        job.priority = priority
+        if not job.started:
+            # The old queue entry is skipped once the job has started
+            self.queue.put_nowait((priority, next(self._counter), job))
+        logger.info(f"Promoted generation job {key} to priority {priority}")
+        return True
+
+    async def _worker(self, index):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self.queue.get()
+            if job.started:
+                self.queue.task_done()
+                continue
+            job.started = True
+            try:
+                try:
+                    with generation_seconds.time(chain=job.func.__name__):
+                        result = await loop.run_in_executor(self.executor, functools.partial(job.func, *job.args))
+                except Exception as e:
+                    self._forget(job)
+                    logger.error(f"Generation job {job.key} failed on worker {index}: {e}")
+                    record_error("generation", e)
+                    if job.on_error:
+                        await job.on_error(e)
+                else:
+                    self._forget(job)
+                    if job.on_done:
+                        await job.on_done(result)
+            except Exception as e:
+                logger.error(f"Error in callback of generation job {job.key}: {e}")
+            finally:
+                self._forget(job)
+                if job.on_finish:
+                    job.on_finish()
+                self.queue.task_done()
+
+    def _forget(self, job):
+        """
+        Free the job's key. Done as soon as generation is over, so the prefetch queued by
+        on_done and the user's next request aren't turned away during the delivery.
+        """
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+
+
+# Shared queue used by the bot handlers
+generation_queue = GenerationQueue()
+
+Gauge('generation_queue_depth', "Generation jobs waiting for a free worker", callback=generation_queue.depth)
+Gauge(
+    'generation_jobs_running', "Generation jobs currently running",
+    callback=lambda: sum(1 for job in list(generation_queue.jobs.values()) if job.started)
+)
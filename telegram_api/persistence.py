@@ -0,0 +1,114 @@
+import logging
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+
+class DatabasePersistence(BasePersistence):
+    """
+    Keeps context.user_data and conversation states in the database, so every
+    replica sees the same state whichever one Telegram's update lands on.
+
+    Nothing is loaded up front: user_data is read again before every update
+    (refresh_user_data) and conversation states by SharedConversationHandler.load_state.
+    Writes go out at the end of every update, see flush_shared_state.
+    """
+
+    def __init__(self, get_adb, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.get_adb = get_adb
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        await self.get_adb().save_user_data(user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        await self.get_adb().save_conversation_state(name, key, new_state)
+
+    async def drop_user_data(self, user_id):
+        await self.get_adb().drop_user_data(user_id)
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        data = await self.get_adb().get_user_data(user_id)
+        user_data.clear()
+        user_data.update(data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+class SharedConversationHandler(ConversationHandler):
+    """
+    ConversationHandler whose state for an update can be reloaded from the persistence.
+
+    There is no public API for this, so load_state works on the handler's internal
+    TrackingDict. That is why python-telegram-bot is pinned to an exact version;
+    tests/test_persistence.py checks the behaviour when upgrading it.
+    """
+
+    async def load_state(self, update: Update, persistence: DatabasePersistence) -> None:
+        """Replace the in-memory state of this update's conversation with the stored one."""
+        if not isinstance(update, Update) or not update.effective_user or not update.effective_chat:
+            return
+        key = self._get_key(update)
+        state = await persistence.get_adb().get_conversation_state(self.name, key)
+        if state is None:
+            # Bypass the tracking, so removing the stale local state isn't written back as a change
+            self._conversations.data.pop(key, None)
+        else:
+            self._conversations.update_no_track({key: state})
+
+
+def shared_state_handlers(conv_handler: SharedConversationHandler):
+    """
+    Callbacks to register in the first and last handler groups. The first loads the
+    conversation state of the update, the last writes user_data and conversation
+    states back straight away instead of every update_interval seconds.
+    """
+
+    async def load_shared_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # user_data has already been refreshed when this context was built
+        await conv_handler.load_state(update, context.application.persistence)
+
+    async def flush_shared_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if update.effective_user:
+            context.application.mark_data_for_update_persistence(user_ids=update.effective_user.id)
+        await context.application.update_persistence()
+
+    return load_shared_state, flush_shared_state
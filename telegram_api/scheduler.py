@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, ContextTypes
+from config import Config
+from llm.llm import prefetch_chain
+from telegram_api.jobs import generation_queue, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+
+def schedule_daily_batch(application: Application, get_db, get_adb) -> None:
+    """
+    Register the nightly episode batch with the application's JobQueue.
+    get_db/get_adb return the sync and async databases, which are created lazily.
+    """
+    if not Config.DAILY_BATCH_ENABLED:
+        return
+
+    start = datetime.time(hour=Config.DAILY_BATCH_START_HOUR, tzinfo=datetime.timezone.utc)
+    application.job_queue.run_daily(run_daily_batch, time=start, name="daily_batch", data=(get_db, get_adb))
+    logger.info(f"Daily batch scheduled at {start.strftime('%H:%M')} UTC")
+
+
+async def run_daily_batch(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Generate the next episode of every active podcast.
+
+    Episodes are stored as prefetched episodes, so they are sent instantly when the
+    user presses "Next Episode". At most DAILY_BATCH_CONCURRENCY generations run at
+    once, and no new ones are started after the off-peak window closes.
+    """
+    # The generation workers use the sync database, the batch itself the async one
+    get_db, get_adb = context.job.data
+    db, adb = get_db(), get_adb()
+    deadline = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=Config.DAILY_BATCH_WINDOW_HOURS)
+
+    await adb.expire_prefetched_episodes(Config.PREFETCH_TTL_HOURS)
+    series = await adb.get_active_series()
+    logger.info(f"Daily batch started for {len(series)} podcasts")
+
+    if Config.JOB_BACKEND == 'database':
+        # The workers of every process share the jobs, and interactive jobs still go first. The workers
+        # run at most DAILY_BATCH_CONCURRENCY of them at once and drop those still queued at the deadline
+        not_after = deadline.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        for user_id, topic, language, episode_number in series:
+            await adb.enqueue_job(
+                user_id, 'prefetch', topic, language, episode_number, PRIORITY_BATCH,
+                delivery='notify', not_after=not_after
+            )
+        return
+
+    semaphore = asyncio.Semaphore(Config.DAILY_BATCH_CONCURRENCY)
+
+    for index, (user_id, topic, language, episode_number) in enumerate(series):
+        await semaphore.acquire()
+        if datetime.datetime.now(datetime.timezone.utc) >= deadline:
+            semaphore.release()
+            logger.info(f"Daily batch window closed, {len(series) - index} podcasts left for tomorrow")
+            break
+
+        async def on_done(_, user_id=user_id, topic=topic, episode_number=episode_number):
+            await notify_episode_ready(context.bot, user_id, topic, episode_number)
+
+        if not generation_queue.submit(
+            user_id, prefetch_chain, topic, language, user_id, db, episode_number,
+            on_done=on_done, priority=PRIORITY_BATCH, on_finish=semaphore.release
+        ):
+            # The user is already generating something, leave them alone tonight
+            semaphore.release()
+
+
+async def notify_episode_ready(bot, user_id: int, topic: str, episode_number: int) -> None:
+    """Let the user know that their next episode is waiting for them."""
+    keyboard = [[InlineKeyboardButton("Next Episode ▶️", callback_data='next_episode')]]
+    await bot.send_message(
+        chat_id=user_id,
+        text=f"Good morning! ☀️ Episode {episode_number} of your podcast about '{topic}' is ready! 🎙️",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from telegram.ext import Application, ContextTypes
+from config import Config
+from llm.audio_store import EPISODES_ROOT, get_audio_store
+from metrics import storage_bytes, storage_removed_files
+
+logger = logging.getLogger(__name__)
+
+
+def voice_variant_path(path):
+    return os.path.splitext(path)[0] + '.ogg'
+
+
+def make_voice_variant(db, path, user_id):
+    """
+    Encode an Opus copy of an MP3 episode for sendVoice, next to it, and store and track it.
+    Returns its path, or None if it can't be made (e.g. ffmpeg is missing).
+    """
+    store = get_audio_store()
+    variant = voice_variant_path(path)
+    tmp_path = f"{variant}.part"
+    try:
+        local_path = store.local_copy(path)
+        if os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(local_path):
+            return variant
+        from pydub import AudioSegment
+        AudioSegment.from_mp3(local_path).export(tmp_path, format='ogg', codec='libopus', bitrate=Config.VOICE_BITRATE)
+        os.replace(tmp_path, variant)
+        store.publish(variant)
+    except Exception as e:
+        logger.warning(f"Could not encode a voice variant of {path}, sending the MP3: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    logger.info(f"Encoded {variant} ({os.path.getsize(variant)} bytes, MP3 {os.path.getsize(path)} bytes)")
+    db.track_audio_files(user_id, [variant])
+    return variant
+
+
+class StorageManager:
+    """
+    Keeps the episodes directory tidy and within STORAGE_QUOTA_BYTES.
+
+    Every episode file is tracked in the audio_files table with its size and last
+    delivery. A sweep deletes files nothing refers to, forgets rows whose file is
+    gone, then evicts the least recently delivered files until the rest fits in the
+    quota. Files younger than the grace period may still be in the middle of being
+    generated, and prefetched episodes are still waiting for their user, so neither
+    is ever removed.
+
+    With a bucket as the audio store the directory only holds local copies: evicting
+    them frees the disk but the audio, and its row, stay in the bucket.
+    """
+
+    def __init__(self, db, root=EPISODES_ROOT, quota_bytes=None, grace_seconds=None, store=None):
+        self.db = db
+        self.store = store or get_audio_store()
+        self.root = root
+        self.quota_bytes = Config.STORAGE_QUOTA_BYTES if quota_bytes is None else quota_bytes
+        self.grace_seconds = Config.STORAGE_GRACE_MINUTES * 60 if grace_seconds is None else grace_seconds
+
+    def _remove(self, path, reason):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not remove {path}: {e}")
+            return False
+        storage_removed_files.inc(reason=reason)
+        return True
+
+    def sweep(self):
+        """Run one sweep. Returns how many files were removed, and the bytes left."""
+        now = time.time()
+        tracked = {audio_file.path: audio_file for audio_file in self.db.get_audio_files()}
+        referenced = self.db.get_episode_paths()
+
+        # Files on disk that nothing refers to, including .part leftovers of crashed writes
+        sizes, orphans = {}, 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if path in tracked or now - stat.st_mtime < self.grace_seconds:
+                    sizes[path] = stat.st_size
+                elif path in referenced:
+                    # Written before files were tracked
+                    self.db.track_audio_files(referenced[path], [path])
+                    sizes[path] = stat.st_size
+                elif self._remove(path, 'orphan'):
+                    orphans += 1
+
+        # Rows whose file was deleted some other way, e.g. an expired prefetch
+        missing = []
+        if self.store.local:
+            missing = [path for path in tracked if path not in sizes and not os.path.exists(path)]
+            self.db.forget_audio_files(missing)
+
+        evicted = 0
+        total = sum(sizes.values())
+        if self.quota_bytes and total > self.quota_bytes:
+            protected = self.db.get_prefetched_paths()
+            cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+            removed = []
+            for audio_file in tracked.values():  # least recently used first
+                if total <= self.quota_bytes:
+                    break
+                if audio_file.path not in sizes or audio_file.path in protected:
+                    continue
+                if audio_file.last_accessed_at and audio_file.last_accessed_at > cutoff:
+                    continue
+                if self._remove(audio_file.path, 'quota'):
+                    total -= sizes.pop(audio_file.path)
+                    removed.append(audio_file.path)
+            if self.store.local:
+                self.db.forget_audio_files(removed)
+            evicted = len(removed)
+            if total > self.quota_bytes:
+                logger.warning(f"Episode storage is still over quota after eviction: {total} of {self.quota_bytes} bytes")
+
+        storage_bytes.set(total)
+        if orphans or missing or evicted:
+            logger.info(f"Storage sweep removed {orphans} orphaned and {evicted} evicted files, forgot {len(missing)} missing ones, {total} bytes left")
+        return {'orphans': orphans, 'missing': len(missing), 'evicted': evicted, 'bytes': total}
+
+
+def schedule_storage_sweep(application: Application, get_db) -> None:
+    """Register the periodic storage sweep with the application's JobQueue."""
+    if not Config.STORAGE_SWEEP_MINUTES:
+        return
+    interval = Config.STORAGE_SWEEP_MINUTES * 60
+    application.job_queue.run_repeating(run_storage_sweep, interval=interval, first=60, name="storage_sweep", data=get_db)
+
+
+async def run_storage_sweep(context: ContextTypes.DEFAULT_TYPE) -> None:
+    # File and database work both block, so the sweep runs in a thread
+    get_db = context.job.data
+    try:
+        await asyncio.to_thread(lambda: StorageManager(get_db()).sweep())
+    except Exception as e:
+        logger.error(f"Storage sweep failed: {e}")
@@ -0,0 +1,151 @@
+import asyncio
+import functools
+import logging
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from telegram import Bot
+from config import Config
+from metrics import generation_seconds, record_error, start_metrics_server
+from llm.llm import start_chain, start_initial_chain, prefetch_chain
+from llm.clients import close_clients
+from telegram_api.bot import TOKEN, get_db, get_adb, deliver_podcast, remember_episode, schedule_prefetch, ProgressiveDelivery
+from telegram_api.scheduler import notify_episode_ready
+
+logger = logging.getLogger(__name__)
+
+CHAINS = {
+    'initial': start_initial_chain,
+    'next': start_chain,
+    'prefetch': prefetch_chain,
+}
+
+
+class JobWorkerPool:
+    """
+    Workers that lease jobs from the generation_jobs table, so any number of bot
+    and worker processes share the generation load without running a job twice.
+
+    A job's lease is renewed while its chain runs. If the process dies, the lease
+    runs out and another worker picks the job up again (up to JOB_MAX_ATTEMPTS times).
+    """
+
+    def __init__(self, bot, workers=None, user_data=None):
+        self.bot = bot
+        self.user_data = user_data  # the application's user_data, when running in the bot process
+        self.workers = workers or Config.GENERATION_WORKERS
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.executor = None
+        self._tasks = []
+
+    def start(self):
+        """Start the workers. Must be called from a running event loop."""
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="generation")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started {self.workers} job workers as {self.owner}")
+
+    async def stop(self):
+        """Cancel the workers. Jobs they were running are picked up again once their lease expires."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def _worker(self, index):
+        while True:
+            try:
+                job = await asyncio.to_thread(
+                    get_db().claim_job, self.owner, Config.JOB_LEASE_SECONDS, Config.JOB_MAX_ATTEMPTS,
+                    Config.DAILY_BATCH_CONCURRENCY
+                )
+            except Exception as e:
+                logger.error(f"Job worker {index} could not claim a job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(Config.JOB_POLL_INTERVAL)
+                continue
+            await self._run(job, index)
+
+    async def _keep_lease(self, job):
+        while True:
+            await asyncio.sleep(Config.JOB_LEASE_SECONDS / 3)
+            if not await asyncio.to_thread(get_db().renew_job_lease, job.id, self.owner, Config.JOB_LEASE_SECONDS):
+                logger.warning(f"Lost the lease of generation job {job.id}")
+                return
+
+    async def _run(self, job, index):
+        db = get_db()
+        args = (job.topic, job.language, job.user_id, db)
+        if job.chain != 'initial':
+            args += (job.episode_number,)
+        # Prefetches wait for the user anyway, and retries deliver everything at the end like before
+        progressive = None
+        if Config.PROGRESSIVE_DELIVERY and job.chain != 'prefetch' and job.attempts == 1:
+            progressive = ProgressiveDelivery(self.bot, job.user_id, job.topic, job.episode_number)
+            args += (progressive,)
+        logger.info(f"Worker {index} running generation job {job.id} ({job.chain}, attempt {job.attempts})")
+
+        loop = asyncio.get_running_loop()
+        lease = asyncio.create_task(self._keep_lease(job))
+        try:
+            with generation_seconds.time(chain=CHAINS[job.chain].__name__):
+                await loop.run_in_executor(self.executor, functools.partial(CHAINS[job.chain], *args))
+        except Exception as e:
+            logger.error(f"Generation job {job.id} failed on worker {index}: {e}")
+            record_error("generation", e)
+            if progressive:
+                await progressive.finish()
+            final, delivery = await asyncio.to_thread(db.fail_job, job.id, self.owner, str(e), Config.JOB_MAX_ATTEMPTS)
+            if final and delivery == 'send':
+                await self.bot.send_message(
+                    chat_id=job.user_id,
+                    text="Sorry, something went wrong while sending your podcast. Please try again later. 😔"
+                )
+            return
+        finally:
+            lease.cancel()
+
+        sent = await progressive.finish() if progressive else ()
+        done, delivery = await asyncio.to_thread(db.complete_job, job.id, self.owner)
+        if not done:
+            logger.warning(f"Generation job {job.id} finished after its lease was taken over, result not delivered")
+            return
+
+        try:
+            if delivery == 'send':
+                # A prefetch the user asked for while it was running is moved into their podcast first
+                if job.chain == 'prefetch' and not await get_adb().claim_prefetched_episode(job.user_id, job.topic, job.episode_number):
+                    return
+                if await deliver_podcast(self.bot, job.user_id, job.topic, job.episode_number, sent):
+                    await remember_episode(
+                        job.user_id, job.topic, job.language, job.episode_number,
+                        self.user_data[job.user_id] if self.user_data is not None else None
+                    )
+                    await schedule_prefetch(job.user_id, job.topic, job.language, job.episode_number + 1)
+            elif delivery == 'notify':
+                await notify_episode_ready(self.bot, job.user_id, job.topic, job.episode_number)
+        except Exception as e:
+            logger.error(f"Error delivering generation job {job.id}: {e}")
+
+
+async def run_workers():
+    """Run a pool of job workers until the process is stopped."""
+    start_metrics_server(Config.METRICS_PORT)
+    # Workers join a database the bot already set up, and must never wipe its podcasts and queued jobs
+    await asyncio.to_thread(get_db, False)
+    async with Bot(TOKEN, base_url=Config.TELEGRAM_BASE_URL, base_file_url=Config.TELEGRAM_BASE_FILE_URL) as bot:
+        pool = JobWorkerPool(bot)
+        pool.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await pool.stop()
+            await close_clients()
+            await get_adb().close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run_workers())
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from telegram_api.jobs import GenerationQueue, PRIORITY_INTERACTIVE, PRIORITY_PREFETCH
+
+
+def run(test):
+    async def main():
+        queue = GenerationQueue(workers=2)
+        queue.start()
+        try:
+            await asyncio.wait_for(test(queue), 5)
+        finally:
+            await queue.stop()
+    asyncio.run(main())
+
+
+def test_key_is_free_again_when_on_done_runs():
+    async def test(queue):
+        resubmitted = asyncio.Event()
+
+        async def on_done(result):
+            assert result == 'episode'
+            assert not queue.is_pending(1)
+            # e.g. the prefetch of the next episode, queued while the current one is delivered
+            assert queue.submit(1, lambda: 'next', on_done=lambda _: asyncio.sleep(0, resubmitted.set()))
+
+        assert queue.submit(1, lambda: 'episode', on_done=on_done)
+        await resubmitted.wait()
+    run(test)
+
+
+def test_key_is_free_again_when_on_error_runs():
+    async def test(queue):
+        handled = asyncio.Event()
+
+        def fail():
+            raise RuntimeError("boom")
+
+        async def on_error(e):
+            assert isinstance(e, RuntimeError)
+            assert not queue.is_pending(1)
+            handled.set()
+
+        queue.submit(1, fail, on_error=on_error)
+        await handled.wait()
+    run(test)
+
+
+def test_same_key_is_rejected_while_pending():
+    async def test(queue):
+        release = threading.Event()
+        done = asyncio.Event()
+
+        assert queue.submit(1, release.wait, on_done=lambda _: asyncio.sleep(0, done.set()))
+        assert not queue.submit(1, lambda: None)
+        assert queue.submit(2, lambda: None)
+        release.set()
+        await done.wait()
+        assert not queue.is_pending(1)
+    run(test)
+
+
+def test_promote_hands_a_pending_job_new_callbacks():
+    async def test(queue):
+        release = threading.Event()
+        delivered = asyncio.Event()
+
+        queue.submit(1, release.wait, priority=PRIORITY_PREFETCH, match=('octopuses', 2))
+        assert queue.promote(
+            1, on_done=lambda _: asyncio.sleep(0, delivered.set()), priority=PRIORITY_INTERACTIVE, match=('octopuses', 2)
+        )
+        assert not queue.promote(1, priority=PRIORITY_INTERACTIVE, match=('octopuses', 2))  # already interactive
+        release.set()
+        await delivered.wait()
+    run(test)
+
+
+def test_promote_ignores_a_job_for_another_episode():
+    async def test(queue):
+        release = threading.Event()
+        done = asyncio.Event()
+
+        queue.submit(1, release.wait, priority=PRIORITY_PREFETCH, on_done=lambda _: asyncio.sleep(0, done.set()),
+                     match=('octopuses', 3))
+        assert not queue.promote(1, priority=PRIORITY_INTERACTIVE, match=('octopuses', 2))
+        assert not queue.promote(1, priority=PRIORITY_INTERACTIVE, match=('volcanoes', 3))
+        release.set()
+        await done.wait()  # the prefetch kept its own callbacks
+    run(test)
@@ -0,0 +1,44 @@
+from llm.mp3 import frame_length, iter_frames, iter_joined_frames, skip_id3v2
+
+# MPEG1 layer III, 128 kbps, 44.1 kHz, no padding
+HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+FRAME_LENGTH = 417
+
+
+def frame(fill=b'\x01'):
+    return HEADER + fill * (FRAME_LENGTH - 4)
+
+
+def info_frame():
+    body = b'\x00' * 32 + b'Info'
+    return HEADER + body + b'\x00' * (FRAME_LENGTH - 4 - len(body))
+
+
+def id3v2(size):
+    # Syncsafe size: 7 bits per byte
+    return b'ID3\x04\x00\x00' + bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F]) + b'\x00' * size
+
+
+def test_frame_length():
+    assert frame_length(HEADER) == FRAME_LENGTH
+    assert frame_length(bytes([0xFF, 0xFB, 0x92, 0x00])) == FRAME_LENGTH + 1  # padding
+    assert frame_length(b'\x00\x00\x00\x00') is None
+    assert frame_length(bytes([0xFF, 0xFB, 0xF0, 0x00])) is None  # bad bitrate index
+
+
+def test_skip_id3v2():
+    assert skip_id3v2(id3v2(300) + frame()) == 310
+    assert skip_id3v2(frame()) == 0
+
+
+def test_iter_frames_skips_tags_info_frame_and_junk():
+    frames = [frame(b'\x01'), frame(b'\x02')]
+    data = id3v2(20) + info_frame() + frames[0] + b'junk' + frames[1] + b'TAG' + b'\x00' * 125
+    assert list(iter_frames(data)) == frames
+
+
+def test_iter_joined_frames_keeps_only_audio_frames(tmp_path):
+    first, second = tmp_path / 'a.mp3', tmp_path / 'b.mp3'
+    first.write_bytes(id3v2(10) + info_frame() + frame(b'\x01'))
+    second.write_bytes(id3v2(10) + info_frame() + frame(b'\x02') + frame(b'\x03'))
+    assert list(iter_joined_frames([first, second])) == [frame(b'\x01'), frame(b'\x02'), frame(b'\x03')]
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from telegram import Chat, Message, Update, User
+from telegram.ext import CommandHandler, MessageHandler, filters
+from telegram_api.persistence import DatabasePersistence, SharedConversationHandler
+
+WAITING_FOR_TOPIC = 1
+
+
+class FakeDatabase:
+    def __init__(self, states):
+        self.states = states
+
+    async def get_conversation_state(self, name, key):
+        return self.states.get((name, key))
+
+
+def make_handler(persistence):
+    """A persistent handler set up the way Application.initialize() does it."""
+    async def callback(update, context):
+        pass
+
+    handler = SharedConversationHandler(
+        entry_points=[CommandHandler("start", callback)],
+        states={WAITING_FOR_TOPIC: [MessageHandler(filters.TEXT & ~filters.COMMAND, callback)]},
+        fallbacks=[],
+        name="podcast",
+        persistent=True,
+    )
+    asyncio.run(handler._initialize_persistence(SimpleNamespace(persistence=persistence)))
+    return handler
+
+
+def text_update(text, user_id=42):
+    user = User(id=user_id, first_name="Ada", is_bot=False)
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    return Update(update_id=1, message=Message(message_id=1, date=datetime.now(), chat=chat, from_user=user, text=text))
+
+
+def test_load_state_takes_the_stored_state():
+    persistence = DatabasePersistence(lambda: FakeDatabase({("podcast", (42, 42)): WAITING_FOR_TOPIC}))
+    handler = make_handler(persistence)
+    update = text_update("octopuses")
+
+    assert not handler.check_update(update)  # no conversation yet, and text isn't an entry point
+    asyncio.run(handler.load_state(update, persistence))
+    assert handler.check_update(update)  # the state another replica stored: waiting for a topic
+    # Loading isn't a change, so it mustn't be written back by update_persistence()
+    assert not handler._conversations.pop_accessed_write_items()
+
+
+def test_load_state_drops_stale_local_state():
+    stored = {("podcast", (42, 42)): WAITING_FOR_TOPIC}
+    persistence = DatabasePersistence(lambda: FakeDatabase(stored))
+    handler = make_handler(persistence)
+    update = text_update("octopuses")
+
+    asyncio.run(handler.load_state(update, persistence))
+    stored.clear()  # the conversation ended on another replica
+    asyncio.run(handler.load_state(update, persistence))
+    assert not handler.check_update(update)
+    assert not handler._conversations.pop_accessed_write_items()
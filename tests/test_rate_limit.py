@@ -0,0 +1,155 @@
+import pytest
+from llm import rate_limit
+from llm.rate_limit import AdaptiveConcurrency, TokenBucket, VendorLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+
+def test_bucket_starts_full_then_waits_for_refill(clock):
+    bucket = TokenBucket(60)  # one unit a second
+    bucket.take(60)
+    assert clock.slept == 0
+    bucket.take(3)
+    assert clock.slept == pytest.approx(3)
+
+
+def test_bucket_charge_leaves_debt_for_later_callers(clock):
+    bucket = TokenBucket(60)
+    bucket.take(10)
+    bucket.charge(60)  # the call used 70 units, 10 more than there were
+    bucket.take(1)
+    assert clock.slept == pytest.approx(11)
+
+
+def test_oversized_take_only_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    bucket.take(600)
+    assert clock.slept == pytest.approx(60)
+
+
+def test_zero_rate_is_unlimited(clock):
+    bucket = TokenBucket(0)
+    bucket.take(10 ** 9)
+    bucket.charge(10 ** 9)
+    bucket.take(1)
+    assert clock.slept == 0
+
+
+def test_zero_concurrency_is_unlimited(clock):
+    concurrency = AdaptiveConcurrency(0)
+    slots = [concurrency.acquire() for _ in range(100)]
+    assert concurrency.in_flight == 100
+    concurrency.release(slots.pop(), throttled=True)
+    for started in slots:
+        concurrency.release(started)
+    assert concurrency.in_flight == 0
+    concurrency.acquire()
+
+
+def test_concurrency_halves_on_throttling_and_grows_back(clock):
+    limiter = AdaptiveConcurrency(8)
+    started = [limiter.acquire() for _ in range(3)]
+    clock.now += 1
+    limiter.release(started[0], throttled=True)
+    assert limiter.limit == 4
+    # Calls that were already in flight when the limit was cut don't cut it again
+    limiter.release(started[1], throttled=True)
+    assert limiter.limit == 4
+    limiter.release(started[2])
+    assert limiter.limit == pytest.approx(4.25)
+    for _ in range(100):
+        limiter.release(limiter.acquire())
+    assert limiter.limit == 8
+
+
+def test_concurrency_never_drops_below_one(clock):
+    limiter = AdaptiveConcurrency(2)
+    for _ in range(5):
+        clock.now += 1
+        limiter.release(limiter.acquire(), throttled=True)
+    assert limiter.limit == 1
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def test_vendor_call_retries_transient_errors(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit.Config, 'RETRY_MAX_ATTEMPTS', 3)
+    limiter = VendorLimiter("Test", 0, 0, 4)
+    results = [Throttled(), Throttled(), 'ok']
+
+    def call():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert limiter.call(call) == 'ok'
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_vendor_call_gives_up_on_client_errors_and_after_max_attempts(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit.Config, 'RETRY_MAX_ATTEMPTS', 3)
+    limiter = VendorLimiter("Test", 0, 0, 4)
+    calls = []
+
+    def fail(error):
+        calls.append(error)
+        raise error
+
+    with pytest.raises(BadRequest):
+        limiter.call(lambda: fail(BadRequest()))
+    assert len(calls) == 1
+
+    with pytest.raises(Throttled):
+        limiter.call(lambda: fail(Throttled()))
+    assert len(calls) == 1 + 3
+
+
+def test_vendor_stream_holds_the_slot_until_consumed(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit.Config, 'RETRY_MAX_ATTEMPTS', 3)
+    limiter = VendorLimiter("Test", 0, 0, 4)
+    results = [Throttled(), iter('abc')]
+
+    def open_stream():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with limiter.stream(open_stream) as stream:
+        for _ in stream:
+            assert limiter.concurrency.in_flight == 1
+    assert limiter.concurrency.in_flight == 0
+
+    with pytest.raises(RuntimeError):
+        with limiter.stream(lambda: iter('abc')):
+            raise RuntimeError("connection dropped mid-stream")
+    assert limiter.concurrency.in_flight == 0
@@ -0,0 +1,64 @@
+from llm.ssml import SSMLChunker, split_ssml, plain_text
+
+SCRIPT = (
+    "<speak><p>First sentence here. Second sentence here.</p>"
+    "<p><emphasis level=\"moderate\">Third sentence. Fourth sentence.</emphasis></p></speak>"
+)
+
+
+def test_short_script_is_one_segment():
+    assert split_ssml(SCRIPT, 10_000) == [SCRIPT]
+
+
+def test_segments_keep_every_word_in_order():
+    segments = split_ssml(SCRIPT, 40)
+    assert len(segments) > 1
+    assert ' '.join(plain_text(segment) for segment in segments) == plain_text(SCRIPT)
+
+
+def test_tags_open_at_a_cut_are_closed_and_reopened():
+    segments = split_ssml(SCRIPT, 20)
+    cut = next(segment for segment in segments if 'Fourth' in segment)
+    assert cut.startswith('<speak><p><emphasis level="moderate">')
+    assert cut.endswith('</emphasis></p></speak>')
+    for segment in segments:
+        assert segment.startswith('<speak>') and segment.endswith('</speak>')
+
+
+def test_cuts_only_happen_between_sentences():
+    for segment in split_ssml(SCRIPT, 1):
+        assert plain_text(segment).endswith('.')
+
+
+def test_segments_without_speech_are_dropped():
+    assert split_ssml("<speak><p>Only this.</p><break time=\"1s\"/></speak>", 5) == ["<speak><p>Only this.</p></speak>"]
+
+
+def chunk(text, min_chars, piece_size):
+    chunker = SSMLChunker(min_chars)
+    segments = []
+    for start in range(0, len(text), piece_size):
+        segments += chunker.feed(text[start:start + piece_size])
+    return segments + chunker.finish()
+
+
+def test_chunker_cuts_where_split_ssml_does():
+    for piece_size in (1, 7, len(SCRIPT)):
+        segments = chunk(SCRIPT, 1, piece_size)
+        assert segments == split_ssml(SCRIPT, 1)
+
+
+def test_chunker_waits_for_min_chars():
+    segments = chunk(SCRIPT, 40, 5)
+    assert 1 < len(segments) < len(chunk(SCRIPT, 1, 5))
+    assert ' '.join(plain_text(segment) for segment in segments) == plain_text(SCRIPT)
+    for segment in segments[:-1]:
+        assert len(segment) >= 40  # raw SSML, tags included
+
+
+def test_chunker_holds_back_an_unfinished_sentence():
+    chunker = SSMLChunker(1)
+    assert chunker.feed("<speak><p>Complete sentence. Still being wri") == ["<speak><p>Complete sentence.</p></speak>"]
+    assert chunker.feed("tten.") == []
+    assert chunker.feed(" More") == ["<speak><p>Still being written.</p></speak>"]
+    assert chunker.finish() == ["<speak><p>More</p></speak>"]
@@ -0,0 +1,97 @@
+import os
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from telegram_api.database import AudioFileInfo
+from telegram_api.storage import StorageManager
+
+HOUR = 3600
+
+
+class FakeDatabase:
+    """The audio_files bookkeeping StorageManager needs, in memory."""
+
+    def __init__(self, files, referenced=None, prefetched=()):
+        self.files = files  # least recently delivered first, like get_audio_files
+        self.referenced = referenced or {}
+        self.prefetched = set(prefetched)
+
+    def get_audio_files(self):
+        return list(self.files)
+
+    def get_episode_paths(self):
+        return dict(self.referenced)
+
+    def get_prefetched_paths(self):
+        return set(self.prefetched)
+
+    def track_audio_files(self, user_id, paths):
+        self.files += [AudioFileInfo(path, user_id, os.path.getsize(path), None) for path in paths]
+
+    def forget_audio_files(self, paths):
+        self.files = [audio_file for audio_file in self.files if audio_file.path not in paths]
+
+
+def write(root, name, size, age_hours):
+    path = os.path.join(root, '1', name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as audio_file:
+        audio_file.write(b'\x00' * size)
+    mtime = time.time() - age_hours * HOUR
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def delivered(path, hours_ago):
+    return AudioFileInfo(path, 1, os.path.getsize(path), datetime.utcnow() - timedelta(hours=hours_ago))
+
+
+def sweep(db, root, quota_bytes):
+    return StorageManager(db, root=str(root), quota_bytes=quota_bytes, grace_seconds=HOUR, store=SimpleNamespace(local=True)).sweep()
+
+
+def test_evicts_least_recently_delivered_first(tmp_path):
+    oldest = write(tmp_path, 'episode_1.mp3', 100, 48)
+    older = write(tmp_path, 'episode_2.mp3', 100, 48)
+    recent = write(tmp_path, 'episode_3.mp3', 100, 48)
+    db = FakeDatabase([delivered(oldest, 30), delivered(older, 20), delivered(recent, 10)])
+
+    result = sweep(db, tmp_path, quota_bytes=150)
+
+    assert result == {'orphans': 0, 'missing': 0, 'evicted': 2, 'bytes': 100}
+    assert os.path.exists(recent) and not os.path.exists(oldest) and not os.path.exists(older)
+    assert [audio_file.path for audio_file in db.files] == [recent]
+
+
+def test_never_evicts_prefetched_or_recently_delivered_files(tmp_path):
+    prefetched = write(tmp_path, 'episode_2.mp3', 100, 48)
+    just_sent = write(tmp_path, 'episode_1.mp3', 100, 48)
+    db = FakeDatabase([delivered(prefetched, 30), delivered(just_sent, 0.1)], prefetched=[prefetched])
+
+    result = sweep(db, tmp_path, quota_bytes=50)
+
+    assert result['evicted'] == 0 and result['bytes'] == 200
+    assert os.path.exists(prefetched) and os.path.exists(just_sent)
+
+
+def test_removes_orphans_but_keeps_young_and_referenced_files(tmp_path):
+    orphan = write(tmp_path, 'old.mp3.part', 10, 48)
+    young = write(tmp_path, 'episode_2.mp3', 10, 0)
+    referenced = write(tmp_path, 'episode_1.mp3', 10, 48)
+    db = FakeDatabase([], referenced={referenced: 1})
+
+    result = sweep(db, tmp_path, quota_bytes=0)
+
+    assert result['orphans'] == 1
+    assert not os.path.exists(orphan) and os.path.exists(young) and os.path.exists(referenced)
+    # Files written before tracking started are tracked from now on
+    assert [audio_file.path for audio_file in db.files] == [referenced]
+
+
+def test_forgets_rows_whose_file_is_gone(tmp_path):
+    kept = write(tmp_path, 'episode_1.mp3', 10, 48)
+    gone = os.path.join(tmp_path, '1', 'episode_2.mp3')
+    db = FakeDatabase([delivered(kept, 30), AudioFileInfo(gone, 1, 10, None)])
+
+    assert sweep(db, tmp_path, quota_bytes=0)['missing'] == 1
+    assert [audio_file.path for audio_file in db.files] == [kept]
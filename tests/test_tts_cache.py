@@ -0,0 +1,48 @@
+import os
+
+from llm.tts_cache import TTSCache
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_cache_entries_do_not_share_inodes_with_episodes(tmp_path):
+    cache = TTSCache(str(tmp_path / 'cache'), max_bytes=1024)
+    episode = tmp_path / 'episode.mp3'
+    write(episode, b'audio')
+    cache.store('key', str(episode))
+
+    copy = tmp_path / 'copy.mp3'
+    assert cache.fetch('key', str(copy))
+    cached = tmp_path / 'cache' / 'key.mp3'
+    assert os.stat(cached).st_ino != os.stat(episode).st_ino
+    assert os.stat(cached).st_ino != os.stat(copy).st_ino
+    assert copy.read_bytes() == b'audio'
+
+
+def test_fetch_leaves_delivered_episode_mtime_alone(tmp_path):
+    cache = TTSCache(str(tmp_path / 'cache'), max_bytes=1024)
+    episode = tmp_path / 'episode.mp3'
+    write(episode, b'audio')
+    os.utime(episode, ns=(1_000_000_000, 1_000_000_000))
+    cache.store('key', str(episode))
+
+    assert cache.fetch('key', str(tmp_path / 'other.mp3'))
+    assert os.stat(episode).st_mtime_ns == 1_000_000_000
+
+
+def test_least_recently_fetched_entry_is_evicted(tmp_path):
+    cache = TTSCache(str(tmp_path / 'cache'), max_bytes=10)
+    for key in ('a', 'b'):
+        write(tmp_path / f'{key}.mp3', b'12345')
+        cache.store(key, str(tmp_path / f'{key}.mp3'))
+
+    assert cache.fetch('a', str(tmp_path / 'out.mp3'))
+    write(tmp_path / 'c.mp3', b'12345')
+    cache.store('c', str(tmp_path / 'c.mp3'))
+
+    assert not cache.fetch('b', str(tmp_path / 'out.mp3'))
+    assert cache.fetch('a', str(tmp_path / 'out.mp3'))
+    assert cache.stats()['evictions'] == 1